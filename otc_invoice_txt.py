@@ -1,9 +1,10 @@
 import os
 import json
 
+from tango_records import iter_records, rebuild_index, append_lock, rewrite_lock, atomic_write, SEPARATOR_LINE
+
 # ---------------- CONFIG ----------------
 INVOICE_ALL_OUTPUT_FILE = r""   # PUT YOUR TXT FILE PATH HERE
-SEPARATOR_LINE = "-" * 80
 # ----------------------------------------
 
 
@@ -11,45 +12,25 @@ def clean_invoice_output(file_path):
     if not os.path.isfile(file_path):
         raise FileNotFoundError(f"File not found: {file_path}")
 
-    with open(file_path, "r", encoding="utf-8") as f:
-        lines = f.readlines()
-
-    json_blocks = []
-    buffer = []
-    brace_count = 0
-
-    for line in lines:
-        # Skip separator lines completely
-        if line.strip() == SEPARATOR_LINE:
-            continue
-
-        for char in line:
-            if char == "{":
-                brace_count += 1
-            if brace_count > 0:
-                buffer.append(char)
-            if char == "}":
-                brace_count -= 1
-                if brace_count == 0:
-                    json_blocks.append("".join(buffer))
-                    buffer = []
-
-    latest_invoices = {}
-
-    for block in json_blocks:
-        try:
-            data = json.loads(block)
-            invoice_no = data["invoice"]["invoice_number"]
-            # Last occurrence wins
-            latest_invoices[invoice_no] = data
-        except Exception as e:
-            print("Skipped invalid JSON block:", e)
-
-    with open(file_path, "w", encoding="utf-8") as f:
-        for invoice in latest_invoices.values():
-            f.write(SEPARATOR_LINE + "\n")
-            f.write(json.dumps(invoice, indent=2))
-            f.write("\n\n")
+    # Readers finish first; extractor appends wait until the rewrite is done
+    with rewrite_lock(file_path), append_lock(file_path):
+        latest_invoices = {}
+
+        for data in iter_records(file_path):
+            try:
+                invoice_no = data["invoice"]["invoice_number"]
+                # Last occurrence wins
+                latest_invoices[invoice_no] = data
+            except Exception as e:
+                print("Skipped invalid JSON block:", e)
+
+        with atomic_write(file_path) as f:
+            for invoice in latest_invoices.values():
+                f.write(SEPARATOR_LINE + "\n")
+                f.write(json.dumps(invoice, indent=2))
+                f.write("\n\n")
+
+        rebuild_index(file_path)
 
     print(
         "Cleanup completed successfully\n"
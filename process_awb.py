@@ -1,33 +1,28 @@
 # 11-03-2026
 import os
 import sys
+import asyncio
+import re
 import json
 import base64
 import fitz  # PyMuPDF
-from io import BytesIO
+import inspect
 from datetime import datetime
-from typing import Optional, List, Union
+from functools import lru_cache
+from typing import Optional, List, Tuple, Union
 
-from pydantic import BaseModel
-import cv2
-import numpy as np
-from PIL import Image
+from pydantic import BaseModel, create_model
+from pydantic_core import PydanticUndefined
 
-import pytesseract
-# changed path for POC PC
-# pytesseract.pytesseract.tesseract_cmd = r"C:\Coding\Tesseract OCR\tesseract.exe"
-pytesseract.pytesseract.tesseract_cmd = r"C:\CODING\Tesseract OCR\tesseract.exe"
+from tango_records import append_record
 
 # ---------------------------
-# LangChain
+# Heavy dependencies (imported on first use)
 # ---------------------------
-from langchain.prompts import ChatPromptTemplate
-from langchain.output_parsers import PydanticOutputParser
-from langchain.schema import BaseCache, ChatGeneration, ChatResult, SystemMessage, HumanMessage, AIMessage
-from langchain.chat_models.base import BaseChatModel
-from langchain.callbacks.base import Callbacks
-from langchain_google_genai import ChatGoogleGenerativeAI
-
+# langchain + the Gemini client are only needed once a document goes to the
+# model (cv2 + pytesseract only for scanned pages, see tango_ocr.py);
+# importing them up front made every start pay for all of them
+# (python tango_startup.py shows the budget).
 
 # ---------------------------
 # Gemini Nexus (NEW)
@@ -41,8 +36,15 @@ from langchain_google_genai import ChatGoogleGenerativeAI
 from dotenv import load_dotenv
 load_dotenv()
 
+from tango_db import already_stored, use_sqlite, TangoStore, DB_PATH
+import tango_cache
+import tango_ocr
+from tango_fastpath import preextract_awb, FASTPATH_VERSION
+from tango_templates import TemplateStore, template_signature
+
 NEXUS_BASE_URL = "https://genai-nexus.int.api.corpinter.net"
 NEXUS_API_KEY = os.getenv("NEXUS_API_KEY")
+LLM_MODEL = "gemini-2.5-pro"
 
 # Output paths
 # AWB_JSON_FOLDER = r"C:\Users\SONIARN\OneDrive - Mercedes-Benz (corpdir.onmicrosoft.com)\DWT_TANGO - Documents\AWB\Processed"
@@ -91,36 +93,19 @@ class AirwayBill(BaseModel):
     executed_on_date: Optional[str] = ""
     other_reference_numbers: Optional[List[str]] = []
 
-awb_parser = PydanticOutputParser(pydantic_object=AirwayBill)
+@lru_cache(maxsize=None)
+def get_awb_parser():
+    from langchain.output_parsers import PydanticOutputParser
+    return PydanticOutputParser(pydantic_object=AirwayBill)
 
 # NexusGeminiChat.model_rebuild()
 
 # ----------------------------------------
 # 3. Helper Functions
 # ----------------------------------------
-def extract_text_from_pdf_bytes(pdf_bytes: BytesIO): # BytesIO (an in-memory byte stream)
-    """Extract text using PyMuPDF; if pure image PDF, returns None."""
-    # try & except, so the entire operation is wrapped in error handling to prevent program from crashing
-    try:
-        pdf_bytes.seek(0) # Moves the "cursor" of the BytesIO object back to beginning. w/o this, .read() might return empty data.
-        data = pdf_bytes.read()
-        doc = fitz.open(stream=data, filetype="pdf")
-        '''
-        fitz.open() creates a PDF document object
-        stream = data tells PyMuPDF to open from bytes (not a file path)
-        filetype="pdf" tells PyMuPDF to expect a PDF file
-
-        doc now represents the enitire PDF document.
-        '''
-        text = ""
-        for page in doc:
-            t = page.get_text().strip()
-            if t:
-                text += t + "\n"
-        doc.close()
-        return text.strip() if text.strip() else None
-    except:
-        return None
+def open_pdf(data: bytes):
+    """One fitz document over the PDF bytes (no copy), shared by text probing, layout and OCR."""
+    return fitz.open(stream=data, filetype="pdf")
 
 
 def clean_awb_text(text):
@@ -132,74 +117,12 @@ def clean_awb_text(text):
     print("AWB text cleaned.\n")
     return cleaned
 
-def pdf_to_image_path(pdf_bytes):
-    """Convert first page of PDF to high-resolution PNG file (300 DPI)."""
-    if hasattr(pdf_bytes, "seek"):
-        pdf_bytes.seek(0)
-
-    data = pdf_bytes.read()
-    doc = fitz.open(stream=data, filetype="pdf")
-
-    if doc.page_count == 0:
-        raise ValueError("PDF has no pages")
-
-    page = doc.load_page(0)
-
-    # 🔥 300 DPI rendering (major improvement)
-    zoom = 300 / 72
-    matrix = fitz.Matrix(zoom, zoom)
-    pix = page.get_pixmap(matrix=matrix)
-
-    image_path = "temp_awb_page.png"
-    pix.save(image_path)
-
-    doc.close()
-    return image_path
-
-
-def ocr_first_page_from_pdf(pdf_bytes: BytesIO) -> str:
-    """
-    Perform OCR on the FIRST PAGE ONLY of a scanned PDF.
-    Uses 300 DPI rendering + adaptive thresholding.
-    """
-    image_path = pdf_to_image_path(pdf_bytes)
-
-    try:
-        img = cv2.imread(image_path)
-
-        # Convert to grayscale
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-
-        # 🔥 Adaptive Thresholding (major improvement)
-        thresh = cv2.adaptiveThreshold(
-            gray,
-            255,
-            cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-            cv2.THRESH_BINARY,
-            31,   # block size
-            2     # constant subtracted from mean
-        )
-
-        # OCR config optimized for structured documents
-        custom_config = r'--oem 3 --psm 6'
-
-        text = pytesseract.image_to_string(
-            thresh,
-            lang="eng",
-            config=custom_config
-        )
-
-        return text.strip()
-
-    finally:
-        if os.path.exists(image_path):
-            os.remove(image_path)
-
-
 # ----------------------------------------
 # 3. Build Prompt
 # ----------------------------------------
 def build_prompt():
+    from langchain.prompts import ChatPromptTemplate
+
     return ChatPromptTemplate.from_messages([
     ("system",
         """You are a strict logistics document extraction engine.
@@ -322,13 +245,25 @@ def build_prompt():
             """)
         ])
 
-llm = ChatGoogleGenerativeAI(
-    model="gemini-2.5-pro",
-    google_api_key=NEXUS_API_KEY,
-    client_options={"api_endpoint": NEXUS_BASE_URL},
-    transport="rest",
-    temperature=0,
-)
+@lru_cache(maxsize=None)
+def get_llm():
+    """Gemini client, built once per process on first use."""
+    from langchain_google_genai import ChatGoogleGenerativeAI
+
+    return ChatGoogleGenerativeAI(
+        model=LLM_MODEL,
+        google_api_key=NEXUS_API_KEY,
+        client_options={"api_endpoint": NEXUS_BASE_URL},
+        transport="rest",
+        temperature=0,
+    )
+
+
+def preload():
+    """Import everything a file may need now (long-lived watcher workers call this once at start)."""
+    tango_ocr.ocr_modules()
+    get_llm()
+    get_awb_parser()
 
 # ----------------------------------------
 # 5. Model Runner
@@ -338,92 +273,294 @@ llm = ChatGoogleGenerativeAI(
 #     chain = prompt | llm | awb_parser
 #     return chain.invoke({"awb_text": awb_text})
 def run_model(prompt, awb_text: str):
-    chain = prompt | llm | awb_parser
+    chain = prompt | get_llm() | get_awb_parser()
     return chain.invoke({"awb_text": awb_text})
 
 
+# ----------------------------------------
+# 5b. Fast path: regex fields + a smaller model call for the rest
+# ----------------------------------------
+FIELD_RULE_RE = re.compile(r"^- ([a-z_]+(?: / [a-z_]+)*):")
+
+
+TEMPLATES = TemplateStore()
+
+
+def _field_kind(annotation) -> str:
+    if annotation in (int, float):
+        return annotation.__name__
+    return "list" if "List" in str(annotation) else "str"
+
+
+FIELD_KINDS = {f: _field_kind(info.annotation) for f, info in AirwayBill.model_fields.items()}
+
+
+def awb_layout(doc):
+    """(words, page size) of the first page, for the layout templates; None for scans."""
+    try:
+        page = doc.load_page(0)
+        words = page.get_text("words")
+        size = (page.rect.width, page.rect.height)
+    except Exception:
+        return None
+    return (words, size) if words else None
+
+
+def split_fields(awb_text: str, layout=None):
+    """(fields read by tango_fastpath / a layout template, names still needed from the model)."""
+    known = preextract_awb(awb_text)
+
+    if layout:
+        template_id, values = TEMPLATES.extract(layout[0], layout[1], FIELD_KINDS)
+        if values is None:
+            print(f"⚠ Layout template {template_id} did not validate → not used")
+        elif values:
+            clash = [f for f in values if f in known and values[f] != known[f]]
+            if clash:
+                print(f"⚠ Layout template {template_id} disagrees with the text on {', '.join(clash)} → not used")
+            else:
+                print(f"✓ Layout template {template_id}: {len(values)} fields read from word positions")
+                known = {**values, **known}
+
+    missing = tuple(f for f in AirwayBill.model_fields if f not in known)
+    return known, missing
+
+
+def learn_layout(layout, output: AirwayBill, fields):
+    """Teach the layout templates where this AWB's values are printed: only `fields`, the ones the model read."""
+    if not layout:
+        return
+    data = output.model_dump()
+    try:
+        TEMPLATES.learn(layout[0], layout[1], {f: data[f] for f in fields}, FIELD_KINDS)
+    except Exception as e:
+        print(f"[WARN] Layout template not updated: {e}")
+
+
+def residual_rules(fields) -> str:
+    """build_prompt's general rules + the FIELD RULES lines for `fields` (no few-shot example)."""
+    system = build_prompt().messages[0].prompt.template
+    head, _, rules = system.partition("FIELD RULES:")
+    rules = rules.split("--- FEW-SHOT EXAMPLES ---")[0]
+
+    keep, current = [], False
+    for line in rules.splitlines():
+        line = line.strip()
+        m = FIELD_RULE_RE.match(line)
+        if m:
+            current = bool(set(m.group(1).split(" / ")) & set(fields))
+        elif not line or line.isupper():
+            current = False  # blank line or section header (PARTIES, INVOICES, ...)
+        if current:
+            keep.append(line)
+
+    head = "\n".join(line.strip() for line in head.strip().splitlines())
+    return head + "\n\nFIELD RULES:\n" + "\n".join(keep)
+
+
+def _placeholder(field: str):
+    info = AirwayBill.model_fields[field]
+    if info.default is not PydanticUndefined:
+        return info.default if info.default is not None else ""
+    return 0 if info.annotation in (int, float) else ""
+
+
+@lru_cache(maxsize=None)
+def _residual_chain(fields: tuple):
+    from langchain.prompts import ChatPromptTemplate
+    from langchain.output_parsers import PydanticOutputParser
+
+    residual_model = create_model(
+        "AirwayBillFields",
+        **{f: (AirwayBill.model_fields[f].annotation, AirwayBill.model_fields[f]) for f in fields}
+    )
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", "{rules}"),
+        ("human", "AWB TEXT:\n{awb_text}\n\nReturn ONLY JSON in this schema:\n{schema}")
+    ])
+    inputs = {
+        "rules": residual_rules(fields),
+        "schema": json.dumps({f: _placeholder(f) for f in fields}, indent=2)
+    }
+    return prompt | get_llm() | PydanticOutputParser(pydantic_object=residual_model), inputs
+
+
+def extract_fields(prompt, awb_text: str, layout=None) -> AirwayBill:
+    """run_model, minus whatever the regex fast path / a layout template already read."""
+    known, missing = split_fields(awb_text, layout)
+    if not missing:
+        print("✓ Fast path: every field read without Gemini")
+        return AirwayBill(**known)
+
+    if not known:
+        print("✓ Text detected → Gemini extraction")
+        output = run_model(prompt, awb_text)
+    else:
+        print(f"✓ Fast path: {', '.join(known)} read directly → Gemini asked for {len(missing)} fields")
+        chain, inputs = _residual_chain(missing)
+        residual = chain.invoke({"awb_text": awb_text, **inputs})
+        output = AirwayBill(**{**residual.model_dump(), **known})
+
+    learn_layout(layout, output, missing)
+    return output
+
+
+async def aextract_fields(prompt, awb_text: str, layout=None) -> AirwayBill:
+    known, missing = split_fields(awb_text, layout)
+    if not missing:
+        return AirwayBill(**known)
+
+    if not known:
+        chain = prompt | get_llm() | get_awb_parser()
+        output = await chain.ainvoke({"awb_text": awb_text})
+    else:
+        chain, inputs = _residual_chain(missing)
+        residual = await chain.ainvoke({"awb_text": awb_text, **inputs})
+        output = AirwayBill(**{**residual.model_dump(), **known})
+
+    # The template file is updated under a lock; keep that off the event loop
+    await asyncio.to_thread(learn_layout, layout, output, missing)
+    return output
+
 
 # ----------------------------------------
 # 6. Save JSON
 # ----------------------------------------
-def save_awb_json_combined(data: dict, source_file: str = ""):
+def save_awb_json_combined(data: dict, source_file: str = "", replay: bool = False):
+    """`replay`: a cached result; not stored again if this file's newest record already holds it."""
     os.makedirs(os.path.dirname(AWB_COMBINED_OUTPUT), exist_ok=True)
     entry = {
         "_source_file": os.path.abspath(source_file),
         "_timestamp": datetime.now().isoformat(),
         "awb": data
     }
-    with open(AWB_COMBINED_OUTPUT, "a", encoding="utf-8") as f:
-        f.write("\n" + "-" * 80 + "\n")
-        json.dump(entry, f, indent=2, ensure_ascii=False)
+    if replay and already_stored(entry, AWB_COMBINED_OUTPUT):
+        print("✓ Same result already stored for this file → not appended again")
+        return
+
+    if use_sqlite():
+        with TangoStore() as store:
+            store.add_awb(entry)
+        print(f"✔ AWB stored in: {DB_PATH}")
+        return
+
+    # Appends the record and its line in the sidecar index (awb_all_output.txt.idx)
+    append_record(AWB_COMBINED_OUTPUT, entry)
     print(f"✔ AWB appended to: {AWB_COMBINED_OUTPUT}")
 
 # ----------------------------------------
 # 7. AWB Extraction Pipeline
 # ----------------------------------------
-def extract_awb(pdf_path: str):
+def awb_text_from_doc(doc, data: bytes) -> str:
+    # 🧠 Per page: text layer where there is one, OCR (in parallel) for scanned pages
+    text = "\n".join(t for t in tango_ocr.page_texts(doc, data, "awb") if t)
+    if not text:
+        raise RuntimeError("OCR failed — no text extracted from scanned PDF")
+
+    return clean_awb_text(text)
+
+
+# ----------------------------------------
+# Extraction cache (re-dropped PDFs skip OCR + Gemini)
+# ----------------------------------------
+@lru_cache(maxsize=None)
+def cache_version() -> str:
+    return tango_cache.extraction_version(
+        inspect.getsource(build_prompt),
+        json.dumps(AirwayBill.model_json_schema(), sort_keys=True),
+        LLM_MODEL,
+        FASTPATH_VERSION,
+        template_signature(),
+        tango_ocr.OCR_VERSION
+    )
+
+
+def cached_extraction(digest: str) -> Optional[AirwayBill]:
+    data = tango_cache.lookup("awb", digest, cache_version())
+    if data is None:
+        return None
+    print("✓ Same PDF extracted before → cached result, no OCR / Gemini call")
+    return AirwayBill.model_validate(data)
+
+
+def remember_extraction(digest: str, output: AirwayBill):
+    tango_cache.remember("awb", digest, cache_version(), output.model_dump())
+
+
+def read_awb_document(data: bytes):
+    """(cleaned text, word layout) from one open document."""
+    with open_pdf(data) as doc:
+        return awb_text_from_doc(doc, data), awb_layout(doc)
+
+
+def extract_awb(pdf_path: str) -> Tuple[Optional[AirwayBill], bool]:
+    """(output, True when it came from the extraction cache)."""
     with open(pdf_path, "rb") as f:
-        file_bytes = BytesIO(f.read())
+        data = f.read()
+
+    digest = tango_cache.pdf_digest(data)
+    cached = cached_extraction(digest)
+    if cached is not None:
+        return cached, True
 
     prompt = build_prompt()
 
-    text = extract_text_from_pdf_bytes(file_bytes)
-    # 🧠 If no text → scanned PDF → OCR FIRST PAGE
-    if not text:
-        print("⚠ No embedded text detected — performing OCR on first page")
-        ocr_text = ocr_first_page_from_pdf(file_bytes)
+    cleaned, layout = read_awb_document(data)
+    output = extract_fields(prompt, cleaned, layout)
+    remember_extraction(digest, output)
+    return output, False
+
 
-        if not ocr_text:
-            raise RuntimeError("OCR failed — no text extracted from scanned PDF")
+def store_extraction(output, input_file: str, replay: bool = False):
+    """Classify a parsed AWB and append it to the combined output (`replay`: see save_awb_json_combined)."""
+    # Convert Pydantic model to dictionary
+    data = output.model_dump()
 
-        text = ocr_text
+    from tango_classifier import DocumentClassifier
 
-    cleaned = clean_awb_text(text)
-    print("✓ Text detected → Gemini extraction")
-    return run_model(prompt, cleaned)
+    classifier = DocumentClassifier()
+    data["classification"] = classifier.classify(data)
+
+    # Save JSON line into combined AWB file
+    save_awb_json_combined(data, input_file, replay)
 
 
 # ----------------------------------------
-# 7. MAIN USED BY WATCHER
+# BULK MODE (tango_bulk.py)
 # ----------------------------------------
-def main():
-    if len(sys.argv) < 3:
-        print("Usage: python process_awb.py <inputfile> <processed_folder>")
-        sys.exit(1)
+def document_text(pdf_path: str):
+    """(cleaned text or first-page OCR, word layout) of one AWB: the CPU-bound half of extract_awb."""
+    with open(pdf_path, "rb") as f:
+        return read_awb_document(f.read())
+
+
+async def aextract_text(document):
+    """Same as extract_fields, awaited."""
+    text, layout = document
+    return await aextract_fields(build_prompt(), text, layout)
 
-    input_file = sys.argv[1]
-    processed_folder = sys.argv[2]
 
+# ----------------------------------------
+# 7. ENTRY POINTS USED BY WATCHER
+# ----------------------------------------
+def process_file(input_file: str, processed_folder: str) -> bool:
+    """Extract, classify and store one AWB, then move it to `processed_folder`. Returns success."""
     print(f"\n--- Processing AWB: {input_file} ---")
 
     try:
-        output = extract_awb(input_file)
+        output, cached = extract_awb(input_file)
 
         if output is None:
             print("[ERROR] extract_awb() returned None → cannot continue.")
-            return
-
-        # Convert Pydantic model to dictionary
-        data = output.model_dump()
+            return False
 
-        from tango_classifier import DocumentClassifier
-
-        classifier = DocumentClassifier()
-        data["classification"] = classifier.classify(data)
-
-        # Safety check — data must be a dict
-        if not isinstance(data, dict):
-            print("[ERROR] Parsed AWB data is not a dictionary.")
-            return
-
-        # Save JSON line into combined AWB file
-        save_awb_json_combined(data, input_file) # need to add source file path here!!!
+        store_extraction(output, input_file, replay=cached)
 
     except Exception as e:
         print(f"[AWB] Error processing file: {e}")
         import traceback
         traceback.print_exc()
-        return
+        return False
 
     # Move processed file only after success
     try:
@@ -435,6 +572,22 @@ def main():
         print(f"[ERROR] Failed to move processed file: {e}")
 
     print("✔ AWB extraction finished.\n")
+    return True
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--bulk":
+        # python process_awb.py --bulk <input_dir> <processed_folder> [--concurrency N] [--rpm N]
+        from tango_bulk import main as bulk_main
+        sys.exit(bulk_main(["awb"] + sys.argv[2:]))
+
+    if len(sys.argv) < 3:
+        print("Usage: python process_awb.py <inputfile> <processed_folder>")
+        print("       python process_awb.py --bulk <input_dir> <processed_folder> [--concurrency N] [--rpm N]")
+        sys.exit(1)
+
+    # Non-zero exit so the watcher's subprocess mode sees the failure
+    sys.exit(0 if process_file(sys.argv[1], sys.argv[2]) else 1)
 
 
 
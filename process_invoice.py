@@ -3,25 +3,31 @@ import os
 import sys
 import json
 import fitz
+import inspect
 from io import BytesIO
 from datetime import datetime
+from functools import lru_cache
 from pydantic import BaseModel
-from typing import Optional, Dict, Any, List, Union
+from typing import Optional, Dict, Any, List, Tuple, Union
 
-from langchain.prompts import ChatPromptTemplate
-from langchain.output_parsers import PydanticOutputParser
-
-# ✅ NEW — same as process_awb.py
-from langchain_google_genai import ChatGoogleGenerativeAI
+# langchain + the Gemini client are imported on first use (see get_llm),
+# same as process_awb.py
 
 from dotenv import load_dotenv
 load_dotenv()
 
+from tango_records import append_record
+from tango_db import already_stored, use_sqlite, TangoStore, DB_PATH
+import tango_cache
+import tango_ocr
+from tango_pages import select_pages, selection_signature
+
 # ---------------------------------------------------
 # CONFIG
 # ---------------------------------------------------
 NEXUS_BASE_URL = "https://genai-nexus.int.api.corpinter.net"
 NEXUS_API_KEY = os.getenv("NEXUS_API_KEY")
+LLM_MODEL = "gemini-2.5-pro"
 
 INVOICE_JSON_FOLDER = r"C:\Users\HEKOLLI\OneDrive - Mercedes-Benz (corpdir.onmicrosoft.com)\DWT_TANGO - Documents\Invoice\Processed"
 INVOICE_COMBINED_OUTPUT = r"C:\Users\HEKOLLI\OneDrive - Mercedes-Benz (corpdir.onmicrosoft.com)\DWT_TANGO - Documents\invoice_all_output.txt"
@@ -57,18 +63,33 @@ class Invoice(BaseModel):
  
     other_fields: Optional[Dict[str, Any]] = {}
 
-invoice_parser = PydanticOutputParser(pydantic_object=Invoice)
+@lru_cache(maxsize=None)
+def get_invoice_parser():
+    from langchain.output_parsers import PydanticOutputParser
+    return PydanticOutputParser(pydantic_object=Invoice)
 
 # ---------------------------------------------------
 # 2. Gemini model (SAME STYLE AS AWB)
 # ---------------------------------------------------
-llm = ChatGoogleGenerativeAI(
-    model="gemini-2.5-pro",
-    google_api_key=NEXUS_API_KEY,
-    client_options={"api_endpoint": NEXUS_BASE_URL},
-    transport="rest",
-    temperature=0,
-)
+@lru_cache(maxsize=None)
+def get_llm():
+    """Gemini client, built once per process on first use."""
+    from langchain_google_genai import ChatGoogleGenerativeAI
+
+    return ChatGoogleGenerativeAI(
+        model=LLM_MODEL,
+        google_api_key=NEXUS_API_KEY,
+        client_options={"api_endpoint": NEXUS_BASE_URL},
+        transport="rest",
+        temperature=0,
+    )
+
+
+def preload():
+    """Import everything a file may need now (long-lived watcher workers call this once at start)."""
+    tango_ocr.ocr_modules()
+    get_llm()
+    get_invoice_parser()
 
 # ---------------------------------------------------
 # 3. Helper functions
@@ -84,26 +105,33 @@ def clean_inv_text(text: str) -> str:
 # ---------------------------------------------------
 # 3. Invoice extraction
 # ---------------------------------------------------
-def extract_invoice_from_bytes(file_bytes: BytesIO) -> Invoice:
+def invoice_text_from_bytes(file_bytes: BytesIO) -> str:
     file_bytes.seek(0)
-    doc = fitz.open("pdf", file_bytes.read())
+    data = file_bytes.read()
+
+    # Per page: text layer where there is one, OCR (in parallel) for scanned pages
+    with fitz.open("pdf", data) as doc:
+        pages_text = [clean_inv_text(raw) for raw in tango_ocr.page_texts(doc, data, "invoice")]
+
+    # Long invoices: page 1 + the pages that cover the schema, not the whole annex
+    kept, report = select_pages(pages_text)
+    if report["tokens_saved"]:
+        print(f"✓ Page selection ({report['scorer']}): sending pages {[p + 1 for p in kept]} of {report['pages']}, "
+              f"~{report['tokens_saved']} of {report['tokens_before']} tokens saved")
 
-    pages_text = []
-    for page in doc:
-        raw = page.get_text()
-        cleaned = clean_inv_text(raw)
-        pages_text.append(cleaned)
+    return "\n\n".join(pages_text[p] for p in kept)
 
-    combined_text = "\n\n".join(pages_text)
 
-    # ---------------------------------------------------
-    # PROMPT — EXACT, UNCHANGED FROM inv_data_ext.py
-    # ---------------------------------------------------
-    def build_invoice_prompt():
-        return ChatPromptTemplate.from_messages([
+# ---------------------------------------------------
+# PROMPT — EXACT, UNCHANGED FROM inv_data_ext.py
+# ---------------------------------------------------
+def build_invoice_prompt():
+    from langchain.prompts import ChatPromptTemplate
+
+    return ChatPromptTemplate.from_messages([
         (
-        "system",
-        """You are a strict invoice data extraction engine.
+            "system",
+            """You are a strict invoice data extraction engine.
     
         Extract ONLY explicitly stated values from the provided invoice text.
         Do NOT infer, assume, calculate, or guess.
@@ -208,8 +236,8 @@ def extract_invoice_from_bytes(file_bytes: BytesIO) -> Invoice:
         """
         ),
         (
-        "human",
-        """
+            "human",
+            """
         Invoice Text (all pages combined):
         {page_text}
     
@@ -219,41 +247,98 @@ def extract_invoice_from_bytes(file_bytes: BytesIO) -> Invoice:
         )
     ])
 
-    # ---------------------------------------------------
-    # Model
-    # ---------------------------------------------------
-    def run_invoice_model(prompt, combined_text: str):
-        chain = prompt | llm | invoice_parser
-        return chain.invoke({
-            "page_text": combined_text,
-            "schema": invoice_parser.get_format_instructions()
-        })
 
-    prompt = build_invoice_prompt()
-    structured = run_invoice_model(prompt, combined_text)
+# ---------------------------------------------------
+# Model
+# ---------------------------------------------------
+def _invoice_chain():
+    invoice_parser = get_invoice_parser()
+    chain = build_invoice_prompt() | get_llm() | invoice_parser
+    return chain, {"schema": invoice_parser.get_format_instructions()}
+
+
+def run_invoice_model(combined_text: str):
+    chain, inputs = _invoice_chain()
+    return chain.invoke({"page_text": combined_text, **inputs})
+
+
+async def arun_invoice_model(combined_text: str):
+    chain, inputs = _invoice_chain()
+    return await chain.ainvoke({"page_text": combined_text, **inputs})
+
+
+# ---------------------------------------------------
+# Extraction cache (re-dropped PDFs skip the Gemini call)
+# ---------------------------------------------------
+def cache_version() -> str:
+    # Not cached as a whole: the page scorer can fall back to keywords mid-run
+    return _cache_version(selection_signature())
+
+
+@lru_cache(maxsize=None)
+def _cache_version(selection: str) -> str:
+    return tango_cache.extraction_version(
+        inspect.getsource(build_invoice_prompt),
+        json.dumps(Invoice.model_json_schema(), sort_keys=True),
+        LLM_MODEL,
+        selection,
+        tango_ocr.OCR_VERSION
+    )
+
+
+def cached_extraction(digest: str) -> Optional[Invoice]:
+    data = tango_cache.lookup("invoice", digest, cache_version())
+    if data is None:
+        return None
+    print("✓ Same PDF extracted before → cached result, no Gemini call")
+    return Invoice.model_validate(data)
+
+
+def remember_extraction(digest: str, result: Invoice):
+    tango_cache.remember("invoice", digest, cache_version(), result.model_dump())
+
+
+def extract_invoice_from_bytes(file_bytes: BytesIO) -> Tuple[Invoice, bool]:
+    """(invoice, True when it came from the extraction cache)."""
+    file_bytes.seek(0)
+    digest = tango_cache.pdf_digest(file_bytes.read())
+    cached = cached_extraction(digest)
+    if cached is not None:
+        return cached, True
+
+    combined_text = invoice_text_from_bytes(file_bytes)
+    structured = run_invoice_model(combined_text)
+    remember_extraction(digest, structured)
 
     print("\nInvoice extracted successfully.\n")
-    return structured
+    return structured, False
 
 
 # ---------------------------------------------------
 # 4. Save JSON
 # ---------------------------------------------------
-def save_invoice_json_combined(data: dict, source_file: str = ""):
+def save_invoice_json_combined(data: dict, source_file: str = "", replay: bool = False):
+    """`replay`: a cached result; not stored again if this file's newest record already holds it."""
     os.makedirs(os.path.dirname(INVOICE_COMBINED_OUTPUT), exist_ok=True)
 
-    separator = "\n" + ("-" * 80) + "\n"  # distinguish from AWB separator
-
     entry = {
         "_source_file": os.path.abspath(source_file),
         "_timestamp": datetime.now().isoformat(),
         "invoice": data
     }
 
-    with open(INVOICE_COMBINED_OUTPUT, "a", encoding="utf-8") as f:
-        f.write(separator)
-        f.write(json.dumps(entry, ensure_ascii=False, indent=2))
-        f.write("\n")
+    if replay and already_stored(entry, INVOICE_COMBINED_OUTPUT):
+        print("✓ Same result already stored for this file → not appended again")
+        return
+
+    if use_sqlite():
+        with TangoStore() as store:
+            store.add_invoice(entry)
+        print(f"✔ Invoice stored in: {DB_PATH}")
+        return
+
+    # Appends the record and its line in the sidecar index (invoice_all_output.txt.idx)
+    append_record(INVOICE_COMBINED_OUTPUT, entry)
 
     print(f"✔ Invoice appended to: {INVOICE_COMBINED_OUTPUT}")
 
@@ -267,37 +352,75 @@ def extract_from_pdf(pdf_path: str) -> dict:
     with open(pdf_path, "rb") as f:
         file_bytes = BytesIO(f.read())
 
-    result = extract_invoice_from_bytes(file_bytes)
+    result, cached = extract_invoice_from_bytes(file_bytes)
+    return store_extraction(result, pdf_path, replay=cached)
+
 
+def store_extraction(result: Invoice, pdf_path: str, replay: bool = False) -> dict:
     data_dict = result.model_dump()
     base_name = os.path.splitext(os.path.basename(pdf_path))[0]
     # save_invoice_json(data_dict, base_name)
-    save_invoice_json_combined(data_dict, pdf_path)
+    save_invoice_json_combined(data_dict, pdf_path, replay)
 
     return data_dict
 
 
 # ---------------------------------------------------
-# 6. ENTRY POINT for watch_dwt_tango.py
+# BULK MODE (tango_bulk.py)
 # ---------------------------------------------------
-def main():
-    if len(sys.argv) < 3:
-        print("Usage: python process_invoice.py <input_file> <processed_folder>")
-        sys.exit(1)
+def document_text(pdf_path: str) -> str:
+    """Cleaned text of all pages (the CPU-bound half of extract_invoice_from_bytes)."""
+    with open(pdf_path, "rb") as f:
+        return invoice_text_from_bytes(BytesIO(f.read()))
 
-    input_file = sys.argv[1]
-    processed_folder = sys.argv[2]
 
-    print(f"\n--- Processing Invoice: {input_file} ---")
+async def aextract_text(text: str) -> Invoice:
+    result = await arun_invoice_model(text)
+    print("\nInvoice extracted successfully.\n")
+    return result
 
-    extract_from_pdf(input_file)
 
-    os.makedirs(processed_folder, exist_ok=True)
-    dest = os.path.join(processed_folder, os.path.basename(input_file))
-    os.replace(input_file, dest)
+# ---------------------------------------------------
+# 6. ENTRY POINTS for watch_dwt_tango.py
+# ---------------------------------------------------
+def process_file(input_file: str, processed_folder: str) -> bool:
+    """Extract and store one invoice, then move it to `processed_folder`. Returns success."""
+    print(f"\n--- Processing Invoice: {input_file} ---")
+
+    try:
+        extract_from_pdf(input_file)
+    except Exception as e:
+        print(f"[INVOICE] Error processing file: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+    # Move processed file only after success
+    try:
+        os.makedirs(processed_folder, exist_ok=True)
+        dest = os.path.join(processed_folder, os.path.basename(input_file))
+        os.replace(input_file, dest)
+        print(f"✔ Invoice moved to processed folder: {dest}")
+    except Exception as e:
+        print(f"[ERROR] Failed to move processed file: {e}")
 
-    print(f"✔ Invoice moved to processed folder: {dest}")
     print("✔ Invoice extraction completed.\n")
+    return True
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--bulk":
+        # python process_invoice.py --bulk <input_dir> <processed_folder> [--concurrency N] [--rpm N]
+        from tango_bulk import main as bulk_main
+        sys.exit(bulk_main(["invoice"] + sys.argv[2:]))
+
+    if len(sys.argv) < 3:
+        print("Usage: python process_invoice.py <input_file> <processed_folder>")
+        print("       python process_invoice.py --bulk <input_dir> <processed_folder> [--concurrency N] [--rpm N]")
+        sys.exit(1)
+
+    # Non-zero exit so the watcher's subprocess mode sees the failure
+    sys.exit(0 if process_file(sys.argv[1], sys.argv[2]) else 1)
 
 
 if __name__ == "__main__":
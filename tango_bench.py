@@ -0,0 +1,408 @@
+# 17-10-2026
+"""
+Benchmark for the matching engine
+---------------------------------
+
+Generates synthetic AWB + invoice stores in the real separator-delimited
+format and runs them through the same phases as tango_match.main:
+
+    load     store_snapshot + iter_records
+    dedup    prepare_awbs / prepare_invoices + dedup_invoices
+    index    build_invoice_index
+    match    match_awbs (serial, or --workers N)
+    rematch  fuzzy invoice numbers + GROUP consolidation
+    write    write_match_outputs (json + txt report + log)
+
+Each phase reports wall time and peak traced memory (tracemalloc; timings
+include its overhead, use --no-memory for pure timings). Results can be
+stored as a baseline and later runs compared against it:
+
+    python tango_bench.py --sizes 1000 10000 --save-baseline bench_baseline.json
+    python tango_bench.py --sizes 1000 10000 --baseline bench_baseline.json
+
+Sizes are total records (AWBs + invoices). 100k and 1M are supported but
+take a while and need several GB of RAM.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import tempfile
+import time
+import tracemalloc
+from datetime import date, timedelta
+from typing import Any, Dict, List
+
+from tango_records import SEPARATOR_LINE, store_snapshot, iter_records
+import tango_match
+
+PHASES = ["load", "dedup", "index", "match", "rematch", "write"]
+
+# Invoice number prefixes per category (the BBAC / APAC ones are checked by the matchers)
+CATEGORY_PREFIXES = {
+    "MBAG Production Parts": "490",
+    "MBAG After Sales Parts": "106",
+    "MBAG CBU": "491",
+    "MBUSA CBU": "492",
+    "MBUSI": "550",
+    "BBAC Production Parts": "150",
+    "BBAC After Sales Parts": "1106",
+    "MB Parts Logistics APAC": "1100"
+}
+
+GROUP_CATEGORIES = set(tango_match.CONSOLIDATION_PREFIXES)
+CBU_CATEGORIES = {"MBAG CBU", "MBUSA CBU"}
+
+# Regression threshold for --baseline comparisons (fraction of the baseline)
+DEFAULT_TOLERANCE = 0.25
+
+
+# ============================================================================
+# SYNTHETIC DATA
+# ============================================================================
+
+class SyntheticData:
+    """
+    Deterministic (seeded) AWB / invoice records shaped like the extractor output:
+    SINGLE and GROUP shipments for every category, CBU VIN/order pairs,
+    European weight strings, re-extracted duplicates and unmatched noise.
+    """
+
+    def __init__(self, seed: int = 1):
+        self.r = random.Random(seed)
+        self.serial = 0
+        self.start = date(2026, 1, 1)
+
+    def _number(self, category):
+        self.serial += 1
+        prefix = CATEGORY_PREFIXES[category]
+        return prefix + str(self.serial).zfill(10 - len(prefix))
+
+    def _day(self):
+        return self.start + timedelta(days=self.r.randint(0, 365))
+
+    def _weight_text(self, w):
+        # Mostly plain numbers, some as the LLM sometimes returns them
+        roll = self.r.random()
+        if roll < 0.15:
+            whole, frac = f"{w:.2f}".split(".")
+            return f"{int(whole):,}".replace(",", ".") + "," + frac + " KG"
+        if roll < 0.25:
+            return f"{w:.2f} kg"
+        return round(w, 2)
+
+    def _invoice(self, category, pieces, weight, day, **extra):
+        inv = {
+            "invoice_number": self._number(category),
+            "invoice_date": day.strftime("%d-%m-%Y"),
+            "supplier_name": "Mercedes-Benz AG",
+            "supplier_address": "Mercedesstrasse 120, 70372 Stuttgart, Germany",
+            "consignee_name": f"Consignee {self.r.randint(1, 50)}",
+            "consignee_add": "Somewhere 1",
+            "no_pieces": pieces,
+            "gross_weight": weight,
+            "container_number": None,
+            "order_no": None,
+            "vin_no": None,
+            "currency": "EUR",
+            "total_price": round(self.r.uniform(100, 90000), 2),
+            "other_fields": {}
+        }
+        inv.update(extra)
+        return inv
+
+    def _awb(self, category, invoice_numbers, pieces, weight, day, **extra):
+        awb = {
+            "shipper_name": "Mercedes-Benz AG",
+            "shipper_add": "Stuttgart, Germany",
+            "consignee_name": "Consignee",
+            "consignee_add": "Somewhere 1",
+            "mawb": f"020-{self.r.randint(10**7, 10**8 - 1)}",
+            "hawb": f"FRA{self.r.randint(10**7, 10**8 - 1)}",
+            "container_number": "",
+            "invoice_numbers": invoice_numbers,
+            "origin_airport": "FRA",
+            "destination_airport": self.r.choice(["PEK", "ATL", "SIN", "JNB"]),
+            "no_pieces": pieces,
+            "gross_weight": weight,
+            "executed_on_date": day.strftime("%d.%m.%Y"),
+            "other_reference_numbers": [],
+            "classification": {
+                "country": "DE",
+                "category": category,
+                "requires_invoice": True,
+                "matched_rules": ["synthetic"]
+            }
+        }
+        awb.update(extra)
+        return awb
+
+    def shipment(self, category):
+        """One AWB and the invoices that belong to it."""
+        r = self.r
+        day = self._day()
+
+        if category in CBU_CATEGORIES:
+            vin = "W1ND" + "".join(r.choice("0123456789ABCDEFGHJKLMNPRSTUVWXYZ") for _ in range(13))
+            order = str(r.randint(10**9, 10**10 - 1))
+            inv = self._invoice(category, 1, round(r.uniform(1800, 3200), 1), day, vin_no=vin, order_no=order)
+            awb = self._awb(category, [], 1, inv["gross_weight"], day, vin_no=vin, order_no=order)
+            if category == "MBUSA CBU":
+                awb["shipper_add"] = "Mercedes-Benz USA, Atlanta, USA"
+            return awb, [inv]
+
+        group = category in GROUP_CATEGORIES and r.random() < 0.35
+        count = r.randint(2, 5) if group else 1
+
+        invoices = []
+        for _ in range(count):
+            pieces = r.randint(1, 12)
+            weight = round(r.uniform(2, 900), 2)
+            inv = self._invoice(category, pieces, weight, day - timedelta(days=r.randint(0, 20)))
+            if group:
+                inv["gross_weight"] = self._weight_text(weight)
+            invoices.append((inv, pieces, weight))
+
+        total_pieces = sum(p for _, p, _ in invoices)
+        total_weight = round(sum(w for _, _, w in invoices), 1)
+        awb = self._awb(category, [i["invoice_number"] for i, _, _ in invoices], total_pieces, total_weight, day)
+
+        if category == "MBUSI" and not group:
+            invoices[0][0]["container_number"] = awb["hawb"]
+        if category == "BBAC Production Parts" and not group:
+            invoices[0][0]["hawb"] = awb["hawb"]
+        if category == "MBAG Production Parts" and r.random() < 0.2:
+            awb["invoice_numbers"] = []  # matched on pieces/weight against every invoice
+
+        # OCR damage: a digit wrong or a number missing
+        roll = r.random()
+        if roll < 0.03 and awb["invoice_numbers"]:
+            n = awb["invoice_numbers"][0]
+            awb["invoice_numbers"][0] = n[:-1] + str((int(n[-1]) + 1) % 10)
+        elif roll < 0.06 and len(awb["invoice_numbers"]) > 1:
+            awb["invoice_numbers"].pop()
+
+        return awb, [i for i, _, _ in invoices]
+
+    def noise_invoice(self):
+        category = self.r.choice(list(CATEGORY_PREFIXES))
+        return self._invoice(category, self.r.randint(1, 12), round(self.r.uniform(2, 900), 2), self._day())
+
+    def generate(self, total: int):
+        """About `total` records: roughly one AWB per two invoices, with duplicates and noise."""
+        categories = list(tango_match.CATEGORY_MATCHERS)
+        awbs, invoices = [], []
+
+        while len(awbs) + len(invoices) < total:
+            awb, invs = self.shipment(self.r.choice(categories))
+            awbs.append(awb)
+            invoices.extend(invs)
+
+            if self.r.random() < 0.3:
+                invoices.append(self.noise_invoice())
+            if self.r.random() < 0.05:
+                invoices.append(dict(invs[0]))  # same document extracted twice
+            if self.r.random() < 0.02:
+                awbs.append(dict(awb))
+
+        return awbs, invoices
+
+
+def _entry(kind: str, k: int, record: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "_source_file": f"C:\\bench\\{kind}\\{kind}_{k:07d}.pdf",
+        "_timestamp": f"2026-10-17T00:00:00.{k:06d}",
+        kind: record
+    }
+
+
+def write_store(path: str, kind: str, records: List[Dict[str, Any]]):
+    # Same layout as tango_records.append_record, written in one go
+    with open(path, "w", encoding="utf-8") as f:
+        for k, record in enumerate(records):
+            f.write("\n" + SEPARATOR_LINE + "\n")
+            f.write(json.dumps(_entry(kind, k, record), ensure_ascii=False, indent=2))
+            f.write("\n")
+
+
+# ============================================================================
+# PHASE RUNNER
+# ============================================================================
+
+class PhaseTimer:
+    def __init__(self, memory: bool):
+        self.memory = memory
+        self.phases = {}
+
+    def run(self, name, fn, *args):
+        if self.memory:
+            tracemalloc.reset_peak()
+
+        start = time.perf_counter()
+        result = fn(*args)
+        seconds = time.perf_counter() - start
+
+        stats = {"seconds": round(seconds, 4)}
+        if self.memory:
+            stats["peak_mb"] = round(tracemalloc.get_traced_memory()[1] / 2**20, 2)
+
+        self.phases[name] = stats
+        print(f"   {name:<8} {seconds:9.3f} s" + (f"   peak {stats['peak_mb']:9.1f} MB" if self.memory else ""))
+        return result
+
+
+def _load(awb_path, inv_path):
+    with store_snapshot(awb_path, inv_path) as sizes:
+        return list(iter_records(awb_path, end=sizes[awb_path])), list(iter_records(inv_path, end=sizes[inv_path]))
+
+
+def _dedup(awbs, invoices):
+    return tango_match.prepare_awbs(awbs), tango_match.dedup_invoices(tango_match.prepare_invoices(invoices))
+
+
+def _rematch(results, awbs, invoices, index):
+    tango_match.fuzzy_rematch_unmatched(results, awbs, invoices, index)
+    tango_match.consolidate_unmatched_groups(results, awbs, invoices, index)
+    return results
+
+
+def run_size(total: int, workdir: str, seed: int, workers: int, memory: bool) -> Dict[str, Any]:
+    print(f"\n→ {total:,} records")
+
+    awb_records, invoice_records = SyntheticData(seed).generate(total)
+    awb_path = os.path.join(workdir, "awb_all_output.txt")
+    inv_path = os.path.join(workdir, "invoice_all_output.txt")
+    write_store(awb_path, "awb", awb_records)
+    write_store(inv_path, "invoice", invoice_records)
+    del awb_records, invoice_records
+
+    timer = PhaseTimer(memory)
+    if memory:
+        tracemalloc.start()
+
+    try:
+        awbs, invoices = timer.run("load", _load, awb_path, inv_path)
+        awbs, invoices = timer.run("dedup", _dedup, awbs, invoices)
+        index = timer.run("index", tango_match.build_invoice_index, invoices)
+        results = timer.run("match", tango_match.match_awbs, awbs, invoices, index, workers)
+        results = timer.run("rematch", _rematch, results, awbs, invoices, index)
+        timer.run("write", tango_match.write_match_outputs, results, workdir)
+    finally:
+        if memory:
+            tracemalloc.stop()
+
+    matched = sum(1 for r in results if r.get("matched_invoices"))
+    print(f"   ✔ {len(awbs):,} AWBs, {len(invoices):,} unique invoices, {matched:,} AWBs matched")
+
+    return {
+        "awbs": len(awbs),
+        "invoices": len(invoices),
+        "matched_awbs": matched,
+        "store_mb": round((os.path.getsize(awb_path) + os.path.getsize(inv_path)) / 2**20, 1),
+        "phases": timer.phases
+    }
+
+
+# ============================================================================
+# BASELINE COMPARISON
+# ============================================================================
+
+def compare_to_baseline(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Print phase-by-phase changes; return the regressions beyond `tolerance`."""
+    regressions = []
+
+    for size, current in report["sizes"].items():
+        base = baseline.get("sizes", {}).get(size)
+        if not base:
+            print(f"\n[WARN] No baseline for {size} records")
+            continue
+
+        print(f"\n{size} records vs baseline:")
+        for phase in PHASES:
+            for metric in ("seconds", "peak_mb"):
+                old = base["phases"].get(phase, {}).get(metric)
+                new = current["phases"].get(phase, {}).get(metric)
+                if old is None or new is None:
+                    continue
+
+                change = (new - old) / old if old else 0.0
+                flag = ""
+                # Sub-10ms phases are noise
+                if change > tolerance and (metric != "seconds" or new - old > 0.01):
+                    flag = "  ← REGRESSION"
+                    regressions.append(f"{size} {phase} {metric}: {old} → {new}")
+                print(f"   {phase:<8} {metric:<8} {old:>10} → {new:>10}  ({change:+.0%}){flag}")
+
+    return regressions
+
+
+# ----------------------------------------
+# Main Function
+# ----------------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the TANGO matching engine on synthetic data.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000],
+                        help="total records per run (e.g. 1000 10000 100000 1000000)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--workers", type=int, default=1, help="passed to match_awbs")
+    parser.add_argument("--no-memory", action="store_true", help="skip tracemalloc (pure timings)")
+    parser.add_argument("--workdir", help="where the synthetic stores go (default: a temp folder, removed after)")
+    parser.add_argument("--output", default="bench_results.json", help="report file")
+    parser.add_argument("--save-baseline", metavar="PATH", help="also store this report as the baseline")
+    parser.add_argument("--baseline", metavar="PATH", help="compare against a stored baseline")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help=f"allowed slowdown / memory growth before failing (default: {DEFAULT_TOLERANCE})")
+    args = parser.parse_args(argv)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="tango_bench_")
+    os.makedirs(workdir, exist_ok=True)
+
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "seed": args.seed,
+        "workers": args.workers,
+        "memory": not args.no_memory,
+        "sizes": {}
+    }
+
+    try:
+        for total in args.sizes:
+            report["sizes"][str(total)] = run_size(total, workdir, args.seed, args.workers, not args.no_memory)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\n✔ Report saved to: {args.output}")
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"✔ Baseline saved to: {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+
+        if baseline.get("memory") != report["memory"]:
+            print("[WARN] Baseline was taken with a different --no-memory setting; timings are not comparable")
+
+        regressions = compare_to_baseline(report, baseline, args.tolerance)
+        if regressions:
+            print(f"\n✗ {len(regressions)} regression(s) beyond {args.tolerance:.0%}:")
+            for line in regressions:
+                print(f"   {line}")
+            return 1
+
+        print("\n✔ No regressions against baseline")
+
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
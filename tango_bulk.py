@@ -0,0 +1,174 @@
+# 17-10-2026
+"""
+Bulk extraction for a folder of AWB / invoice PDFs
+--------------------------------------------------
+
+The watcher handles PDFs one at a time, so a backlog of a few hundred files
+takes as long as all of their Gemini round-trips added together. This runs
+a whole folder through the same extractor code with asyncio:
+
+    cache    PDFs already extracted (same bytes, same prompt) skip the
+             next two steps, see tango_cache.py
+    text     document_text() on a thread pool (PyMuPDF, or OCR for scans),
+             overlapping with the model calls in flight
+    model    aextract_text() → chain.ainvoke, at most --concurrency calls at
+             once and at most --rpm calls started per minute
+    store    store_extraction() → the usual combined output (or sqlite),
+             then the PDF moves to the processed folder. A cached result
+             that is already this file's newest record is not stored again.
+
+A file that fails at any step stays where it is, so running the command
+again only picks up the failures.
+
+    python tango_bulk.py awb <input_dir> <processed_folder> --concurrency 8 --rpm 60
+    python process_awb.py --bulk <input_dir> <processed_folder> [options]
+    python process_invoice.py --bulk <input_dir> <processed_folder> [options]
+"""
+
+import argparse
+import asyncio
+import importlib
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+from tango_cache import file_digest
+
+EXTRACTOR_MODULES = {"awb": "process_awb", "invoice": "process_invoice"}
+
+DEFAULT_CONCURRENCY = int(os.getenv("TANGO_BULK_CONCURRENCY", "8"))
+DEFAULT_RPM = int(os.getenv("TANGO_BULK_RPM", "60"))
+
+
+class RateLimiter:
+    """At most `per_minute` acquisitions in any rolling 60 s window (0 = no limit)."""
+
+    def __init__(self, per_minute: int):
+        self.per_minute = per_minute
+        self.started = deque()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        if self.per_minute <= 0:
+            return
+
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                while self.started and now - self.started[0] >= 60:
+                    self.started.popleft()
+                if len(self.started) < self.per_minute:
+                    self.started.append(now)
+                    return
+                await asyncio.sleep(60 - (now - self.started[0]))
+
+
+def list_pdfs(input_dir: str) -> List[str]:
+    return sorted(
+        os.path.join(input_dir, name)
+        for name in os.listdir(input_dir)
+        if name.lower().endswith(".pdf") and not name.startswith(("~$", "processed_"))
+    )
+
+
+async def extract_one(extractor, pdf_path: str, processed_folder: str, pool: ThreadPoolExecutor,
+                      semaphore: asyncio.Semaphore, limiter: RateLimiter) -> bool:
+    loop = asyncio.get_running_loop()
+    name = os.path.basename(pdf_path)
+
+    try:
+        digest = await loop.run_in_executor(pool, file_digest, pdf_path)
+        output = await loop.run_in_executor(pool, extractor.cached_extraction, digest)
+        replay = output is not None
+
+        if output is None:
+            document = await loop.run_in_executor(pool, extractor.document_text, pdf_path)
+
+            async with semaphore:
+                await limiter.acquire()
+                output = await extractor.aextract_text(document)
+
+            if output is None:
+                raise RuntimeError("model returned nothing")
+            await loop.run_in_executor(pool, extractor.remember_extraction, digest, output)
+
+        # append_record waits on the store lock; keep that off the event loop
+        # A cached result already stored for this file (re-dropped PDF) is not appended again
+        await loop.run_in_executor(pool, extractor.store_extraction, output, pdf_path, replay)
+    except Exception as e:
+        print(f"[ERROR] {name}: {e} (file left in place)")
+        return False
+
+    try:
+        dest = os.path.join(processed_folder, name)
+        os.replace(pdf_path, dest)
+    except Exception as e:
+        print(f"[ERROR] Failed to move processed file {name}: {e}")
+
+    print(f"✔ {name}")
+    return True
+
+
+async def run_bulk(kind: str, input_dir: str, processed_folder: str, concurrency: int, rpm: int,
+                   text_workers: int) -> int:
+    """Extract every PDF in `input_dir`; returns the number of failures."""
+    extractor = importlib.import_module(EXTRACTOR_MODULES[kind])
+    pdfs = list_pdfs(input_dir)
+    if not pdfs:
+        print(f"No PDFs in {input_dir}")
+        return 0
+
+    os.makedirs(processed_folder, exist_ok=True)
+    print(f"→ {len(pdfs)} {kind.upper()} PDFs, {concurrency} concurrent model calls, "
+          f"{rpm or 'unlimited'} per minute, {text_workers} text/OCR threads")
+
+    loop = asyncio.get_running_loop()
+    # langchain runs sync-only model clients on the default executor; give it one thread per slot
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=concurrency))
+
+    semaphore = asyncio.Semaphore(concurrency)
+    limiter = RateLimiter(rpm)
+    started = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=text_workers, thread_name_prefix="tango-text") as pool:
+        results = await asyncio.gather(*(
+            extract_one(extractor, pdf, processed_folder, pool, semaphore, limiter) for pdf in pdfs
+        ))
+
+    failed = results.count(False)
+    print(f"\n✔ {len(pdfs) - failed}/{len(pdfs)} extracted in {time.perf_counter() - started:.1f}s"
+          + (f", {failed} failed (left in {input_dir})" if failed else ""))
+    return failed
+
+
+# ----------------------------------------
+# Main Function
+# ----------------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Extract a folder of AWB or invoice PDFs concurrently.")
+    parser.add_argument("kind", choices=sorted(EXTRACTOR_MODULES))
+    parser.add_argument("input_dir")
+    parser.add_argument("processed_folder")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                        help=f"model calls in flight at once (default: {DEFAULT_CONCURRENCY})")
+    parser.add_argument("--rpm", type=int, default=DEFAULT_RPM,
+                        help=f"model calls started per minute, 0 = no limit (default: {DEFAULT_RPM})")
+    parser.add_argument("--text-workers", type=int, default=min(4, os.cpu_count() or 1),
+                        help="threads for text extraction / OCR")
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.input_dir):
+        print(f"ERROR: Folder does not exist: {args.input_dir}")
+        return 1
+
+    failed = asyncio.run(run_bulk(
+        args.kind, args.input_dir, args.processed_folder,
+        max(1, args.concurrency), args.rpm, max(1, args.text_workers)
+    ))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,233 @@
+# 17-10-2026
+"""
+Extraction cache
+----------------
+
+The same AWB / invoice PDF is regularly dropped again (e-mail forwards,
+OneDrive resyncs). Parsed extractions are kept here, keyed on:
+
+    kind      "awb" / "invoice"
+    digest    SHA-256 of the PDF bytes
+    version   hash of the prompt, the output schema and the model name,
+              plus the rules of whatever else shapes the result (OCR,
+              fast path and layout templates, invoice page selection)
+
+so a PDF already seen skips OCR and the Gemini call entirely. Changing
+a prompt or a schema changes the version, and the old entries stop
+matching and age out. The extractors do not store a cached result again
+when it is already the newest record for the same file.
+
+The cache holds at most TANGO_CACHE_MAX_ENTRIES entries; the least
+recently used go first. Hits, misses and evictions are counted in the
+same file.
+
+Settings (.env):
+    TANGO_CACHE=off                      disable
+    TANGO_CACHE_PATH=C:\\path\\to\\cache.db  (optional, keep it on a local disk)
+    TANGO_CACHE_MAX_ENTRIES=20000
+
+    python tango_cache.py stats
+    python tango_cache.py clear [--kind awb]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from typing import Any, Dict, Optional
+
+from dotenv import load_dotenv
+load_dotenv()
+
+CACHE_ENABLED = os.getenv("TANGO_CACHE", "on").lower() not in ("0", "off", "false", "no")
+CACHE_PATH = os.getenv(
+    "TANGO_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "tango_cache.db")
+)
+CACHE_MAX_ENTRIES = int(os.getenv("TANGO_CACHE_MAX_ENTRIES", "20000"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS extractions (
+    kind TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    version TEXT NOT NULL,
+    data TEXT NOT NULL,
+    created REAL NOT NULL,
+    last_used REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (kind, digest, version)
+);
+CREATE INDEX IF NOT EXISTS idx_extractions_last_used ON extractions (last_used);
+
+CREATE TABLE IF NOT EXISTS counters (
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    value INTEGER NOT NULL,
+    PRIMARY KEY (kind, name)
+);
+"""
+
+
+def pdf_digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_digest(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def extraction_version(*parts: str) -> str:
+    """Short hash of whatever shapes the output (prompt text, schema, model)."""
+    h = hashlib.sha256()
+    for part in parts:
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()[:16]
+
+
+class ExtractionCache:
+    """Parsed extractions keyed on (kind, PDF digest, prompt/schema version), LRU-bounded."""
+
+    def __init__(self, path: str = CACHE_PATH, max_entries: int = CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def _count(self, kind: str, name: str, n: int = 1):
+        self.conn.execute(
+            "INSERT INTO counters (kind, name, value) VALUES (?, ?, ?) "
+            "ON CONFLICT (kind, name) DO UPDATE SET value = value + excluded.value",
+            (kind, name, n)
+        )
+
+    def get(self, kind: str, digest: str, version: str) -> Optional[Dict[str, Any]]:
+        with self.conn:
+            row = self.conn.execute(
+                "SELECT data FROM extractions WHERE kind = ? AND digest = ? AND version = ?",
+                (kind, digest, version)
+            ).fetchone()
+
+            if row is None:
+                self._count(kind, "misses")
+                return None
+
+            self.conn.execute(
+                "UPDATE extractions SET last_used = ?, hits = hits + 1 WHERE kind = ? AND digest = ? AND version = ?",
+                (time.time(), kind, digest, version)
+            )
+            self._count(kind, "hits")
+        return json.loads(row[0])
+
+    def put(self, kind: str, digest: str, version: str, data: Dict[str, Any]):
+        now = time.time()
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO extractions (kind, digest, version, data, created, last_used) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (kind, digest, version) DO UPDATE SET data = excluded.data, last_used = excluded.last_used",
+                (kind, digest, version, json.dumps(data, ensure_ascii=False), now, now)
+            )
+            self._count(kind, "stored")
+
+            # LRU: drop the least recently used entries beyond the bound
+            (total,) = self.conn.execute("SELECT COUNT(*) FROM extractions").fetchone()
+            excess = total - self.max_entries
+            if excess > 0:
+                self.conn.execute(
+                    "DELETE FROM extractions WHERE rowid IN "
+                    "(SELECT rowid FROM extractions ORDER BY last_used LIMIT ?)",
+                    (excess,)
+                )
+                self._count(kind, "evictions", excess)
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        stats = {}
+        for kind, name, value in self.conn.execute("SELECT kind, name, value FROM counters"):
+            stats.setdefault(kind, {})[name] = value
+        for kind, entries, size in self.conn.execute(
+                "SELECT kind, COUNT(*), COALESCE(SUM(LENGTH(data)), 0) FROM extractions GROUP BY kind"):
+            stats.setdefault(kind, {}).update({"entries": entries, "bytes": size})
+
+        for s in stats.values():
+            lookups = s.get("hits", 0) + s.get("misses", 0)
+            s["hit_rate"] = round(s.get("hits", 0) / lookups, 4) if lookups else None
+        return stats
+
+    def clear(self, kind: str = None):
+        with self.conn:
+            if kind:
+                self.conn.execute("DELETE FROM extractions WHERE kind = ?", (kind,))
+                self.conn.execute("DELETE FROM counters WHERE kind = ?", (kind,))
+            else:
+                self.conn.execute("DELETE FROM extractions")
+                self.conn.execute("DELETE FROM counters")
+
+
+# ============================================================================
+# EXTRACTOR HELPERS
+# ============================================================================
+# A broken or locked cache must never stop an extraction: both helpers
+# warn and carry on as if the cache were empty.
+
+def lookup(kind: str, digest: str, version: str) -> Optional[Dict[str, Any]]:
+    if not CACHE_ENABLED:
+        return None
+    try:
+        with ExtractionCache() as cache:
+            return cache.get(kind, digest, version)
+    except sqlite3.Error as e:
+        print(f"[WARN] Extraction cache unavailable: {e}")
+        return None
+
+
+def remember(kind: str, digest: str, version: str, data: Dict[str, Any]):
+    if not CACHE_ENABLED:
+        return
+    try:
+        with ExtractionCache() as cache:
+            cache.put(kind, digest, version, data)
+    except sqlite3.Error as e:
+        print(f"[WARN] Extraction not cached: {e}")
+
+
+# ----------------------------------------
+# Main Function
+# ----------------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="TANGO extraction cache tools.")
+    parser.add_argument("--db", default=CACHE_PATH, help=f"cache file (default: {CACHE_PATH})")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    sub.add_parser("stats", help="entries, hits, misses and evictions per document kind")
+    clear = sub.add_parser("clear", help="drop cached extractions and their counters")
+    clear.add_argument("--kind", choices=["awb", "invoice"])
+
+    args = parser.parse_args(argv)
+
+    with ExtractionCache(args.db) as cache:
+        if args.command == "stats":
+            print(json.dumps(cache.stats(), indent=2))
+        elif args.command == "clear":
+            cache.clear(args.kind)
+            print(f"✔ Cleared {args.kind or 'all'} cached extractions in: {args.db}")
+
+
+if __name__ == "__main__":
+    main()
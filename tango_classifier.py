@@ -5,6 +5,8 @@ import sys
 from typing import Dict, Any, List, Optional
 from datetime import datetime
 
+from tango_records import iter_records
+
 
 # ----------------------------------------
 # Rule-Based Document Classifier
@@ -133,15 +135,9 @@ def main():
     classifier = DocumentClassifier()
     results = []
 
-    # Read combined AWB file
-    with open(input_file, "r", encoding="utf-8") as f:
-        content = f.read()
-
-    blocks = [b.strip() for b in content.split("--------------------------------------------------------------------------------") if b.strip()]
-
-    for block in blocks:
+    # Stream combined AWB file
+    for entry in iter_records(input_file):
         try:
-            entry = json.loads(block)
             awb_data = entry.get("awb") or entry
             classification = classifier.classify(awb_data, inv={})
             results.append({
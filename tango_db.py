@@ -0,0 +1,348 @@
+# 17-10-2026
+"""
+Optional SQLite storage backend
+-------------------------------
+
+Replaces the appended text stores (awb_all_output.txt,
+invoice_all_output.txt) and matched_results.json with one embedded
+database. Lookups by HAWB, normalized invoice number, VIN and source
+file are indexed. WAL mode lets the extractors keep writing while
+tango_match / tango_excel_writer read.
+
+Select it in .env:
+    TANGO_STORAGE=sqlite
+    TANGO_DB_PATH=C:\\path\\to\\tango.db     (optional)
+
+Keep the database on a local disk: WAL needs shared memory, which a
+synced OneDrive folder or network share does not provide.
+
+One-shot import of the existing text files:
+    python tango_db.py import --awb awb_all_output.txt --invoice invoice_all_output.txt --matches matched_results.json
+
+Indexed lookups (stored entries as JSON, AWBs before invoices):
+    python tango_db.py find --hawb FRA12345678
+    python tango_db.py find --invoice 1500012345      AWBs listing it and the invoice itself
+    python tango_db.py find --vin W1ND...
+    python tango_db.py find --source C:\\path\\to\\file.pdf
+"""
+
+import argparse
+import json
+import os
+import re
+import sqlite3
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from tango_records import iter_records, latest_record_for_source
+
+STORAGE_BACKEND = os.getenv("TANGO_STORAGE", "text").lower()   # "text" or "sqlite"
+DB_PATH = os.getenv(
+    "TANGO_DB_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "tango.db")
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS awbs (
+    id INTEGER PRIMARY KEY,
+    source_file TEXT NOT NULL,
+    timestamp TEXT,
+    hawb TEXT,
+    vin_no TEXT,
+    data TEXT NOT NULL,
+    UNIQUE (source_file, timestamp)
+);
+CREATE INDEX IF NOT EXISTS idx_awbs_hawb ON awbs (hawb);
+CREATE INDEX IF NOT EXISTS idx_awbs_vin ON awbs (vin_no);
+CREATE INDEX IF NOT EXISTS idx_awbs_source ON awbs (source_file);
+
+CREATE TABLE IF NOT EXISTS awb_invoice_numbers (
+    awb_id INTEGER NOT NULL REFERENCES awbs (id) ON DELETE CASCADE,
+    invoice_number TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_awb_invoice_numbers ON awb_invoice_numbers (invoice_number);
+
+CREATE TABLE IF NOT EXISTS classifications (
+    awb_id INTEGER PRIMARY KEY REFERENCES awbs (id) ON DELETE CASCADE,
+    country TEXT,
+    category TEXT,
+    requires_invoice INTEGER,
+    matched_rules TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_classifications_category ON classifications (category);
+
+CREATE TABLE IF NOT EXISTS invoices (
+    id INTEGER PRIMARY KEY,
+    source_file TEXT NOT NULL,
+    timestamp TEXT,
+    invoice_number TEXT,
+    vin_no TEXT,
+    data TEXT NOT NULL,
+    UNIQUE (source_file, timestamp)
+);
+CREATE INDEX IF NOT EXISTS idx_invoices_number ON invoices (invoice_number);
+CREATE INDEX IF NOT EXISTS idx_invoices_vin ON invoices (vin_no);
+CREATE INDEX IF NOT EXISTS idx_invoices_source ON invoices (source_file);
+
+CREATE TABLE IF NOT EXISTS match_results (
+    position INTEGER PRIMARY KEY,
+    awb_file TEXT NOT NULL,
+    hawb TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_match_results_awb ON match_results (awb_file);
+CREATE INDEX IF NOT EXISTS idx_match_results_hawb ON match_results (hawb);
+"""
+
+
+def use_sqlite() -> bool:
+    return STORAGE_BACKEND == "sqlite"
+
+
+def already_stored(entry: Dict[str, Any], text_path: str) -> bool:
+    """
+    True when the newest stored record for the entry's source file holds the
+    same AWB / invoice, e.g. a re-dropped PDF answered from the extraction
+    cache. Checks the database or, with text storage, the store at `text_path`.
+    """
+    kind = "awb" if "awb" in entry else "invoice"
+    if use_sqlite():
+        with TangoStore(DB_PATH) as store:
+            stored = [e for e in store.find_by_source_file(entry["_source_file"]) if kind in e]
+        latest = stored[-1] if stored else None
+    else:
+        latest = latest_record_for_source(text_path, entry["_source_file"])
+
+    # Compare as stored (JSON), not as the in-memory model dump
+    return latest is not None and latest.get(kind) == json.loads(json.dumps(entry[kind], ensure_ascii=False))
+
+
+def _digits(x) -> str:
+    # Same rule as tango_match.normalize_invoice_number
+    return re.sub(r"\D", "", str(x)) if x else ""
+
+
+class TangoStore:
+    """AWBs, invoices, classifications and match results in one SQLite file."""
+
+    def __init__(self, path: str = DB_PATH):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        self.conn.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    @contextmanager
+    def snapshot(self):
+        """One read transaction: every read inside sees the same point in time."""
+        self.conn.execute("BEGIN")
+        try:
+            yield self
+        except BaseException:
+            # Keep the original error: an error may already have ended the transaction
+            if self.conn.in_transaction:
+                self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+
+    # ------------------------------------------------------------------
+    # WRITES
+    # ------------------------------------------------------------------
+    def _insert_awb(self, entry: Dict[str, Any]) -> int:
+        """Rows inserted: 1, or 0 when the entry is already stored."""
+        awb = entry.get("awb") or {}
+        cur = self.conn.execute(
+            "INSERT OR IGNORE INTO awbs (source_file, timestamp, hawb, vin_no, data) VALUES (?, ?, ?, ?, ?)",
+            (entry.get("_source_file"), entry.get("_timestamp"), awb.get("hawb"), awb.get("vin_no"),
+             json.dumps(entry, ensure_ascii=False))
+        )
+        if cur.rowcount == 0:
+            return 0  # already stored (re-import)
+
+        awb_id = cur.lastrowid
+        self.conn.executemany(
+            "INSERT INTO awb_invoice_numbers (awb_id, invoice_number) VALUES (?, ?)",
+            [(awb_id, _digits(x)) for x in (awb.get("invoice_numbers") or [])]
+        )
+
+        classification = awb.get("classification")
+        if classification:
+            self.conn.execute(
+                "INSERT INTO classifications (awb_id, country, category, requires_invoice, matched_rules) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (awb_id, classification.get("country"), classification.get("category"),
+                 int(bool(classification.get("requires_invoice"))),
+                 json.dumps(classification.get("matched_rules", []), ensure_ascii=False))
+            )
+        return 1
+
+    def _insert_invoice(self, entry: Dict[str, Any]) -> int:
+        """Rows inserted: 1, or 0 when the entry is already stored."""
+        invoice = entry.get("invoice") or {}
+        cur = self.conn.execute(
+            "INSERT OR IGNORE INTO invoices (source_file, timestamp, invoice_number, vin_no, data) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (entry.get("_source_file"), entry.get("_timestamp"), _digits(invoice.get("invoice_number")),
+             invoice.get("vin_no"), json.dumps(entry, ensure_ascii=False))
+        )
+        return cur.rowcount
+
+    def add_awb(self, entry: Dict[str, Any]):
+        with self.conn:
+            self._insert_awb(entry)
+
+    def add_invoice(self, entry: Dict[str, Any]):
+        with self.conn:
+            self._insert_invoice(entry)
+
+    def save_match_results(self, results: List[Dict[str, Any]]):
+        """Replace the stored results in one transaction (readers see old or new, never half)."""
+        with self.conn:
+            self.conn.execute("DELETE FROM match_results")
+            self.conn.executemany(
+                "INSERT INTO match_results (position, awb_file, hawb, data) VALUES (?, ?, ?, ?)",
+                [(pos, r.get("awb_file"), r.get("hawb"), json.dumps(r, ensure_ascii=False))
+                 for pos, r in enumerate(results)]
+            )
+
+    # ------------------------------------------------------------------
+    # READS (entries come back exactly as they were in the text files)
+    # ------------------------------------------------------------------
+    def _iter_data(self, sql: str, params=()) -> Iterator[Dict[str, Any]]:
+        for (data,) in self.conn.execute(sql, params):
+            yield json.loads(data)
+
+    def iter_awbs(self) -> Iterator[Dict[str, Any]]:
+        return self._iter_data("SELECT data FROM awbs ORDER BY id")
+
+    def iter_invoices(self) -> Iterator[Dict[str, Any]]:
+        return self._iter_data("SELECT data FROM invoices ORDER BY id")
+
+    def load_match_results(self) -> List[Dict[str, Any]]:
+        return list(self._iter_data("SELECT data FROM match_results ORDER BY position"))
+
+    def find_awbs_by_hawb(self, hawb: str) -> List[Dict[str, Any]]:
+        return list(self._iter_data("SELECT data FROM awbs WHERE hawb = ? ORDER BY id", (hawb,)))
+
+    def find_awbs_by_invoice_number(self, invoice_number: str) -> List[Dict[str, Any]]:
+        return list(self._iter_data(
+            "SELECT DISTINCT a.data FROM awbs a JOIN awb_invoice_numbers n ON n.awb_id = a.id "
+            "WHERE n.invoice_number = ? ORDER BY a.id",
+            (_digits(invoice_number),)
+        ))
+
+    def find_invoices_by_number(self, invoice_number: str) -> List[Dict[str, Any]]:
+        return list(self._iter_data(
+            "SELECT data FROM invoices WHERE invoice_number = ? ORDER BY id",
+            (_digits(invoice_number),)
+        ))
+
+    def find_by_vin(self, vin_no: str) -> Dict[str, List[Dict[str, Any]]]:
+        return {
+            "awbs": list(self._iter_data("SELECT data FROM awbs WHERE vin_no = ? ORDER BY id", (vin_no,))),
+            "invoices": list(self._iter_data("SELECT data FROM invoices WHERE vin_no = ? ORDER BY id", (vin_no,)))
+        }
+
+    def find_by_source_file(self, source_file: str) -> List[Dict[str, Any]]:
+        return list(self._iter_data(
+            "SELECT data FROM awbs WHERE source_file = ? "
+            "UNION ALL SELECT data FROM invoices WHERE source_file = ?",
+            (source_file, source_file)
+        ))
+
+    def find(self, hawb: str = None, invoice_number: str = None, vin_no: str = None,
+             source_file: str = None) -> List[Dict[str, Any]]:
+        """Stored entries for one key (the first one given), AWBs before invoices."""
+        if hawb:
+            return self.find_awbs_by_hawb(hawb.strip())
+        if invoice_number:
+            return self.find_awbs_by_invoice_number(invoice_number) + self.find_invoices_by_number(invoice_number)
+        if vin_no:
+            found = self.find_by_vin(vin_no.strip())
+            return found["awbs"] + found["invoices"]
+        if source_file:
+            return self.find_by_source_file(os.path.abspath(source_file))
+        return []
+
+    # ------------------------------------------------------------------
+    # IMPORT
+    # ------------------------------------------------------------------
+    def import_text_stores(self, awb_path: str = None, invoice_path: str = None, matches_path: str = None) -> Dict[str, int]:
+        counts = {"awbs": 0, "invoices": 0, "match_results": 0}
+
+        with self.conn:
+            if awb_path:
+                for entry in iter_records(awb_path):
+                    counts["awbs"] += self._insert_awb(entry)
+
+            if invoice_path:
+                for entry in iter_records(invoice_path):
+                    counts["invoices"] += self._insert_invoice(entry)
+
+        if matches_path:
+            with open(matches_path, "r", encoding="utf-8") as f:
+                results = json.load(f)
+            self.save_match_results(results)
+            counts["match_results"] = len(results)
+
+        return counts
+
+
+# ----------------------------------------
+# Main Function
+# ----------------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="TANGO SQLite store tools.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    imp = sub.add_parser("import", help="import the existing text stores into the database")
+    imp.add_argument("--awb", help="awb_all_output.txt")
+    imp.add_argument("--invoice", help="invoice_all_output.txt")
+    imp.add_argument("--matches", help="matched_results.json")
+    imp.add_argument("--db", default=DB_PATH, help=f"database file (default: {DB_PATH})")
+
+    find = sub.add_parser("find", help="stored AWBs / invoices for one key")
+    key = find.add_mutually_exclusive_group(required=True)
+    key.add_argument("--hawb")
+    key.add_argument("--invoice", help="invoice number (digits only are compared)")
+    key.add_argument("--vin")
+    key.add_argument("--source", help="path of the extracted PDF")
+    find.add_argument("--db", default=DB_PATH, help=f"database file (default: {DB_PATH})")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "find":
+        if not os.path.exists(args.db):
+            print(f"ERROR: Database does not exist: {args.db}")
+            return 1
+        with TangoStore(args.db) as store:
+            entries = store.find(args.hawb, args.invoice, args.vin, args.source)
+        for entry in entries:
+            print(json.dumps(entry, ensure_ascii=False, indent=2))
+        print(f"✔ {len(entries)} stored entries")
+        return 0
+
+    if args.command == "import":
+        with TangoStore(args.db) as store:
+            counts = store.import_text_stores(args.awb, args.invoice, args.matches)
+
+        print(f"✔ Imported {counts['awbs']} AWBs, {counts['invoices']} invoices, "
+              f"{counts['match_results']} match results into: {args.db}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
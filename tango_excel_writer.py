@@ -13,6 +13,7 @@ Data Sources:
     - awb_all_output.txt
     - invoice_all_output.txt
     - matched_results.json   (Generated by matching engine)
+    or, with TANGO_STORAGE=sqlite, the same records from tango_db
 
 Design Principle:
     Matching logic is NOT re-evaluated here.
@@ -27,6 +28,9 @@ import json
 from datetime import datetime
 import pandas as pd
 
+from tango_records import read_snapshot
+from tango_db import use_sqlite, TangoStore
+
 # ============================================================
 # 📂 PATH CONFIGURATION
 # ============================================================
@@ -46,22 +50,8 @@ OUTPUT_EXCEL = os.path.join(BASE_DIR, "reconciliation_output.xlsx")
 
 def load_json_blocks(path):
 
-    with open(path, "r", encoding="utf-8") as f:
-        raw = f.read()
-
-    blocks = raw.split("--------------------------------------------------------------------------------")
-    objects = []
-
-    for block in blocks:
-        block = block.strip()
-        if not block:
-            continue
-        try:
-            objects.append(json.loads(block))
-        except json.JSONDecodeError:
-            continue
-
-    return objects
+    # Never includes a record that is still being appended
+    return read_snapshot(path)
 
 
 def load_matched_results(path):
@@ -211,10 +201,16 @@ def deduplicate_by_hawb(records):
 
 print("Loading data...")
 
-awbs_raw = load_json_blocks(AWB_PATH)
-invoices_raw = load_json_blocks(INV_PATH)
+if use_sqlite():
+    with TangoStore() as store, store.snapshot():
+        awbs_raw = list(store.iter_awbs())
+        invoices_raw = list(store.iter_invoices())
+        matched_results = store.load_match_results()
+else:
+    awbs_raw = load_json_blocks(AWB_PATH)
+    invoices_raw = load_json_blocks(INV_PATH)
 
-matched_results = load_matched_results(MATCH_PATH)
+    matched_results = load_matched_results(MATCH_PATH)
 
 # Apply HAWB deduplication
 matched_results = deduplicate_by_hawb(matched_results)
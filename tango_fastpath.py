@@ -0,0 +1,106 @@
+# 17-10-2026
+"""
+Regex fast path for AWB fields
+------------------------------
+
+Several AirwayBill fields have strict formats, and the rules in
+process_awb.build_prompt already spell them out:
+
+    mawb             3 digits + 3 letters + 8 digits, separators removed
+    hawb             3 letters + 8 digits, separators removed
+    invoice_numbers  10 digits starting with 106, 1100, 1106, 150, 400 or 490
+    vin_no           17 characters, Mercedes VINs start with W1
+    order_no         10 digits after an "order" label, spaces removed
+
+preextract_awb() returns only the fields it is sure of: exactly one
+distinct candidate, or one labelled candidate. Anything ambiguous or not
+found is left to the model. A missing value is never reported as "" here,
+because a field that is absent from the text and one the regex could not
+read look the same.
+
+TANGO_FASTPATH=off sends everything to the model again.
+"""
+
+import os
+import re
+from typing import Any, Dict, List, Tuple
+
+FASTPATH_ENABLED = os.getenv("TANGO_FASTPATH", "on").lower() not in ("0", "off", "false", "no")
+
+# Bump when a rule changes: cached extractions made with other rules are then ignored
+FASTPATH_VERSION = "1"
+
+INVOICE_PREFIXES = ("106", "1100", "1106", "150", "400", "490")
+
+MAWB_RE = re.compile(r"(?<![A-Z0-9])(\d{3})[ -]?([A-Z]{3})[ -]?(\d{4})[ -]?(\d{4})(?![A-Z0-9])")
+HAWB_RE = re.compile(r"(?<![A-Z0-9])([A-Z]{3})[ -]?(\d{8})(?![0-9])")
+# A label directly in front of the candidate ("HAWB: ", "HAWB No. ", "House Waybill - ")
+HAWB_LABEL_RE = re.compile(
+    r"\b(?:HAWB|HOUSE\s*(?:AIR\s*)?WAYBILL)(?:\s*(?:NO\.?|NUMBER|#))?[^A-Z0-9]{0,5}$",
+    re.IGNORECASE
+)
+INVOICE_RE = re.compile(r"(?<!\d)\d{10}(?!\d)")
+VIN_RE = re.compile(r"(?<![A-Z0-9])(W1[A-HJ-NPR-Z0-9]{15})(?![A-Z0-9])")
+ORDER_RE = re.compile(
+    r"\bORDER\s*(?:NO\.?|NUMBER|NR\.?|#)?\s*[:.]?\s*((?:\d[ ]?){9}\d)(?![ ]?\d)",
+    re.IGNORECASE
+)
+
+
+def _unique(values: List[str]):
+    distinct = list(dict.fromkeys(values))
+    return distinct[0] if len(distinct) == 1 else None
+
+
+def _mawbs(text: str) -> Tuple[List[str], List[Tuple[int, int]]]:
+    values, spans = [], []
+    for m in MAWB_RE.finditer(text):
+        values.append("".join(m.groups()))
+        spans.append(m.span())
+    return values, spans
+
+
+def _hawb(text: str, mawb_spans: List[Tuple[int, int]]):
+    # "020-FRA-33119542" contains "FRA-33119542": skip HAWB candidates inside a MAWB
+    candidates = [
+        m for m in HAWB_RE.finditer(text)
+        if not any(start <= m.start() < end for start, end in mawb_spans)
+    ]
+
+    labelled = [
+        "".join(m.groups()) for m in candidates
+        if HAWB_LABEL_RE.search(text, max(0, m.start() - 30), m.start())
+    ]
+    if labelled:
+        return _unique(labelled)
+    return _unique(["".join(m.groups()) for m in candidates])
+
+
+def preextract_awb(text: str) -> Dict[str, Any]:
+    """Fields of `text` (cleaned AWB text) that follow their format rule unambiguously."""
+    if not FASTPATH_ENABLED or not text:
+        return {}
+
+    found = {}
+
+    mawbs, mawb_spans = _mawbs(text)
+    if _unique(mawbs):
+        found["mawb"] = mawbs[0]
+
+    hawb = _hawb(text, mawb_spans)
+    if hawb:
+        found["hawb"] = hawb
+
+    invoices = [n for n in INVOICE_RE.findall(text) if n.startswith(INVOICE_PREFIXES)]
+    if invoices:
+        found["invoice_numbers"] = list(dict.fromkeys(invoices))
+
+    vin = _unique(VIN_RE.findall(text))
+    if vin:
+        found["vin_no"] = vin
+
+    order_no = _unique([re.sub(r"\D", "", m) for m in ORDER_RE.findall(text)])
+    if order_no:
+        found["order_no"] = order_no
+
+    return found
@@ -1,18 +1,48 @@
 # 11-03-2026
+import argparse
+import cProfile
 import json
+import math
 import os
 import re
-from typing import List, Dict, Any
+import sys
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack, contextmanager
+from datetime import datetime, timedelta
+from typing import List, Dict, Any, NamedTuple, Optional
+
+try:
+    import numpy as np
+except ImportError:  # SINGLE screening falls back to the per-pair matchers
+    np = None
+
+try:
+    from rapidfuzz import process as fuzz_process
+    from rapidfuzz.distance import Levenshtein
+except ImportError:  # fuzzy invoice-number pass is skipped
+    fuzz_process = None
 
 MATCH_SCOPE_SINGLE = "SINGLE"
 MATCH_SCOPE_GROUP = "GROUP"
 
 # ---- Local imports ----
 from tango_classifier import DocumentClassifier
+from tango_records import iter_records, store_snapshot, file_lock, atomic_write, write_json_array
+from tango_db import use_sqlite, TangoStore, DB_PATH
 
 # LOCK_FILE = r"C:\Users\HEKOLLI\OneDrive - Mercedes-Benz (corpdir.onmicrosoft.com)\DWT_TANGO - Documents\matching.lock"
 LOCK_FILE = r"C:\Users\SONIARN\OneDrive - Mercedes-Benz (corpdir.onmicrosoft.com)\DWT_TANGO - Documents\matching.lock"
 
+# === PATHS ===
+# AWB_PATH = r"C:\Users\HEKOLLI\OneDrive - Mercedes-Benz (corpdir.onmicrosoft.com)\DWT_TANGO - Documents\awb_all_output.txt"
+# INV_PATH = r"C:\Users\HEKOLLI\OneDrive - Mercedes-Benz (corpdir.onmicrosoft.com)\DWT_TANGO - Documents\invoice_all_output.txt"
+# OUT_DIR = r"C:\Users\HEKOLLI\OneDrive - Mercedes-Benz (corpdir.onmicrosoft.com)\DWT_TANGO - Documents"
+AWB_PATH = r"C:\Users\SONIARN\OneDrive - Mercedes-Benz (corpdir.onmicrosoft.com)\DWT_TANGO - Documents\awb_all_output.txt"
+INV_PATH = r"C:\Users\SONIARN\OneDrive - Mercedes-Benz (corpdir.onmicrosoft.com)\DWT_TANGO - Documents\invoice_all_output.txt"
+OUT_DIR = r"C:\Users\SONIARN\OneDrive - Mercedes-Benz (corpdir.onmicrosoft.com)\DWT_TANGO - Documents"
+
 # Utility (copied from shared_utils logic)
 def _get(d, key, default=None):
     return d.get(key, default) if d else default
@@ -57,6 +87,87 @@ def _weights_approximately_equal(a, b, tolerance=1.0):
 def single_result(matched, details):
     return matched, details, MATCH_SCOPE_SINGLE
 
+
+# ============================================================================
+# PRECOMPUTED FEATURES
+# ============================================================================
+
+class RecordFeatures(NamedTuple):
+    """Normalized view of one AWB or invoice, computed once per run."""
+    invoice_number: str         # digits-only invoice_number (invoices)
+    invoice_number_raw: str     # stripped invoice_number as written (After Sales SINGLE check)
+    invoice_numbers: frozenset  # digits-only invoice_numbers (AWBs)
+    pieces: Any                 # no_pieces as loaded: matchers compare it exactly like the raw field
+    pieces_int: Optional[int]   # whole-number no_pieces, None if missing / not a count → consolidation
+    weight: float               # normalize_weight() → GROUP totals
+    weight_raw: float           # plain float(), NaN if not numeric → SINGLE ±1.0 checks
+    shipper_add: str            # lowercase
+
+
+def _as_int(value):
+    if isinstance(value, int):
+        return value
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, str) and value.strip().isdigit():
+        return int(value.strip())
+    return None
+
+
+def _strict_float(value):
+    # Same acceptance as _weights_approximately_equal: anything float() rejects
+    # becomes NaN, which never compares within tolerance
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def compute_features(record: Dict[str, Any]) -> RecordFeatures:
+    return RecordFeatures(
+        invoice_number=normalize_invoice_number(record.get("invoice_number")),
+        invoice_number_raw=str(record.get("invoice_number", "")).strip(),
+        invoice_numbers=frozenset(
+            normalize_invoice_number(x)
+            for x in (record.get("invoice_numbers") or [])
+        ),
+        pieces=record.get("no_pieces"),
+        pieces_int=_as_int(record.get("no_pieces")),
+        weight=normalize_weight(record.get("gross_weight")),
+        weight_raw=_strict_float(record.get("gross_weight")),
+        shipper_add=str(record.get("shipper_add", "")).lower()
+    )
+
+
+def _features(record) -> RecordFeatures:
+    """Features stored by prepare_awbs/prepare_invoices, or computed on the fly."""
+    if record and "_features" in record:
+        return record["_features"]
+    return compute_features(record or {})
+
+
+def prepare_awbs(awbs: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    for entry in awbs:
+        entry["awb"]["_features"] = compute_features(entry["awb"])
+    return awbs
+
+
+def prepare_invoices(invoices: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    for entry in invoices:
+        entry["invoice"]["_features"] = compute_features(entry["invoice"])
+    return invoices
+
+
+def dedup_invoices(invoices: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """One entry per normalized invoice number (the last one wins); unnumbered invoices are dropped."""
+    unique_invoices = {}
+    for inv in invoices:
+        inv_num = _features(inv["invoice"]).invoice_number
+        if inv_num:
+            unique_invoices[inv_num] = inv
+
+    return list(unique_invoices.values())
+
 # ============================================================================
 # MATCHING FUNCTIONS (directly aligned with match_script_2 logic)
 # ============================================================================
@@ -66,12 +177,11 @@ def match_mbag_production_parts(awb, inv, **kwargs):
     # -----------------------------------------
     # 1️⃣ Invoice enforcement (CATEGORY-SPECIFIC)
     # -----------------------------------------
-    awb_inv_nums = set(
-        normalize_invoice_number(x)
-        for x in (awb.get("invoice_numbers") or [])
-    )
+    awb_f = _features(awb)
+    inv_f = _features(inv)
 
-    inv_num = normalize_invoice_number(inv.get("invoice_number"))
+    awb_inv_nums = awb_f.invoice_numbers
+    inv_num = inv_f.invoice_number
 
     if awb_inv_nums:
         if inv_num not in awb_inv_nums:
@@ -85,12 +195,9 @@ def match_mbag_production_parts(awb, inv, **kwargs):
     # -----------------------------------------
     # 2️⃣ Physical validations
     # -----------------------------------------
-    pieces_match = _get(awb, 'no_pieces') == _get(inv, 'no_pieces')
+    pieces_match = awb_f.pieces == inv_f.pieces
 
-    weight_match = _weights_approximately_equal(
-        _get(awb, 'gross_weight'),
-        _get(inv, 'gross_weight')
-    )
+    weight_match = _weights_approximately_equal(awb_f.weight_raw, inv_f.weight_raw)
 
     awb_container = _get(awb, 'container_number')
     inv_container = _get(inv, 'container_number')
@@ -119,7 +226,8 @@ def match_mbag_production_parts(awb, inv, **kwargs):
 
 def match_mbag_after_sales_parts(awb, inv, all_invoices=None, **kwargs):
     
-    awb_inv_nums = set(normalize_invoice_number(x) for x in (awb.get("invoice_numbers") or []))
+    awb_f = _features(awb)
+    awb_inv_nums = awb_f.invoice_numbers
 
 
     match_scope = (
@@ -134,22 +242,19 @@ def match_mbag_after_sales_parts(awb, inv, all_invoices=None, **kwargs):
     if match_scope == MATCH_SCOPE_GROUP:
 
         related_invoices = [
-        i for i in all_invoices
-        if normalize_invoice_number(i.get("invoice_number")) in awb_inv_nums
+        _features(i) for i in all_invoices
+        if _features(i).invoice_number in awb_inv_nums
     ]
 
 
         if not related_invoices:
             return False, {"reason": "no_related_invoices"}, match_scope
 
-        total_pieces = sum(i.get("no_pieces") or 0 for i in related_invoices)
-        total_weight = sum(normalize_weight(i.get("gross_weight")) for i in related_invoices)
+        total_pieces = sum(i.pieces or 0 for i in related_invoices)
+        total_weight = sum(i.weight for i in related_invoices)
 
-        pieces_match = total_pieces == (awb.get("no_pieces") or 0)
-        weight_match = _weights_approximately_equal(
-            normalize_weight(awb.get("gross_weight")),
-            total_weight
-        )
+        pieces_match = total_pieces == (awb_f.pieces or 0)
+        weight_match = _weights_approximately_equal(awb_f.weight, total_weight)
 
 
         return (
@@ -168,15 +273,13 @@ def match_mbag_after_sales_parts(awb, inv, all_invoices=None, **kwargs):
     # ------------------
     # SINGLE MODE
     # ------------------
-    inv_num = str(inv.get("invoice_number", "")).strip()
+    inv_f = _features(inv)
+    inv_num = inv_f.invoice_number_raw
     if inv_num not in awb_inv_nums:
         return False, {"reason": "invoice_not_in_awb"}, match_scope
 
-    pieces_match = inv.get("no_pieces") == awb.get("no_pieces")
-    weight_match = _weights_approximately_equal(
-        inv.get("gross_weight"),
-        awb.get("gross_weight")
-    )
+    pieces_match = inv_f.pieces == awb_f.pieces
+    weight_match = _weights_approximately_equal(inv_f.weight_raw, awb_f.weight_raw)
 
     return (
         pieces_match and weight_match,
@@ -201,33 +304,28 @@ def match_mbag_cbu(awb, inv, **kwargs):
     }, MATCH_SCOPE_SINGLE
 
 def match_mbusa_cbu(awb, inv, **kwargs):
-    shipper_add = str(_get(awb, 'shipper_add', '')).lower()
+    shipper_add = _features(awb).shipper_add
     if not any(x in shipper_add for x in ["us", "usa", "united states"]):
         return False, {"shipper_add_check": False}, MATCH_SCOPE_SINGLE
  
     return match_mbag_cbu(awb, inv)
 
 def match_mbusI(awb, inv, all_invoices=None, **kwargs):
-    awb_inv_nums = set(
-        normalize_invoice_number(x)
-        for x in (awb.get("invoice_numbers") or [])
-    )
+    awb_f = _features(awb)
+    awb_inv_nums = awb_f.invoice_numbers
 
     # GROUP
     if len(awb_inv_nums) > 1:
         related = [
-            i for i in (all_invoices or [])
-            if normalize_invoice_number(i.get("invoice_number")) in awb_inv_nums
+            _features(i) for i in (all_invoices or [])
+            if _features(i).invoice_number in awb_inv_nums
         ]
 
-        total_pieces = sum(i.get("no_pieces") or 0 for i in related)
-        total_weight = sum(normalize_weight(i.get("gross_weight")) for i in related)
+        total_pieces = sum(i.pieces or 0 for i in related)
+        total_weight = sum(i.weight for i in related)
 
-        pieces_match = total_pieces == (awb.get("no_pieces") or 0)
-        weight_match = _weights_approximately_equal(
-            normalize_weight(awb.get("gross_weight")),
-            total_weight
-        )
+        pieces_match = total_pieces == (awb_f.pieces or 0)
+        weight_match = _weights_approximately_equal(awb_f.weight, total_weight)
 
         return (
             pieces_match and weight_match,
@@ -241,16 +339,14 @@ def match_mbusI(awb, inv, all_invoices=None, **kwargs):
         )
 
     # SINGLE
-    inv_num = normalize_invoice_number(inv.get("invoice_number"))
+    inv_f = _features(inv)
+    inv_num = inv_f.invoice_number
     if awb_inv_nums and inv_num not in awb_inv_nums:
         return False, {"reason": "invoice_not_in_awb"}, MATCH_SCOPE_SINGLE
 
     hawb_match = _get(awb, 'hawb') == _get(inv, 'container_number')
-    pieces_match = _get(awb, 'no_pieces') == _get(inv, 'no_pieces')
-    weight_match = _weights_approximately_equal(
-        _get(awb, 'gross_weight'),
-        _get(inv, 'gross_weight')
-    )
+    pieces_match = awb_f.pieces == inv_f.pieces
+    weight_match = _weights_approximately_equal(awb_f.weight_raw, inv_f.weight_raw)
 
     return (
         hawb_match and pieces_match and weight_match,
@@ -264,26 +360,21 @@ def match_mbusI(awb, inv, all_invoices=None, **kwargs):
     )
 
 def match_bbac_production_parts(awb, inv, all_invoices=None, **kwargs):
-    awb_inv_nums = set(
-        normalize_invoice_number(x)
-        for x in (awb.get("invoice_numbers") or [])
-    )
+    awb_f = _features(awb)
+    awb_inv_nums = awb_f.invoice_numbers
 
     # GROUP
     if len(awb_inv_nums) > 1:
         related = [
-            i for i in (all_invoices or [])
-            if normalize_invoice_number(i.get("invoice_number")) in awb_inv_nums
+            _features(i) for i in (all_invoices or [])
+            if _features(i).invoice_number in awb_inv_nums
         ]
 
-        total_pieces = sum(i.get("no_pieces") or 0 for i in related)
-        total_weight = sum(normalize_weight(i.get("gross_weight")) for i in related)
+        total_pieces = sum(i.pieces or 0 for i in related)
+        total_weight = sum(i.weight for i in related)
 
-        pieces_match = total_pieces == (awb.get("no_pieces") or 0)
-        weight_match = _weights_approximately_equal(
-            normalize_weight(awb.get("gross_weight")),
-            total_weight
-        )
+        pieces_match = total_pieces == (awb_f.pieces or 0)
+        weight_match = _weights_approximately_equal(awb_f.weight, total_weight)
 
         return (
             pieces_match and weight_match,
@@ -298,17 +389,15 @@ def match_bbac_production_parts(awb, inv, all_invoices=None, **kwargs):
         )
 
     # SINGLE
-    inv_num = normalize_invoice_number(inv.get("invoice_number"))
+    inv_f = _features(inv)
+    inv_num = inv_f.invoice_number
     if awb_inv_nums and inv_num not in awb_inv_nums:
         return False, {"reason": "invoice_not_in_awb"}, MATCH_SCOPE_SINGLE
 
     invoice_match = inv_num.startswith("150")
     hawb_match = _get(awb, 'hawb') == _get(inv, 'hawb')
-    pieces_match = _get(awb, 'no_pieces') == _get(inv, 'no_pieces')
-    weight_match = _weights_approximately_equal(
-        _get(awb, 'gross_weight'),
-        _get(inv, 'gross_weight')
-    )
+    pieces_match = awb_f.pieces == inv_f.pieces
+    weight_match = _weights_approximately_equal(awb_f.weight_raw, inv_f.weight_raw)
 
     return (
         invoice_match and hawb_match and pieces_match and weight_match,
@@ -324,26 +413,21 @@ def match_bbac_production_parts(awb, inv, all_invoices=None, **kwargs):
 
 
 def match_bbac_after_sales(awb, inv, all_invoices=None, **kwargs):
-    awb_inv_nums = set(
-        normalize_invoice_number(x)
-        for x in (awb.get("invoice_numbers") or [])
-    )
+    awb_f = _features(awb)
+    awb_inv_nums = awb_f.invoice_numbers
 
     # GROUP
     if len(awb_inv_nums) > 1:
         related = [
-            i for i in (all_invoices or [])
-            if normalize_invoice_number(i.get("invoice_number")) in awb_inv_nums
+            _features(i) for i in (all_invoices or [])
+            if _features(i).invoice_number in awb_inv_nums
         ]
 
-        total_pieces = sum(i.get("no_pieces") or 0 for i in related)
-        total_weight = sum(normalize_weight(i.get("gross_weight")) for i in related)
+        total_pieces = sum(i.pieces or 0 for i in related)
+        total_weight = sum(i.weight for i in related)
 
-        pieces_match = total_pieces == (awb.get("no_pieces") or 0)
-        weight_match = _weights_approximately_equal(
-            normalize_weight(awb.get("gross_weight")),
-            total_weight
-        )
+        pieces_match = total_pieces == (awb_f.pieces or 0)
+        weight_match = _weights_approximately_equal(awb_f.weight, total_weight)
 
         return (
             pieces_match and weight_match,
@@ -357,16 +441,14 @@ def match_bbac_after_sales(awb, inv, all_invoices=None, **kwargs):
         )
 
     # SINGLE
-    inv_num = normalize_invoice_number(inv.get("invoice_number"))
+    inv_f = _features(inv)
+    inv_num = inv_f.invoice_number
     if awb_inv_nums and inv_num not in awb_inv_nums:
         return False, {"reason": "invoice_not_in_awb"}, MATCH_SCOPE_SINGLE
 
     invoice_match = inv_num.startswith("1106")
-    pieces_match = _get(awb, 'no_pieces') == _get(inv, 'no_pieces')
-    weight_match = _weights_approximately_equal(
-        _get(awb, 'gross_weight'),
-        _get(inv, 'gross_weight')
-    )
+    pieces_match = awb_f.pieces == inv_f.pieces
+    weight_match = _weights_approximately_equal(awb_f.weight_raw, inv_f.weight_raw)
 
     return (
         invoice_match and pieces_match and weight_match,
@@ -382,31 +464,26 @@ def match_bbac_after_sales(awb, inv, all_invoices=None, **kwargs):
 
 # REVISED
 def match_mb_parts_logistics_apac(awb, inv, all_invoices=None, **kwargs):
-    awb_inv_nums = set(
-        normalize_invoice_number(x)
-        for x in (awb.get("invoice_numbers") or [])
-    )
+    awb_f = _features(awb)
+    awb_inv_nums = awb_f.invoice_numbers
 
     # ------------------
     # GROUP MODE
     # ------------------
     if len(awb_inv_nums) > 1:
         related = [
-            i for i in (all_invoices or [])
-            if normalize_invoice_number(i.get("invoice_number")) in awb_inv_nums
+            _features(i) for i in (all_invoices or [])
+            if _features(i).invoice_number in awb_inv_nums
         ]
 
         if not related:
             return False, {"reason": "no_related_invoices"}, MATCH_SCOPE_GROUP
 
-        total_pieces = sum(i.get("no_pieces") or 0 for i in related)
-        total_weight = sum(normalize_weight(i.get("gross_weight")) for i in related)
+        total_pieces = sum(i.pieces or 0 for i in related)
+        total_weight = sum(i.weight for i in related)
 
-        pieces_match = total_pieces == (awb.get("no_pieces") or 0)
-        weight_match = _weights_approximately_equal(
-            normalize_weight(awb.get("gross_weight")),
-            total_weight
-        )
+        pieces_match = total_pieces == (awb_f.pieces or 0)
+        weight_match = _weights_approximately_equal(awb_f.weight, total_weight)
 
         return (
             pieces_match and weight_match,
@@ -424,17 +501,15 @@ def match_mb_parts_logistics_apac(awb, inv, all_invoices=None, **kwargs):
     # ------------------
     # SINGLE MODE
     # ------------------
-    inv_num = normalize_invoice_number(inv.get("invoice_number"))
+    inv_f = _features(inv)
+    inv_num = inv_f.invoice_number
 
     if awb_inv_nums and inv_num not in awb_inv_nums:
         return False, {"reason": "invoice_not_in_awb"}, MATCH_SCOPE_SINGLE
 
     invoice_match = inv_num.startswith("1100")
-    pieces_match = _get(awb, 'no_pieces') == _get(inv, 'no_pieces')
-    weight_match = _weights_approximately_equal(
-        _get(awb, 'gross_weight'),
-        _get(inv, 'gross_weight')
-    )
+    pieces_match = awb_f.pieces == inv_f.pieces
+    weight_match = _weights_approximately_equal(awb_f.weight_raw, inv_f.weight_raw)
 
     return (
         invoice_match and pieces_match and weight_match,
@@ -463,28 +538,251 @@ CATEGORY_MATCHERS = {
 # LOADING JSON BLOCKS FROM .TXT
 # ============================================================================
 
-def load_json_blocks(path: str) -> List[Dict[str, Any]]:
+def load_json_blocks(path: str, end: Optional[int] = None) -> List[Dict[str, Any]]:
     if not os.path.exists(path):
         print(f"ERROR: File not found → {path}")
         return []
 
-    with open(path, "r", encoding="utf-8") as f:
-        raw = f.read()
+    return list(iter_records(path, end=end))
 
-    blocks = raw.split("--------------------------------------------------------------------------------")
-    json_objects = []
 
-    for b in blocks:
-        b = b.strip()
-        if not b:
-            continue
+# ============================================================================
+# INVOICE INDEX
+# ============================================================================
+
+# Invoice fields the index is keyed on. The invoice number is normalized,
+# the other fields are kept as-is because the matchers compare them exactly.
+INDEX_KEYS = ["invoice_number", "vin_no", "order_no", "hawb", "container_number"]
+
+ALL_INVOICES = "ALL"
+
+# Where each category finds its candidates:
+#   (narrow by AWB invoice_numbers?, fallback when the AWB lists none)
+# The fallback is (invoice index key, AWB field), ALL_INVOICES or None
+# (None → the matcher can never match without invoice numbers).
+CATEGORY_CANDIDATES = {
+    "MBAG Production Parts": (True, ALL_INVOICES),
+    "MBAG After Sales Parts": (True, None),
+    "MBAG CBU": (False, ("vin_no", "vin_no")),
+    "MBUSA CBU": (False, ("vin_no", "vin_no")),
+    "MBUSI": (True, ("container_number", "hawb")),
+    "BBAC Production Parts": (True, ("hawb", "hawb")),
+    "BBAC After Sales Parts": (True, ALL_INVOICES),
+    "MB Parts Logistics APAC": (True, ALL_INVOICES)
+}
+
+
+def build_invoice_index(invoices: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Build one lookup table per INDEX_KEYS field: value → positions in `invoices`.
+    Positions are ascending, so candidates come back in load order.
+    Also holds the pieces/weight columns used by screen_single_candidates.
+    """
+    index = {key: {} for key in INDEX_KEYS}
+
+    for pos, entry in enumerate(invoices):
+        inv = entry["invoice"]
+        index["invoice_number"].setdefault(_features(inv).invoice_number, []).append(pos)
+
+        for key in INDEX_KEYS[1:]:
+            value = inv.get(key)
+            try:
+                index[key].setdefault(value, []).append(pos)
+            except TypeError:
+                continue  # unhashable (list/dict) values can never equal an AWB field
+
+    index["columns"] = _build_columns(invoices)
+    return index
+
+
+def _lookup(table, value):
+    try:
+        return table.get(value, [])
+    except TypeError:
+        return []
+
+
+def candidate_positions(awb_core: Dict[str, Any], category: str, index, invoice_count: int) -> List[int]:
+    """Positions of the invoices `category`'s matcher could possibly accept for this AWB."""
+    use_numbers, fallback = CATEGORY_CANDIDATES.get(category, (False, ALL_INVOICES))
+
+    if use_numbers:
+        awb_inv_nums = _features(awb_core).invoice_numbers
+        if awb_inv_nums:
+            positions = set()
+            for num in awb_inv_nums:
+                positions.update(index["invoice_number"].get(num, []))
+            return sorted(positions)
+
+    if fallback is None:
+        return []
+    if fallback == ALL_INVOICES:
+        return list(range(invoice_count))
+
+    index_key, awb_field = fallback
+    return list(_lookup(index[index_key], awb_core.get(awb_field)))
+
+
+# ============================================================================
+# VECTORIZED SINGLE SCREENING
+# ============================================================================
+
+# Categories whose SINGLE match always requires equal pieces AND weight within ±1.0
+SINGLE_SCREENED_CATEGORIES = {
+    "MBAG Production Parts",
+    "MBAG After Sales Parts",
+    "MBUSI",
+    "BBAC Production Parts",
+    "BBAC After Sales Parts",
+    "MB Parts Logistics APAC"
+}
+
+# Below this many candidates the per-pair matcher is cheaper than NumPy setup
+SCREEN_MIN_CANDIDATES = 32
+
+# int64 codes for the pieces column. The matchers compare raw no_pieces with ==,
+# so a code must be equal exactly when the raw values are:
+#   None                   PIECES_MISSING (None == None is a pieces match)
+#   int / whole float      the number (5 == 5.0)
+#   anything else          PIECES_OTHER: "5", 2.5, "abc" never equal an int or None;
+#                          an AWB with such a value is not screened at all
+PIECES_MISSING = -(2 ** 63)
+PIECES_OTHER = -(2 ** 63) + 1
+
+
+def _pieces_code(value) -> int:
+    if value is None:
+        return PIECES_MISSING
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    if not isinstance(value, int):
+        return PIECES_OTHER
+    if not PIECES_OTHER < value < 2 ** 63:
+        raise OverflowError(value)
+    return value
+
+
+def _build_columns(invoices):
+    if np is None:
+        return None
+
+    feats = [_features(i["invoice"]) for i in invoices]
+    try:
+        pieces = np.array([_pieces_code(f.pieces) for f in feats], dtype=np.int64)
+    except OverflowError:
+        return None  # absurd piece counts: leave them to the Python matchers
+
+    return {
+        "pieces": pieces,
+        "weight_raw": np.array([f.weight_raw for f in feats], dtype=np.float64)
+    }
+
+
+def screen_single_candidates(awb_core, positions: List[int], index, tolerance=1.0) -> List[int]:
+    """
+    Keep only the candidate positions whose pieces equal the AWB's and whose
+    weight is within `tolerance`, in one NumPy pass. Uses the same NaN-for-
+    non-numeric weights as the matchers, so survivors are exactly the pairs
+    that can still pass the SINGLE checks.
+    """
+    columns = index.get("columns")
+    if columns is None or len(positions) < SCREEN_MIN_CANDIDATES:
+        return positions
+
+    awb_f = _features(awb_core)
+    try:
+        awb_pieces = _pieces_code(awb_f.pieces)
+    except OverflowError:
+        return positions
+    if awb_pieces == PIECES_OTHER:
+        return positions  # only == on the raw values can tell
+
+    pos = np.asarray(positions, dtype=np.intp)
+    mask = (columns["pieces"][pos] == awb_pieces) & (
+        np.abs(columns["weight_raw"][pos] - awb_f.weight_raw) <= tolerance
+    )
+    return pos[mask].tolist()
+
+
+# ============================================================================
+# RUN STATISTICS
+# ============================================================================
+
+MATCH_STATS_FILE = "match_stats.json"
+PROFILE_FILE = "match_profile.pstats"
+
+CATEGORY_COUNTERS = [
+    "awbs",             # AWBs of this category matched
+    "candidates",       # invoices offered by the index (before screening)
+    "screened_out",     # removed by the NumPy SINGLE screen
+    "matcher_calls",
+    "matcher_seconds",
+    "group_scope",      # AWBs the matcher put in GROUP mode
+    "single_scope",
+    "group_matches",    # AWBs matched as a group
+    "single_matches"    # invoices matched one by one
+]
+
+
+class MatchStats:
+    """Per-category counters and per-phase timings of one run (→ match_stats.json)."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.phases = {}
+        self.categories = {}
+        self.counters = {}
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
         try:
-            obj = json.loads(b)
-            json_objects.append(obj)
-        except json.JSONDecodeError:
-            continue
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - started
+
+    def category(self, name) -> Dict[str, Any]:
+        key = str(name)
+        if key not in self.categories:
+            self.categories[key] = {c: 0 for c in CATEGORY_COUNTERS}
+            self.categories[key]["matcher_seconds"] = 0.0
+        return self.categories[key]
+
+    def count(self, name: str, n: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def merge(self, other: Dict[str, Any]):
+        """Add the as_dict() of another MatchStats (a worker shard)."""
+        for name, seconds in other.get("phases", {}).items():
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+        for name, values in other.get("categories", {}).items():
+            mine = self.category(name)
+            for key, value in values.items():
+                mine[key] = mine.get(key, 0) + value
+        for name, value in other.get("counters", {}).items():
+            self.count(name, value)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "phases": dict(self.phases),
+            "categories": {k: dict(v) for k, v in self.categories.items()},
+            "counters": dict(self.counters)
+        }
 
-    return json_objects
+    def save(self, path: str, **extra):
+        summary = {"generated": datetime.now().isoformat(), **extra, **self.as_dict()}
+        for values in summary["categories"].values():
+            values["matcher_seconds"] = round(values["matcher_seconds"], 6)
+        summary["phases"] = {k: round(v, 6) for k, v in summary["phases"].items()}
+
+        with atomic_write(path) as f:
+            json.dump(summary, f, indent=2)
+
+
+# Collects the current run; match_awb_with_invoices adds to it unless given its own
+MATCH_STATS = MatchStats()
 
 
 # ============================================================================
@@ -574,41 +872,59 @@ def load_json_blocks(path: str) -> List[Dict[str, Any]]:
 #         "classification": classification,
 #         "matched_invoices": results
 #     }
-def match_awb_with_invoices(awb: Dict[str, Any], invoices: List[Dict[str, Any]]) -> Dict[str, Any]:
+def match_awb_with_invoices(awb: Dict[str, Any], invoices: List[Dict[str, Any]], invoice_index=None, stats=None) -> Dict[str, Any]:
     awb_core = awb["awb"]
     classification = awb_core.get("classification", {})
 
     category = classification.get("category")
     matcher = CATEGORY_MATCHERS.get(category)
+    stats = stats or MATCH_STATS
 
     if not matcher:
+        stats.count("awbs_without_matcher")
         return {
             "awb_file": awb["_source_file"],
             "error": f"No matching function for category '{category}'",
             "matched_invoices": []
         }
 
+    if invoice_index is None:
+        invoice_index = build_invoice_index(invoices)
+
+    # Only the invoices this category could accept are ever shown to the matcher
+    positions = candidate_positions(awb_core, category, invoice_index, len(invoices))
+    candidates = [invoices[pos] for pos in positions]
+    candidate_cores = [i["invoice"] for i in candidates]
+
+    counters = stats.category(category)
+    counters["awbs"] += 1
+    counters["candidates"] += len(positions)
+
     results = []
     seen_invoices = set()  # Tracks (invoice_number, invoice_file) tuples to prevent duplicates
 
     # ------------------------------------------------
     # FIRST: Check if this category supports GROUP
     # ------------------------------------------------
+    started = time.perf_counter()
     matched, details, scope = matcher(
         awb_core,
         {},  # dummy invoice
-        all_invoices=[i["invoice"] for i in invoices]
+        all_invoices=candidate_cores
     )
+    counters["matcher_calls"] += 1
+    counters["matcher_seconds"] += time.perf_counter() - started
+    counters["group_scope" if scope == MATCH_SCOPE_GROUP else "single_scope"] += 1
 
     # ------------------
     # GROUP MATCH
     # ------------------
     if matched and scope == MATCH_SCOPE_GROUP:
-        awb_inv_nums = set(normalize_invoice_number(x) for x in (awb_core.get("invoice_numbers") or []))
+        awb_inv_nums = _features(awb_core).invoice_numbers
 
-        for i in invoices:
+        for i in candidates:
             inv_i = i["invoice"]
-            inv_num = normalize_invoice_number(inv_i.get("invoice_number"))
+            inv_num = _features(inv_i).invoice_number
             key = (inv_num, i["_source_file"].lower())
 
             if inv_num in awb_inv_nums and key not in seen_invoices:
@@ -619,6 +935,7 @@ def match_awb_with_invoices(awb: Dict[str, Any], invoices: List[Dict[str, Any]])
                     "details": details
                 })
 
+        counters["group_matches"] += 1
         return {
             "awb_file": awb["_source_file"],
             "hawb": awb_core.get("hawb"),
@@ -629,9 +946,17 @@ def match_awb_with_invoices(awb: Dict[str, Any], invoices: List[Dict[str, Any]])
     # ------------------
     # SINGLE MATCH
     # ------------------
-    for inv in invoices:
+    # Scope depends on the AWB only: a failed GROUP check cannot turn into a SINGLE match
+    if scope == MATCH_SCOPE_GROUP:
+        candidates = []
+    elif category in SINGLE_SCREENED_CATEGORIES:
+        candidates = [invoices[pos] for pos in screen_single_candidates(awb_core, positions, invoice_index)]
+        counters["screened_out"] += len(positions) - len(candidates)
+
+    started = time.perf_counter()
+    for inv in candidates:
         inv_core = inv["invoice"]
-        inv_num = normalize_invoice_number(inv_core.get("invoice_number"))
+        inv_num = _features(inv_core).invoice_number
         key = (inv_num, inv["_source_file"].lower())
 
         if key in seen_invoices:
@@ -640,8 +965,9 @@ def match_awb_with_invoices(awb: Dict[str, Any], invoices: List[Dict[str, Any]])
         matched, details, scope = matcher(
             awb_core,
             inv_core,
-            all_invoices=[i["invoice"] for i in invoices]
+            all_invoices=candidate_cores
         )
+        counters["matcher_calls"] += 1
 
         if not matched or scope != MATCH_SCOPE_SINGLE:
             continue
@@ -654,6 +980,8 @@ def match_awb_with_invoices(awb: Dict[str, Any], invoices: List[Dict[str, Any]])
             "details": details
         })
 
+    counters["matcher_seconds"] += time.perf_counter() - started
+    counters["single_matches"] += len(results)
     return {
         "awb_file": awb["_source_file"],
         "hawb": awb_core.get("hawb"),
@@ -661,18 +989,781 @@ def match_awb_with_invoices(awb: Dict[str, Any], invoices: List[Dict[str, Any]])
         "matched_invoices": results
     }
 
+# ============================================================================
+# PARALLEL MATCHING
+# ============================================================================
+
+# Categories with more AWBs than this are split further by a hash of the file name
+MIN_SHARD_SIZE = 50
+
+# Read-only invoice data, set once per worker process by _init_match_worker
+_worker_invoices = None
+_worker_index = None
+
+
+def _init_match_worker(invoices):
+    global _worker_invoices, _worker_index
+    _worker_invoices = invoices
+    _worker_index = build_invoice_index(invoices)
+
+
+def _match_shard(shard):
+    stats = MatchStats()
+    results = [
+        (pos, match_awb_with_invoices(awb, _worker_invoices, _worker_index, stats))
+        for pos, awb in shard
+    ]
+    return results, stats.as_dict()
+
+
+def shard_awbs(awbs: List[Dict[str, Any]], shard_size: int) -> List[List[tuple]]:
+    """
+    Group (position, awb) pairs by classification category; categories larger
+    than `shard_size` are split into buckets by a stable hash of the source file.
+    """
+    by_category = {}
+    for pos, awb in enumerate(awbs):
+        category = awb["awb"].get("classification", {}).get("category")
+        by_category.setdefault(str(category), []).append((pos, awb))
+
+    shards = []
+    for category in sorted(by_category):
+        items = by_category[category]
+        if len(items) <= shard_size:
+            shards.append(items)
+            continue
+
+        buckets = [[] for _ in range(math.ceil(len(items) / shard_size))]
+        for pos, awb in items:
+            bucket = zlib.crc32(awb["_source_file"].encode("utf-8")) % len(buckets)
+            buckets[bucket].append((pos, awb))
+        shards.extend(b for b in buckets if b)
+
+    return shards
+
+
+def match_awbs_parallel(awbs: List[Dict[str, Any]], invoices: List[Dict[str, Any]], workers: int) -> List[Dict[str, Any]]:
+    """
+    Same results, in the same order, as calling match_awb_with_invoices on each
+    AWB in turn. Invoices are handed to each worker once (initializer), not per shard.
+    """
+    shard_size = max(MIN_SHARD_SIZE, math.ceil(len(awbs) / (workers * 4)))
+    shards = shard_awbs(awbs, shard_size)
+    results = [None] * len(awbs)
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_match_worker,
+        initargs=(invoices,)
+    ) as pool:
+        for shard_results, shard_stats in pool.map(_match_shard, shards):
+            for pos, result in shard_results:
+                results[pos] = result
+            MATCH_STATS.merge(shard_stats)
+
+    return results
+
+
+def match_awbs(awbs: List[Dict[str, Any]], invoices: List[Dict[str, Any]], invoice_index, workers: int = 1) -> List[Dict[str, Any]]:
+    """One result per AWB, in order; in a process pool when `workers` > 1 and there is enough work."""
+    if workers > 1 and len(awbs) > MIN_SHARD_SIZE:
+        print(f"Matching {len(awbs)} AWBs in {workers} processes...")
+        return match_awbs_parallel(awbs, invoices, workers)
+
+    return [match_awb_with_invoices(awb, invoices, invoice_index) for awb in awbs]
+
+
+# ============================================================================
+# INCREMENTAL MATCH STATE
+# ============================================================================
+
+MATCH_STATE_FILE = "match_state.json"
+MATCH_STATE_VERSION = 1
+
+
+def record_key(entry: Dict[str, Any]) -> str:
+    """Identifies one extraction: a re-dropped PDF gets a new timestamp → new key."""
+    return f"{entry.get('_source_file')}|{entry.get('_timestamp')}"
+
+
+def load_match_state(path: str) -> Dict[str, set]:
+    state = {"awbs": set(), "invoices": set()}
+
+    if not os.path.exists(path):
+        return state
+
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            raw = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"[WARN] Ignoring unreadable match state ({e}) → full rematch")
+        return state
+
+    if raw.get("version") != MATCH_STATE_VERSION:
+        print("[WARN] Match state version changed → full rematch")
+        return state
+
+    state["awbs"] = set(raw.get("awbs", []))
+    state["invoices"] = set(raw.get("invoices", []))
+    return state
+
+
+def save_match_state(path: str, awbs: List[Dict[str, Any]], invoices: List[Dict[str, Any]]):
+    """Every loaded AWB has now been evaluated against every loaded invoice."""
+    with atomic_write(path) as f:
+        json.dump({
+            "version": MATCH_STATE_VERSION,
+            "awbs": sorted(record_key(a) for a in awbs),
+            "invoices": sorted(record_key(i) for i in invoices)
+        }, f)
+
+
+def select_awbs_to_match(awbs, invoices, invoice_index, already_processed_awbs, previous_awb_files, state=None):
+    """
+    AWBs that need a matching pass this run.
+
+    Without state: every AWB not already matched (the full rematch).
+    With state: new AWBs (checked against all invoices) plus open AWBs that
+    have at least one new invoice among their candidates, or that a new
+    invoice could match in the fuzzy or consolidation pass (see
+    reopened_by_second_chance). The open AWB is then rematched against all
+    invoices, so GROUP totals still see every member.
+    """
+    pending = [a for a in awbs if a["_source_file"] not in already_processed_awbs]
+
+    if state is None:
+        return pending
+
+    new_positions = {
+        pos for pos, inv in enumerate(invoices)
+        if record_key(inv) not in state["invoices"]
+    }
+
+    selected = []
+    reopened = 0
+    still_open = []
+
+    for awb in pending:
+        if record_key(awb) not in state["awbs"] or awb["_source_file"] not in previous_awb_files:
+            selected.append(awb)
+            continue
+
+        awb_core = awb["awb"]
+        category = awb_core.get("classification", {}).get("category")
+        if category not in CATEGORY_MATCHERS or not new_positions:
+            continue
+
+        if not new_positions.isdisjoint(candidate_positions(awb_core, category, invoice_index, len(invoices))):
+            selected.append(awb)
+            reopened += 1
+        else:
+            still_open.append(awb)
+
+    if still_open:
+        second_chance = reopened_by_second_chance(still_open, invoices, invoice_index, new_positions)
+        selected.extend(a for a in still_open if a["_source_file"] in second_chance)
+        reopened += len(second_chance)
+
+    print(f"Incremental: {len(new_positions)} new invoices, "
+          f"{len(selected) - reopened} new AWBs, {reopened} open AWBs rechecked")
+    return selected
+
+
+def reopened_by_second_chance(open_awbs, invoices, invoice_index, new_positions) -> set:
+    """
+    Source files of open AWBs that none of the new invoices is an exact
+    candidate for, but that the second-chance passes could now match:
+
+        fuzzy           a number the AWB lists that is not on file is within
+                        FUZZY_MAX_DISTANCE edits of a new invoice number
+        consolidation   a new invoice joined the AWB's pool (its prefix,
+                        pieces and weight set, inside the date window)
+    """
+    new = sorted(new_positions)
+    new_f = [_features(invoices[pos]["invoice"]) for pos in new]
+    known = invoice_index["invoice_number"]
+    reopened = set()
+
+    # Fuzzy: distances to the new invoice numbers only
+    missing = {}
+    for awb in open_awbs:
+        category = awb["awb"].get("classification", {}).get("category")
+        if CATEGORY_CANDIDATES.get(category, (False, None))[0]:
+            missing[awb["_source_file"]] = [n for n in _features(awb["awb"]).invoice_numbers if n and n not in known]
+    near = fuzzy_invoice_candidates(
+        [n for numbers in missing.values() for n in numbers],
+        {"invoice_number": {f.invoice_number for f in new_f}}
+    )
+    reopened.update(source_file for source_file, numbers in missing.items() if any(near.get(n) for n in numbers))
+
+    # Consolidation: the same pool conditions as consolidate_unmatched_groups
+    for awb in open_awbs:
+        if awb["_source_file"] in reopened:
+            continue
+        awb_core = awb["awb"]
+        category = awb_core.get("classification", {}).get("category")
+        if category not in CONSOLIDATION_PREFIXES:
+            continue
+
+        awb_f = _features(awb_core)
+        if not any(n in known for n in awb_f.invoice_numbers):
+            continue  # nothing it lists is on file: the pass skips it
+        prefix = CONSOLIDATION_PREFIXES[category] or _shared_prefix(awb_f.invoice_numbers)
+        if not prefix:
+            continue
+
+        awb_date = _awb_date(awb_core)
+        for pos, f in zip(new, new_f):
+            if not f.invoice_number.startswith(prefix) or not (f.pieces_int or 0) > 0 or f.weight <= 0:
+                continue
+            inv_date = parse_document_date(invoices[pos]["invoice"].get("invoice_date"))
+            if awb_date and inv_date and not (
+                awb_date - timedelta(days=CONSOLIDATION_DAYS_BEFORE) <= inv_date <= awb_date + timedelta(days=CONSOLIDATION_DAYS_AFTER)
+            ):
+                continue
+            reopened.add(awb["_source_file"])
+            break
+
+    return reopened
+
+
+# ============================================================================
+# FUZZY INVOICE NUMBERS (one or two OCR'd digits wrong)
+# ============================================================================
+
+FUZZY_MAX_DISTANCE = 2   # Levenshtein edits between AWB and invoice number
+FUZZY_MIN_LENGTH = 6     # shorter numbers are too easy to hit by accident
+FUZZY_BATCH_SIZE = 256   # query rows per cdist call (rows × invoices uint8 matrix)
+
+
+def fuzzy_invoice_candidates(numbers, invoice_index, max_distance: int = FUZZY_MAX_DISTANCE,
+                             batch_size: int = FUZZY_BATCH_SIZE) -> Dict[str, List[tuple]]:
+    """
+    For each normalized number, the indexed invoice numbers within
+    `max_distance` edits, as (invoice_number, distance) sorted by distance.
+    Scored with rapidfuzz cdist in batches of `batch_size` query rows, so
+    memory stays at batch_size × invoices bytes however many are asked.
+    """
+    queries = sorted({n for n in numbers if len(n) >= FUZZY_MIN_LENGTH})
+    choices = [n for n in invoice_index["invoice_number"] if n]
+    found = {n: [] for n in queries}
+
+    if fuzz_process is None or not queries or not choices:
+        return found
+
+    for start in range(0, len(queries), batch_size):
+        batch = queries[start:start + batch_size]
+        dist = fuzz_process.cdist(
+            batch, choices,
+            scorer=Levenshtein.distance,
+            score_cutoff=max_distance,
+            dtype=np.uint8,
+            workers=-1
+        )
+        for row, col in zip(*np.nonzero(dist <= max_distance)):
+            found[batch[row]].append((choices[col], int(dist[row, col])))
+
+    for candidates in found.values():
+        candidates.sort(key=lambda c: (c[1], c[0]))
+    return found
+
+
+def _fuzzy_corrections(missing, candidates, taken=frozenset()) -> Dict[str, tuple]:
+    # Only an unambiguous nearest number counts as a correction
+    corrections = {}
+    for num in missing:
+        options = candidates.get(num, [])
+        if not options:
+            continue
+        best = options[0][1]
+        nearest = [c for c in options if c[1] == best]
+        if len(nearest) != 1:
+            continue
+        if nearest[0][0] in taken:
+            continue  # already another AWB's invoice: one invoice is never matched twice
+        corrections[num] = nearest[0]
+    return corrections
+
+
+def fuzzy_rematch_unmatched(results: List[Dict[str, Any]], awbs: List[Dict[str, Any]],
+                            invoices: List[Dict[str, Any]], invoice_index, awb_files=None) -> int:
+    """
+    Rematch AWBs that found nothing after replacing invoice numbers that are
+    not on file with their single nearest invoice number (≤ FUZZY_MAX_DISTANCE
+    edits). A correction to an invoice that is already matched to an AWB is
+    dropped. The category matcher still checks pieces/weight/etc.
+    as usual; matches made this way carry "fuzzy_invoice_number": True in
+    details. Only AWBs in `awb_files` are tried (None = every unmatched AWB).
+    Updates `results` in place and returns the number of AWBs rematched.
+    """
+    if fuzz_process is None or np is None:
+        print("[WARN] rapidfuzz/numpy not installed → fuzzy invoice-number pass skipped")
+        return 0
+
+    awb_by_file = {a["_source_file"]: a for a in awbs}
+    known = invoice_index["invoice_number"]
+
+    # Unmatched AWBs whose category narrows by invoice number, with numbers not on file
+    pending = []
+    for pos, result in enumerate(results):
+        if result.get("matched_invoices") or result.get("error"):
+            continue
+        if awb_files is not None and result["awb_file"] not in awb_files:
+            continue
+
+        awb = awb_by_file.get(result["awb_file"])
+        if awb is None:
+            continue
+
+        category = awb["awb"].get("classification", {}).get("category")
+        if not CATEGORY_CANDIDATES.get(category, (False, None))[0]:
+            continue
+
+        missing = [n for n in _features(awb["awb"]).invoice_numbers if n and n not in known]
+        if missing:
+            pending.append((pos, awb, missing))
+
+    if not pending:
+        return 0
+
+    # Invoices matched to some AWB (grows with every rematch below)
+    taken = {
+        normalize_invoice_number(m.get("invoice_number"))
+        for r in results
+        for m in r.get("matched_invoices", [])
+    }
+
+    # The rematches are not counted again in MATCH_STATS (their first attempt already is)
+    rematch_stats = MatchStats()
+
+    candidates = fuzzy_invoice_candidates(
+        [n for _, _, missing in pending for n in missing],
+        invoice_index
+    )
+
+    rematched = 0
+    for pos, awb, missing in pending:
+        corrections = _fuzzy_corrections(missing, candidates, taken)
+        if not corrections:
+            continue
+
+        # Corrected copy of the AWB: numbers replaced by the invoice's own spelling
+        core = {k: v for k, v in awb["awb"].items() if k != "_features"}
+        replaced = []
+        for x in core.get("invoice_numbers") or []:
+            fix = corrections.get(normalize_invoice_number(x))
+            if fix:
+                x = invoices[known[fix[0]][-1]]["invoice"].get("invoice_number")
+            replaced.append(x)
+        core["invoice_numbers"] = replaced
+        core["_features"] = compute_features(core)
+
+        result = match_awb_with_invoices(dict(awb, awb=core), invoices, invoice_index, stats=rematch_stats)
+        if not result["matched_invoices"]:
+            continue
+
+        fuzzy_details = {
+            "fuzzy_invoice_number": True,
+            "fuzzy_corrections": [
+                {"awb_invoice_number": num, "invoice_number": fix[0], "distance": fix[1]}
+                for num, fix in sorted(corrections.items())
+            ]
+        }
+        for m in result["matched_invoices"]:
+            m["details"] = dict(m["details"], **fuzzy_details)
+
+        results[pos] = result
+        taken.update(normalize_invoice_number(m.get("invoice_number")) for m in result["matched_invoices"])
+        rematched += 1
+
+    return rematched
+
+
+# ============================================================================
+# GROUP CONSOLIDATION (invoice numbers missing from the AWB)
+# ============================================================================
+
+# Categories with a GROUP mode → invoice number prefix of their invoices
+# ("" → use the prefix the AWB's listed invoice numbers share; when they do not
+# share one, the AWB is skipped rather than searched against every invoice)
+CONSOLIDATION_PREFIXES = {
+    "MBAG After Sales Parts": "",
+    "MBUSI": "",
+    "BBAC Production Parts": "150",
+    "BBAC After Sales Parts": "1106",
+    "MB Parts Logistics APAC": "1100"
+}
+
+CONSOLIDATION_DAYS_BEFORE = 45      # invoice dated up to 45 days before the AWB ...
+CONSOLIDATION_DAYS_AFTER = 7        # ... or 7 days after it
+CONSOLIDATION_MAX_POOL = 60         # open invoices searched per AWB (closest dates first)
+CONSOLIDATION_MAX_EXTRA = 4         # invoices the search may add to the listed ones
+CONSOLIDATION_NODE_BUDGET = 200000  # subsets tried per AWB
+CONSOLIDATION_TIME_BUDGET = 0.5     # seconds per AWB
+CONSOLIDATION_RUN_BUDGET = 60.0     # seconds for the whole pass
+
+DATE_FORMATS = ["%d-%m-%Y", "%d.%m.%Y", "%d/%m/%Y", "%Y-%m-%d", "%d%b%Y", "%d-%b-%Y", "%d %b %Y", "%d %B %Y"]
+
+
+def parse_document_date(value):
+    if not value:
+        return None
+
+    s = str(value).strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(s, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def _awb_date(awb_core):
+    return parse_document_date(awb_core.get("executed_on_date")) or parse_document_date(awb_core.get("second_flight_date"))
+
+
+def _shared_prefix(numbers, length=3):
+    prefixes = {n[:length] for n in numbers if len(n) >= length}
+    return prefixes.pop() if len(prefixes) == 1 else ""
+
+
+def find_unique_subset(items, pieces_needed: int, weight_needed: float, tolerance: float = 1.0,
+                       max_items: int = CONSOLIDATION_MAX_EXTRA,
+                       node_budget: int = CONSOLIDATION_NODE_BUDGET,
+                       time_budget: float = CONSOLIDATION_TIME_BUDGET):
+    """
+    Find the one subset of `items` ((pieces, weight) pairs, pieces >= 1,
+    weight > 0) whose pieces sum to `pieces_needed` exactly and whose weight
+    is within `tolerance` of `weight_needed`.
+
+    Pruned depth-first search over items sorted by pieces: a branch stops as
+    soon as pieces or weight overshoot, or the items left cannot reach the
+    pieces still needed. Stops at the second solution.
+
+    Returns (indexes, status) with status "unique", "none", "ambiguous"
+    or "budget" (ran out of nodes/time before uniqueness was proven).
+    """
+    order = sorted(range(len(items)), key=lambda k: (-items[k][0], -items[k][1], k))
+    pieces = [items[k][0] for k in order]
+    weights = [items[k][1] for k in order]
+    n = len(order)
+
+    deadline = time.perf_counter() + time_budget
+    solutions = []
+    chosen = []
+    nodes = 0
+    out_of_budget = False
+
+    def search(start, pieces_left, weight_sum):
+        nonlocal nodes, out_of_budget
+
+        for k in range(start, n):
+            if len(solutions) > 1 or out_of_budget:
+                return
+
+            nodes += 1
+            if nodes > node_budget or (nodes % 1024 == 0 and time.perf_counter() > deadline):
+                out_of_budget = True
+                return
+
+            if pieces[k] > pieces_left or weight_sum + weights[k] > weight_needed + tolerance:
+                continue
+
+            # Sorted by pieces: the best this branch can still add
+            slots = max_items - len(chosen)
+            if sum(pieces[k:k + slots]) < pieces_left:
+                return
+
+            chosen.append(k)
+            if pieces[k] == pieces_left:
+                # Any further item adds pieces, so this branch ends here either way
+                if abs(weight_sum + weights[k] - weight_needed) <= tolerance:
+                    solutions.append(list(chosen))
+            elif len(chosen) < max_items:
+                search(k + 1, pieces_left - pieces[k], weight_sum + weights[k])
+            chosen.pop()
+
+    if pieces_needed > 0:
+        search(0, pieces_needed, 0.0)
+
+    if len(solutions) > 1:
+        return None, "ambiguous"
+    if out_of_budget:
+        return None, "budget"
+    if not solutions:
+        return None, "none"
+    return sorted(order[k] for k in solutions[0]), "unique"
+
+
+def consolidate_unmatched_groups(results: List[Dict[str, Any]], awbs: List[Dict[str, Any]],
+                                 invoices: List[Dict[str, Any]], invoice_index, awb_files=None) -> int:
+    """
+    Second chance for GROUP-capable AWBs that matched nothing: the invoices
+    the AWB lists, plus a unique set of open invoices (same category prefix,
+    date window) that together reach the AWB's pieces and weight, are taken
+    as its consolidation. Invoice numbers lost by OCR/LLM are recovered this
+    way. Ambiguous or over-budget searches are rejected, and so are AWBs
+    whose prefix cannot be determined. Only AWBs in `awb_files` are tried
+    (None = every unmatched AWB). Updates `results` in place and returns the
+    number of AWBs consolidated.
+    """
+    awb_by_file = {a["_source_file"]: a for a in awbs}
+
+    # Invoices already matched to any AWB are not open
+    taken = {
+        normalize_invoice_number(m.get("invoice_number"))
+        for r in results
+        for m in r.get("matched_invoices", [])
+    }
+
+    eligible_by_prefix = {}
+    run_deadline = time.perf_counter() + CONSOLIDATION_RUN_BUDGET
+    consolidated = 0
+
+    for result in results:
+        if result.get("matched_invoices") or result.get("error"):
+            continue
+        if awb_files is not None and result["awb_file"] not in awb_files:
+            continue
+
+        awb = awb_by_file.get(result["awb_file"])
+        if awb is None:
+            continue
+
+        awb_core = awb["awb"]
+        category = awb_core.get("classification", {}).get("category")
+        if category not in CONSOLIDATION_PREFIXES:
+            continue
+
+        awb_f = _features(awb_core)
+        if not awb_f.invoice_numbers or not awb_f.pieces_int or awb_f.weight <= 0:
+            continue
+
+        if time.perf_counter() > run_deadline:
+            print("[WARN] Consolidation time budget used up → remaining AWBs left unmatched")
+            break
+
+        # Listed invoices that exist are always part of the consolidation
+        anchors = sorted({
+            pos for num in awb_f.invoice_numbers
+            for pos in invoice_index["invoice_number"].get(num, [])
+        })
+        if not anchors:
+            continue  # nothing the AWB lists was found: too little to tie a consolidation to
+
+        anchor_f = [_features(invoices[pos]["invoice"]) for pos in anchors]
+        pieces_needed = awb_f.pieces_int - sum(f.pieces_int or 0 for f in anchor_f)
+        weight_needed = awb_f.weight - sum(f.weight for f in anchor_f)
+
+        if pieces_needed <= 0 or weight_needed <= 0:
+            continue
+
+        prefix = CONSOLIDATION_PREFIXES[category] or _shared_prefix(awb_f.invoice_numbers)
+        if not prefix:
+            result["consolidation"] = "no_prefix"
+            continue
+        if prefix not in eligible_by_prefix:
+            eligible_by_prefix[prefix] = [
+                (pos, parse_document_date(inv["invoice"].get("invoice_date")))
+                for pos, inv in enumerate(invoices)
+                if _features(inv["invoice"]).invoice_number.startswith(prefix)
+                and (_features(inv["invoice"]).pieces_int or 0) > 0
+                and _features(inv["invoice"]).weight > 0
+            ]
+
+        # Open invoices in the date window, closest first (undated ones last)
+        awb_date = _awb_date(awb_core)
+        anchor_set = set(anchors)
+        pool = []
+        for pos, inv_date in eligible_by_prefix[prefix]:
+            if pos in anchor_set or _features(invoices[pos]["invoice"]).invoice_number in taken:
+                continue
+            if awb_date and inv_date:
+                if not awb_date - timedelta(days=CONSOLIDATION_DAYS_BEFORE) <= inv_date <= awb_date + timedelta(days=CONSOLIDATION_DAYS_AFTER):
+                    continue
+                distance = abs((awb_date - inv_date).days)
+            else:
+                distance = math.inf
+            pool.append((distance, pos))
+
+        pool = [pos for _, pos in sorted(pool)[:CONSOLIDATION_MAX_POOL]]
+        items = [
+            (_features(invoices[pos]["invoice"]).pieces_int, _features(invoices[pos]["invoice"]).weight)
+            for pos in pool
+        ]
+
+        picked, status = find_unique_subset(items, pieces_needed, weight_needed)
+        if status != "unique":
+            if status in ("ambiguous", "budget"):
+                result["consolidation"] = status
+            continue
+
+        members = sorted(anchors + [pool[k] for k in picked])
+        member_f = [_features(invoices[pos]["invoice"]) for pos in members]
+        details = {
+            "mode": "GROUP",
+            "consolidated": True,
+            "invoice_count": len(members),
+            "listed_invoice_count": len(anchors),
+            "recovered_invoice_numbers": [invoices[pool[k]]["invoice"].get("invoice_number") for k in picked],
+            "total_pieces": sum(f.pieces_int or 0 for f in member_f),
+            "total_weight": sum(f.weight for f in member_f),
+            "pieces_match": True,
+            "weight_match": True
+        }
+
+        result["matched_invoices"] = [
+            {
+                "invoice_file": invoices[pos]["_source_file"],
+                "invoice_number": invoices[pos]["invoice"].get("invoice_number"),
+                "details": details
+            }
+            for pos in members
+        ]
+        taken.update(f.invoice_number for f in member_f)
+        consolidated += 1
+
+    return consolidated
+
+
+# ============================================================================
+# OUTPUT
+# ============================================================================
+
+def _write_report_entry(f, entry: Dict[str, Any]):
+    f.write(f"AWB FILE: {entry['awb_file']}\n")
+    f.write(f"HAWB: {entry.get('hawb')}\n")
+    f.write(f"CLASSIFICATION: {entry.get('classification')}\n")
+
+    matches = entry.get("matched_invoices", [])
+    if not matches:
+        f.write("  → No matches found\n\n")
+        return
+
+    for m in matches:
+        f.write("  MATCHED INVOICE:\n")
+        f.write(f"    File: {m.get('invoice_file')}\n")
+        f.write(f"    Invoice No: {m.get('invoice_number')}\n")
+        f.write(f"    Details: {json.dumps(m.get('details', {}), indent=4)}\n")
+    f.write("\n")
+
+
+def _write_log_entry(f, r: Dict[str, Any]):
+    f.write(f"AWB: {r['awb_file']}\n")
+    if not r.get("matched_invoices"):
+        f.write("  → No matches found\n\n")
+        return
+    for m in r["matched_invoices"]:
+        f.write(f"  MATCH → Invoice: {m['invoice_file']} | {m['invoice_number']}\n")
+    f.write("\n")
+
+
+def write_match_outputs(results: List[Dict[str, Any]], out_dir: str, write_json: bool = True):
+    """
+    Write matched_results.json, matched_results.txt and match_log.txt in one
+    pass over the results. Each file is streamed to a temp file and renamed
+    into place, so wd2 / tango_excel_writer never read a truncated file.
+    """
+    out_json = os.path.join(out_dir, "matched_results.json")
+    out_txt = os.path.join(out_dir, "matched_results.txt")
+    log_file = os.path.join(out_dir, "match_log.txt")
+
+    with ExitStack() as stack:
+        report = stack.enter_context(atomic_write(out_txt))
+        log = stack.enter_context(atomic_write(log_file))
+        js = stack.enter_context(atomic_write(out_json)) if write_json else None
+
+        def written():
+            for entry in results:
+                _write_report_entry(report, entry)
+                _write_log_entry(log, entry)
+                yield entry
+
+        if js is not None:
+            write_json_array(js, written())
+        else:
+            for _ in written():
+                pass
+
+    return out_txt, log_file
+
+
 # ============================================================================
 # MAIN SCRIPT
 # ============================================================================
 
-def main():
-    # === PATHS ===
-    # AWB_PATH = r"C:\Users\HEKOLLI\OneDrive - Mercedes-Benz (corpdir.onmicrosoft.com)\DWT_TANGO - Documents\awb_all_output.txt"
-    # INV_PATH = r"C:\Users\HEKOLLI\OneDrive - Mercedes-Benz (corpdir.onmicrosoft.com)\DWT_TANGO - Documents\invoice_all_output.txt"
-    # OUT_DIR = r"C:\Users\HEKOLLI\OneDrive - Mercedes-Benz (corpdir.onmicrosoft.com)\DWT_TANGO - Documents"
-    AWB_PATH = r"C:\Users\SONIARN\OneDrive - Mercedes-Benz (corpdir.onmicrosoft.com)\DWT_TANGO - Documents\awb_all_output.txt"
-    INV_PATH = r"C:\Users\SONIARN\OneDrive - Mercedes-Benz (corpdir.onmicrosoft.com)\DWT_TANGO - Documents\invoice_all_output.txt"
-    OUT_DIR = r"C:\Users\SONIARN\OneDrive - Mercedes-Benz (corpdir.onmicrosoft.com)\DWT_TANGO - Documents"
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Match extracted AWBs against invoices.")
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="only check new documents against open AWBs (uses match_state.json)"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="match category shards in this many processes (default: 1, no pool)"
+    )
+    parser.add_argument(
+        "--no-fuzzy",
+        action="store_true",
+        help="skip the fuzzy invoice-number pass for unmatched AWBs"
+    )
+    parser.add_argument(
+        "--no-consolidation",
+        action="store_true",
+        help="skip the subset search for GROUP AWBs with missing invoice numbers"
+    )
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="keep running: hold stores + indexes in memory, match new records as they "
+             "arrive and answer queries over HTTP (see tango_service.py)"
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=8765,
+        help="HTTP port for --serve (localhost only, default: 8765)"
+    )
+    parser.add_argument(
+        "--poll",
+        type=float,
+        default=2.0,
+        help="seconds between store checks for --serve (default: 2)"
+    )
+    parser.add_argument(
+        "--profile",
+        nargs="?",
+        const=os.path.join(OUT_DIR, PROFILE_FILE),
+        metavar="PATH",
+        help=f"run under cProfile and save pstats (default: {PROFILE_FILE} next to the results)"
+    )
+    args = parser.parse_args(argv)
+
+    if args.serve:
+        # tango_service imports this module; only needed in service mode
+        from tango_service import serve
+        serve(args)
+        return
+
+    if not args.profile:
+        run_matching(args)
+        return
+
+    profiler = cProfile.Profile()
+    try:
+        profiler.runcall(run_matching, args)
+    finally:
+        profiler.dump_stats(args.profile)
+        print(f"→ Profile saved to: {args.profile}  (python -m pstats {os.path.basename(args.profile)})")
+
+
+def run_matching(args):
+    stats = MATCH_STATS
+    stats.reset()
+    run_start = time.perf_counter()
 
     os.makedirs(OUT_DIR, exist_ok=True)
 
@@ -684,14 +1775,18 @@ def main():
     old_results = []
     already_processed_awbs = set()
 
-    if os.path.exists(previous_matches_path):
-        with open(previous_matches_path, "r", encoding="utf-8") as f:
-            old_results = json.load(f)
+    with stats.phase("load_previous"):
+        if use_sqlite():
+            with TangoStore() as store:
+                old_results = store.load_match_results()
+        elif os.path.exists(previous_matches_path):
+            with open(previous_matches_path, "r", encoding="utf-8") as f:
+                old_results = json.load(f)
 
-        # Only skip AWBs that already have MATCHES
-        for r in old_results:
-            if r.get("matched_invoices"):  # only if not empty
-                already_processed_awbs.add(r.get("awb_file"))
+    # Only skip AWBs that already have MATCHES
+    for r in old_results:
+        if r.get("matched_invoices"):  # only if not empty
+            already_processed_awbs.add(r.get("awb_file"))
 
 
     # ----------------------------------------------------
@@ -699,34 +1794,55 @@ def main():
     # ----------------------------------------------------
     print("Loading AWB + Invoice data...")
 
-    awbs = load_json_blocks(AWB_PATH)
-    invoices = load_json_blocks(INV_PATH)
+    # Point-in-time view: records appended while we read are left for the next run
+    with stats.phase("load"):
+        if use_sqlite():
+            with TangoStore() as store, store.snapshot():
+                awbs = list(store.iter_awbs())
+                invoices = list(store.iter_invoices())
+        else:
+            with store_snapshot(AWB_PATH, INV_PATH) as sizes:
+                awbs = load_json_blocks(AWB_PATH, end=sizes[AWB_PATH])
+                invoices = load_json_blocks(INV_PATH, end=sizes[INV_PATH])
 
     # ----------------------------------------------------
     # REMOVE DUPLICATE INVOICES (same invoice number)
     # ----------------------------------------------------
-    unique_invoices = {}
-    for inv in invoices:
-        inv_num = normalize_invoice_number(inv["invoice"].get("invoice_number"))
-        if inv_num:
-            unique_invoices[inv_num] = inv
-
-    invoices = list(unique_invoices.values())
+    with stats.phase("dedup"):
+        # Normalize every record once; all matchers read these features
+        awbs = prepare_awbs(awbs)
+        invoices = dedup_invoices(prepare_invoices(invoices))
 
     print(f"Loaded {len(awbs)} AWB entries")
     print(f"Loaded {len(invoices)} UNIQUE Invoice entries")
 
+    with stats.phase("index"):
+        invoice_index = build_invoice_index(invoices)
+
     # ----------------------------------------------------
     # MATCHING
     # ----------------------------------------------------
     all_results = old_results.copy()
 
-    for awb in awbs:
-        if awb["_source_file"] in already_processed_awbs:
-            continue  # Skip already matched AWBs
+    state_path = os.path.join(OUT_DIR, MATCH_STATE_FILE)
+    state = load_match_state(state_path) if args.incremental else None
+
+    with stats.phase("select"):
+        awbs_to_match = select_awbs_to_match(
+            awbs,
+            invoices,
+            invoice_index,
+            already_processed_awbs,  # Skip already matched AWBs
+            {r.get("awb_file") for r in old_results},
+            state
+        )
+
+    with stats.phase("match"):
+        all_results.extend(match_awbs(awbs_to_match, invoices, invoice_index, args.workers))
 
-        result = match_awb_with_invoices(awb, invoices)
-        all_results.append(result)
+    # Fuzzy + consolidation passes: only the AWBs selected above. In an incremental
+    # run, unmatched AWBs from earlier runs have been through them already
+    selected_files = {a["_source_file"] for a in awbs_to_match}
     
     all_results = {r["awb_file"]: r for r in all_results}.values()
     all_results = list(all_results)
@@ -735,68 +1851,86 @@ def main():
         r["matched_invoices"] = list({m["invoice_number"]: m for m in r.get("matched_invoices", [])}.values())
 
     # ----------------------------------------------------
-    # SAVE JSON RESULTS
+    # FUZZY INVOICE NUMBERS (only AWBs still unmatched)
     # ----------------------------------------------------
-    out_json = os.path.join(OUT_DIR, "matched_results.json")
-    with open(out_json, "w", encoding="utf-8") as f:
-        json.dump(all_results, f, indent=2)
+    if not args.no_fuzzy:
+        with stats.phase("fuzzy"):
+            rematched = fuzzy_rematch_unmatched(all_results, awbs, invoices, invoice_index, selected_files)
+        stats.counters["fuzzy_rematched"] = rematched
+        if rematched:
+            print(f"Matched {rematched} AWBs via fuzzy invoice numbers")
 
     # ----------------------------------------------------
-    # SAVE TXT REPORT
+    # GROUP CONSOLIDATION (only AWBs still unmatched)
     # ----------------------------------------------------
-    out_txt = os.path.join(OUT_DIR, "matched_results.txt")
-
-    with open(out_txt, "w", encoding="utf-8") as f:
-        for entry in all_results:
-            f.write(f"AWB FILE: {entry['awb_file']}\n")
-            f.write(f"HAWB: {entry.get('hawb')}\n")
-            f.write(f"CLASSIFICATION: {entry.get('classification')}\n")
-
-            matches = entry.get("matched_invoices", [])
-            if not matches:
-                f.write("  → No matches found\n\n")
-                continue
-
-            for m in matches:
-                f.write("  MATCHED INVOICE:\n")
-                f.write(f"    File: {m.get('invoice_file')}\n")
-                f.write(f"    Invoice No: {m.get('invoice_number')}\n")
-                f.write(f"    Details: {json.dumps(m.get('details', {}), indent=4)}\n")
-            f.write("\n")
+    if not args.no_consolidation:
+        with stats.phase("consolidation"):
+            consolidated = consolidate_unmatched_groups(all_results, awbs, invoices, invoice_index, selected_files)
+        stats.counters["consolidated"] = consolidated
+        if consolidated:
+            print(f"Consolidated {consolidated} GROUP AWBs with missing invoice numbers")
 
     # ----------------------------------------------------
-    # SAVE MATCH LOG
+    # SAVE RESULTS (JSON + TXT REPORT + MATCH LOG)
     # ----------------------------------------------------
-    log_file = os.path.join(OUT_DIR, "match_log.txt")
-
-    with open(log_file, "w", encoding="utf-8") as f:
-        for r in all_results:
-            f.write(f"AWB: {r['awb_file']}\n")
-            if not r.get("matched_invoices"):
-                f.write("  → No matches found\n\n")
-                continue
-            for m in r["matched_invoices"]:
-                f.write(f"  MATCH → Invoice: {m['invoice_file']} | {m['invoice_number']}\n")
-            f.write("\n")
+    with stats.phase("write"):
+        if use_sqlite():
+            with TangoStore() as store:
+                store.save_match_results(all_results)
+            print(f"→ Match results stored in: {DB_PATH}")
+
+        out_txt, log_file = write_match_outputs(all_results, OUT_DIR, write_json=not use_sqlite())
+
+        save_match_state(state_path, awbs, invoices)
+
+    stats.counters.update({
+        "awbs_loaded": len(awbs),
+        "invoices_unique": len(invoices),
+        "awbs_matched_this_run": len(awbs_to_match),
+        "results": len(all_results),
+        "results_with_matches": sum(1 for r in all_results if r.get("matched_invoices"))
+    })
+    stats_path = os.path.join(OUT_DIR, MATCH_STATS_FILE)
+    stats.save(stats_path, total_seconds=time.perf_counter() - run_start)
 
     print("\n✓ Matching complete!")
     print(f"→ Results saved to: {out_txt}")
     print(f"→ Log saved to: {log_file}")
+    print(f"→ Run statistics saved to: {stats_path}")
+
+
+@contextmanager
+def single_run_lock():
+    """
+    One matching process at a time (one-shot run or service). OS lock:
+    released automatically if this process dies. The PID written inside
+    only tells the next run that a previous one crashed.
+    Raises TimeoutError if another run holds it.
+    """
+    with file_lock(LOCK_FILE, timeout=0) as lock:
+        lock.seek(0)
+        stale_owner = lock.read().decode("utf-8", errors="replace").strip()
+        if stale_owner:
+            print(f"[LOCK] Cleared stale lock left by crashed run ({stale_owner})")
+
+        lock.truncate(0)
+        lock.write(f"pid {os.getpid()}".encode("utf-8"))
+        lock.flush()
 
+        try:
+            yield
+        finally:
+            lock.truncate(0)
 
 
 if __name__ == "__main__":
     # -------------------------------
-    # CREATE READ-LOCK
+    # ONE MATCH RUN AT A TIME
     # -------------------------------
-    open(LOCK_FILE, "w").close()
-
     try:
-        main()
-    finally:
-        # -------------------------------
-        # RELEASE READ-LOCK
-        # -------------------------------
-        if os.path.exists(LOCK_FILE):
-            os.remove(LOCK_FILE)
+        with single_run_lock():
+            main()
+    except TimeoutError:
+        print(f"Another matching run is in progress ({LOCK_FILE}) → exiting.")
+        sys.exit(1)
 
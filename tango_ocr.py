@@ -0,0 +1,243 @@
+# 17-10-2026
+"""
+Page-level text / OCR routing for AWBs and invoices
+---------------------------------------------------
+
+Each page is routed on its own:
+
+    text layer   page.get_text() when it has at least MIN_TEXT_CHARS
+                 characters
+    image-only   OCR: rendered straight to a grayscale pixmap (no temp
+                 PNG), thresholded, tesseract
+
+Mixed and fully scanned PDFs are both handled, and page texts always come
+back in page order. With two or more pages to OCR they run concurrently on
+a process pool (TANGO_OCR_WORKERS, started on first use and kept for the
+life of the process). Workers reopen the PDF from its bytes, since fitz
+pages cannot be pickled. A single page is OCR'd in-process, which is
+cheaper than a round trip to the pool.
+
+OCR escalates instead of always paying for 300 DPI (OCR_PASSES):
+
+    1. 200 DPI, adaptive threshold     most clean scans stop here
+    2. 300 DPI, adaptive threshold     the previous fixed setting
+    3. 400 DPI, median blur + Otsu     speckled / noisy scans
+
+A pass is accepted when the mean tesseract word confidence
+(image_to_data) reaches MIN_CONFIDENCE and, on the first page, a key number
+was read: a MAWB / HAWB for AWBs, or an invoice number with one of the
+tango_fastpath prefixes (for either document type). If no pass is accepted,
+the most confident one that read a key number is used (or the most
+confident one if none did).
+
+cv2, numpy and pytesseract are imported on first OCR, not at import.
+
+Settings (.env):
+    TANGO_OCR_WORKERS=4            0 or 1 = OCR in-process, one page at a time
+    TANGO_OCR_MIN_TEXT_CHARS=20
+    TANGO_OCR_MIN_CONFIDENCE=75    0-100
+"""
+
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+import fitz  # PyMuPDF
+
+from tango_fastpath import HAWB_RE, INVOICE_PREFIXES, INVOICE_RE, MAWB_RE
+
+# changed path for POC PC
+# TESSERACT_CMD = r"C:\Coding\Tesseract OCR\tesseract.exe"
+TESSERACT_CMD = r"C:\CODING\Tesseract OCR\tesseract.exe"
+
+OCR_WORKERS = int(os.getenv("TANGO_OCR_WORKERS", str(min(4, os.cpu_count() or 1))))
+MIN_TEXT_CHARS = int(os.getenv("TANGO_OCR_MIN_TEXT_CHARS", "20"))
+MIN_CONFIDENCE = float(os.getenv("TANGO_OCR_MIN_CONFIDENCE", "75"))
+
+# (DPI, preprocessing), cheapest first
+OCR_PASSES = [(200, "adaptive"), (300, "adaptive"), (400, "otsu")]
+
+# Bump when routing or OCR settings change (part of the extraction cache version)
+OCR_VERSION = "2"
+
+
+@lru_cache(maxsize=None)
+def ocr_modules():
+    import cv2
+    import numpy as np
+    import pytesseract
+    pytesseract.pytesseract.tesseract_cmd = TESSERACT_CMD
+    return cv2, np, pytesseract
+
+
+def render_gray(page, dpi: int):
+    """
+    The page as an 8-bit grayscale NumPy image, rendered without alpha.
+    Returns (pixmap, image): the image is a view of the pixmap's buffer and
+    is only valid while the pixmap is alive.
+    """
+    _, np, _ = ocr_modules()
+    zoom = dpi / 72
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csGRAY, alpha=False)
+    # Rows are `stride` bytes apart
+    gray = np.frombuffer(pix.samples_mv, dtype=np.uint8).reshape(pix.height, pix.stride)[:, :pix.width]
+    return pix, gray
+
+
+def preprocess(gray, method: str):
+    cv2, _, _ = ocr_modules()
+
+    if method == "otsu":
+        # Median blur removes scanner speckle; one global Otsu threshold after it
+        blurred = cv2.medianBlur(gray, 3)
+        _, thresh = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        return thresh
+
+    # 🔥 Adaptive Thresholding (major improvement)
+    return cv2.adaptiveThreshold(
+        gray,
+        255,
+        cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+        cv2.THRESH_BINARY,
+        31,   # block size
+        2     # constant subtracted from mean
+    )
+
+
+def read_image(image) -> Tuple[str, float]:
+    """(text, mean word confidence 0-100) from tesseract's word boxes."""
+    _, _, pytesseract = ocr_modules()
+
+    # OCR config optimized for structured documents
+    custom_config = r'--oem 3 --psm 6'
+
+    data = pytesseract.image_to_data(
+        image,
+        lang="eng",
+        config=custom_config,
+        output_type=pytesseract.Output.DICT
+    )
+
+    lines = {}
+    confidences = []
+    for i, word in enumerate(data["text"]):
+        conf = float(data["conf"][i])
+        if conf < 0 or not word.strip():
+            continue   # layout rows (page / block / line) carry conf -1
+        key = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+        lines.setdefault(key, []).append(word)
+        confidences.append(conf)
+
+    text = "\n".join(" ".join(words) for words in lines.values())
+    confidence = sum(confidences) / len(confidences) if confidences else 0.0
+    return text.strip(), confidence
+
+
+def has_key_number(text: str, kind: str) -> bool:
+    upper = text.upper()
+    if any(n.startswith(INVOICE_PREFIXES) for n in INVOICE_RE.findall(upper)):
+        return True
+    return kind == "awb" and bool(MAWB_RE.search(upper) or HAWB_RE.search(upper))
+
+
+def ocr_page(page, kind: Optional[str] = None) -> str:
+    """
+    OCR one page, escalating through OCR_PASSES until a pass is good enough.
+
+    `kind` ("awb" / "invoice") also requires a key number in the text; pass
+    it for the first page only, where those numbers are printed.
+    """
+    best = None
+    for dpi, method in OCR_PASSES:
+        pix, gray = render_gray(page, dpi)
+        text, confidence = read_image(preprocess(gray, method))
+        del gray, pix
+
+        found_key = kind is None or has_key_number(text, kind)
+        if confidence >= MIN_CONFIDENCE and found_key:
+            best = (found_key, confidence, text, dpi, method)
+            break
+        if best is None or (found_key, confidence) > best[:2]:
+            best = (found_key, confidence, text, dpi, method)
+
+    _, confidence, text, dpi, method = best
+    print(f"✓ OCR page {page.number + 1}: {dpi} DPI {method}, confidence {confidence:.0f}")
+    return text
+
+
+def _ocr_pdf_page(data: bytes, page_no: int, kind: Optional[str]) -> str:
+    # Runs in a pool worker
+    with fitz.open(stream=data, filetype="pdf") as doc:
+        return ocr_page(doc.load_page(page_no), kind)
+
+
+# ============================================================================
+# OCR POOL
+# ============================================================================
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=OCR_WORKERS)
+        return _pool
+
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def ocr_pages(doc, data: bytes, page_numbers: List[int], kind: Optional[str] = None) -> List[str]:
+    """OCR text of `page_numbers`, in that order; concurrently when there are several."""
+    # Key numbers are only required on the first page
+    kinds = [kind if n == 0 else None for n in page_numbers]
+
+    if len(page_numbers) < 2 or OCR_WORKERS < 2:
+        return [ocr_page(doc.load_page(n), k) for n, k in zip(page_numbers, kinds)]
+
+    try:
+        futures = [_get_pool().submit(_ocr_pdf_page, data, n, k) for n, k in zip(page_numbers, kinds)]
+        return [f.result() for f in futures]
+    except BrokenProcessPool:
+        # A worker died (out of memory on a huge scan, killed, ...): start over in-process
+        print("[WARN] OCR pool broke → OCR in-process")
+        _reset_pool()
+        return [ocr_page(doc.load_page(n), k) for n, k in zip(page_numbers, kinds)]
+
+
+# ============================================================================
+# ROUTING
+# ============================================================================
+
+def page_texts(doc, data: bytes, kind: Optional[str] = None) -> List[str]:
+    """Text of every page in order: the text layer where usable, OCR elsewhere."""
+    texts = []
+    scanned = []
+    for page in doc:
+        try:
+            text = page.get_text().strip()
+        except Exception:
+            text = ""
+        if len(text) < MIN_TEXT_CHARS:
+            scanned.append(page.number)
+        texts.append(text)
+
+    if scanned:
+        print(f"⚠ {len(scanned)} of {doc.page_count} pages have no usable text layer → OCR")
+        for n, text in zip(scanned, ocr_pages(doc, data, scanned, kind)):
+            # Keep a short text layer if OCR finds even less
+            if len(text) >= len(texts[n]):
+                texts[n] = text
+
+    return texts
@@ -0,0 +1,199 @@
+# 17-10-2026
+"""
+Page selection for long invoices
+--------------------------------
+
+Invoices with long line-item annexes used to send every page to Gemini.
+For invoices over PAGE_SELECT_MIN_PAGES pages, only page 1 plus the pages
+that best cover the Invoice schema are sent.
+
+Every field group below (invoice number / date, parties, weight and
+pieces, references, charges / totals) picks its best page. Page 1 is
+always kept; the other picks are kept best score first, up to
+PAGE_SELECT_TOP pages in total (groups sharing a page send fewer). The
+charges often sit on the last page after the annex, and that page still
+gets picked.
+
+Scoring:
+    embedding  sentence-transformers (PAGE_SELECT_MODEL on the CPU, cached
+               in ./models). Cosine similarity of each field group
+               description with each chunk of a page; a page scores its
+               best chunk.
+    keyword    fallback when sentence-transformers or the model is not
+               available: share of a group's keywords found on the page.
+
+Each selection reports pages kept and the tokens saved, estimated at
+CHARS_PER_TOKEN characters per token.
+
+Settings (.env):
+    TANGO_PAGE_SELECT=embedding | keyword | off
+    TANGO_PAGE_SELECT_MODEL=sentence-transformers/all-MiniLM-L6-v2
+    TANGO_PAGE_SELECT_MIN_PAGES=4
+    TANGO_PAGE_SELECT_TOP=4
+"""
+
+import importlib.util
+import os
+import re
+from functools import lru_cache
+from typing import Any, Dict, List, Tuple
+
+PAGE_SELECT_MODE = os.getenv("TANGO_PAGE_SELECT", "embedding").lower()
+PAGE_SELECT_MODEL = os.getenv("TANGO_PAGE_SELECT_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+PAGE_SELECT_MIN_PAGES = int(os.getenv("TANGO_PAGE_SELECT_MIN_PAGES", "4"))
+PAGE_SELECT_TOP = int(os.getenv("TANGO_PAGE_SELECT_TOP", "4"))
+MODELS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "models")
+
+# Bump when the groups or the selection rule change (part of the extraction cache version)
+PAGE_SELECT_VERSION = "1"
+
+CHUNK_WORDS = 150          # the model reads ~256 word pieces; longer pages are scored in chunks
+CHARS_PER_TOKEN = 4
+
+# Invoice schema fields, grouped by where they are printed together
+FIELD_GROUPS = {
+    "header": (
+        "invoice number, document number, invoice date, delivery note number",
+        ["invoice", "document no", "invoice no", "date", "delivery note"],
+    ),
+    "parties": (
+        "supplier name and address, shipper, consignee, buyer, bill to address",
+        ["supplier", "shipper", "consignee", "buyer", "bill to", "ship to"],
+    ),
+    "shipment": (
+        "gross weight in kg, number of packages, pieces, container number",
+        ["gross weight", "gross", "packages", "pieces", "container", "kg"],
+    ),
+    "references": (
+        "order number, purchase order, VIN vehicle identification number",
+        ["order", "purchase order", "vin", "chassis", "vehicle"],
+    ),
+    "charges": (
+        "subtotal, packing, ex factory, freight charges, FCA, DGR fee, loading charges, "
+        "CFR value, transport insurance, value added tax, total price, currency",
+        ["subtotal", "packing", "ex factory", "ex works", "freight", "fca", "dgr", "loading",
+         "cfr", "insurance", "vat", "value added tax", "total", "amount", "eur", "usd"],
+    ),
+}
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def selection_signature() -> str:
+    """
+    Everything that changes which pages are sent (part of the extraction cache
+    version), with the scorer actually in use: after the embedding scorer fell
+    back to keywords, the signature says "keyword".
+    """
+    return f"{PAGE_SELECT_VERSION}:{scorer_in_use()}:{PAGE_SELECT_MODEL}:{PAGE_SELECT_MIN_PAGES}:{PAGE_SELECT_TOP}"
+
+
+# ============================================================================
+# SCORERS (pages × groups)
+# ============================================================================
+
+def keyword_scores(pages: List[str]) -> List[List[float]]:
+    scores = []
+    for page in pages:
+        text = page.lower()
+        scores.append([
+            sum(1 for kw in keywords if re.search(r"\b" + re.escape(kw) + r"\b", text)) / len(keywords)
+            for _, keywords in FIELD_GROUPS.values()
+        ])
+    return scores
+
+
+@lru_cache(maxsize=None)
+def _embedding_model():
+    from sentence_transformers import SentenceTransformer
+
+    os.makedirs(MODELS_DIR, exist_ok=True)
+    return SentenceTransformer(PAGE_SELECT_MODEL, device="cpu", cache_folder=MODELS_DIR)
+
+
+def _chunks(page: str) -> List[str]:
+    words = page.split()
+    return [" ".join(words[i:i + CHUNK_WORDS]) for i in range(0, len(words), CHUNK_WORDS)] or [""]
+
+
+def embedding_scores(pages: List[str]) -> List[List[float]]:
+    model = _embedding_model()
+
+    chunks, owner = [], []
+    for p, page in enumerate(pages):
+        for chunk in _chunks(page):
+            chunks.append(chunk)
+            owner.append(p)
+
+    queries = [description for description, _ in FIELD_GROUPS.values()]
+    q = model.encode(queries, normalize_embeddings=True)
+    c = model.encode(chunks, normalize_embeddings=True, batch_size=32)
+    similarity = c @ q.T   # chunks × groups, cosine (normalized)
+
+    scores = [[-1.0] * len(queries) for _ in pages]
+    for row, p in zip(similarity, owner):
+        scores[p] = [max(a, float(b)) for a, b in zip(scores[p], row)]
+    return scores
+
+
+_embedding_error = None
+
+
+@lru_cache(maxsize=None)
+def _embedding_installed() -> bool:
+    return importlib.util.find_spec("sentence_transformers") is not None
+
+
+def scorer_in_use() -> str:
+    """PAGE_SELECT_MODE, or "keyword" when the embedding scorer is not installed or failed."""
+    if PAGE_SELECT_MODE == "embedding" and (_embedding_error is not None or not _embedding_installed()):
+        return "keyword"
+    return PAGE_SELECT_MODE
+
+
+def page_scores(pages: List[str]) -> Tuple[List[List[float]], str]:
+    global _embedding_error
+
+    if PAGE_SELECT_MODE == "embedding" and _embedding_error is None:
+        try:
+            return embedding_scores(pages), "embedding"
+        except Exception as e:
+            # Not installed, or the model cannot be downloaded / loaded: keywords still beat
+            # sending everything. Not retried for the rest of this process.
+            _embedding_error = e
+            print(f"[WARN] Embedding page scorer unavailable ({e.__class__.__name__}: {e}) → keyword scorer")
+    return keyword_scores(pages), "keyword"
+
+
+# ============================================================================
+# SELECTION
+# ============================================================================
+
+def select_pages(pages: List[str]) -> Tuple[List[int], Dict[str, Any]]:
+    """Indices of the pages to send (in page order) and a report with the tokens saved."""
+    total_tokens = sum(estimate_tokens(p) for p in pages)
+    report = {"pages": len(pages), "kept": list(range(len(pages))), "scorer": None,
+              "tokens_before": total_tokens, "tokens_after": total_tokens, "tokens_saved": 0}
+
+    if PAGE_SELECT_MODE == "off" or len(pages) <= max(PAGE_SELECT_MIN_PAGES, PAGE_SELECT_TOP):
+        return report["kept"], report
+
+    scores, scorer = page_scores(pages)
+
+    # Each group's best page (ties → earlier page), strongest picks first
+    group_best = []
+    for g in range(len(FIELD_GROUPS)):
+        best = max(range(len(pages)), key=lambda p: (scores[p][g], -p))
+        group_best.append((scores[best][g], best))
+
+    kept = [0]
+    for _, page in sorted(group_best, key=lambda item: -item[0]):
+        if page not in kept and len(kept) < PAGE_SELECT_TOP:
+            kept.append(page)
+
+    kept.sort()
+    after = sum(estimate_tokens(pages[p]) for p in kept)
+    report.update({"kept": kept, "scorer": scorer, "tokens_after": after, "tokens_saved": total_tokens - after})
+    return kept, report
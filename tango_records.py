@@ -0,0 +1,435 @@
+# 17-10-2026
+"""
+Shared reader/writer for the separator-delimited JSON stores
+(awb_all_output.txt, invoice_all_output.txt).
+
+Records are written as an 80-dash separator line followed by an indented
+JSON object. The reader streams the file line by line, so memory stays at
+one record, and decodes each block with JSONDecoder.raw_decode. A block
+holding several objects back to back (no separator) is still read
+correctly, and a half-written record at the tail is skipped rather than
+raising.
+
+Each store has a sidecar index (<store>.idx, one JSON line per record:
+offset, length, source file, HAWB / invoice number, timestamp) so readers
+can seek straight to new records or to one key instead of scanning
+(find_records / tail_records, the service's /records query):
+
+    python tango_records.py find <store> <HAWB or invoice number>
+    python tango_records.py tail <store> [-n 20]
+    python tango_records.py reindex <store>
+
+Whole-file outputs (matched_results.json, the text reports) go through
+atomic_write: temp file + rename, so no reader ever sees half a file.
+
+Concurrency: appends hold <store>.lock for the few milliseconds of a
+write. Readers take a snapshot (the store's length between two appends)
+and read only up to it. They never see a half-written record and never
+stop the extractors. Whole-file rewrites (wd2 dedup) wait for readers
+via <store>.rewrite.lock. All locks are OS locks, so they go away with
+the process that held them.
+"""
+
+import argparse
+import json
+import os
+import time
+from contextlib import contextmanager, ExitStack
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
+
+SEPARATOR_LINE = "-" * 80
+
+_SEPARATOR_BYTES = SEPARATOR_LINE.encode("ascii")
+_decoder = json.JSONDecoder()
+
+
+def _decode_block(data: bytes, base: int) -> Iterator[Tuple[int, int, Dict[str, Any]]]:
+    # surrogateescape keeps a 1:1 mapping back to bytes for the offsets
+    text = data.decode("utf-8", errors="surrogateescape")
+    pos = 0
+
+    while True:
+        pos = text.find("{", pos)
+        if pos < 0:
+            return
+
+        try:
+            obj, end = _decoder.raw_decode(text, pos)
+        except json.JSONDecodeError:
+            return  # truncated or corrupt block → skip the rest of it
+
+        offset = base + len(text[:pos].encode("utf-8", errors="surrogateescape"))
+        length = len(text[pos:end].encode("utf-8", errors="surrogateescape"))
+        yield offset, length, obj
+        pos = end
+
+
+def iter_record_spans(path: str, start: int = 0, end: Optional[int] = None) -> Iterator[Tuple[int, int, Dict[str, Any]]]:
+    """
+    Yield (byte_offset, byte_length, record) for every JSON record in `path`.
+
+    `start` must be 0 or the end (offset + length) of a record returned
+    earlier. Use it to pick up only what was appended since then.
+    `end` (from store_snapshot) stops at that byte, ignoring later appends.
+    """
+    with open(path, "rb") as f:
+        f.seek(start)
+
+        offset = start
+        block_start = start
+        lines = []
+
+        for line in f:
+            if end is not None and offset + len(line) > end:
+                break
+
+            if line.strip() == _SEPARATOR_BYTES:
+                if lines:
+                    yield from _decode_block(b"".join(lines), block_start)
+                    lines = []
+                offset += len(line)
+                block_start = offset
+                continue
+
+            lines.append(line)
+            offset += len(line)
+
+        if lines:
+            yield from _decode_block(b"".join(lines), block_start)
+
+
+def iter_records(path: str, start: int = 0, end: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+    """Yield every JSON record in `path` (from byte `start`, up to byte `end`)."""
+    for _, _, record in iter_record_spans(path, start, end):
+        yield record
+
+
+# ============================================================================
+# LOCKING & SNAPSHOTS
+# ============================================================================
+
+def _try_lock(f, shared: bool):
+    if os.name == "nt":
+        # Windows byte-range locks are exclusive only
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+    else:
+        fcntl.flock(f.fileno(), (fcntl.LOCK_SH if shared else fcntl.LOCK_EX) | fcntl.LOCK_NB)
+
+
+def _unlock(f):
+    if os.name == "nt":
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+@contextmanager
+def file_lock(lock_path: str, shared: bool = False, timeout: Optional[float] = None):
+    """
+    Hold an OS lock on `lock_path` (fcntl.flock / msvcrt.locking).
+
+    The OS drops the lock when its holder exits or crashes, so there is no
+    stale state to clean up. timeout=None waits forever. Otherwise
+    TimeoutError is raised after `timeout` seconds (0 = try once).
+    """
+    f = open(lock_path, "a+b")
+    try:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            try:
+                _try_lock(f, shared)
+                break
+            except OSError:
+                if deadline is not None and time.monotonic() >= deadline:
+                    raise TimeoutError(f"Lock is held by another process: {lock_path}")
+                time.sleep(0.05)
+
+        try:
+            yield f
+        finally:
+            _unlock(f)
+    finally:
+        f.close()
+
+
+def append_lock(path: str, **kwargs):
+    """Serializes writers of one store (appends and rewrites)."""
+    return file_lock(path + ".lock", **kwargs)
+
+
+def rewrite_lock(path: str, shared: bool = False, **kwargs):
+    """Readers hold it shared for their whole read; whole-file rewrites hold it exclusive."""
+    return file_lock(path + ".rewrite.lock", shared=shared, **kwargs)
+
+
+@contextmanager
+def store_snapshot(*paths: str):
+    """
+    Consistent point-in-time view of one or more stores.
+
+    Yields {path: byte length}, captured between appends. Pass the length
+    as `end` to the iterators to read exactly the records that existed at
+    that moment. Appends continue during the read. Rewrites of the stores
+    wait until the context closes.
+    """
+    with ExitStack() as stack:
+        for path in paths:
+            stack.enter_context(rewrite_lock(path, shared=True))
+
+        sizes = {}
+        for path in paths:
+            with append_lock(path):
+                sizes[path] = os.path.getsize(path) if os.path.exists(path) else 0
+
+        yield sizes
+
+
+def read_snapshot(path: str) -> List[Dict[str, Any]]:
+    """All records of `path` as of now, never including a half-written append."""
+    with store_snapshot(path) as sizes:
+        return list(iter_records(path, end=sizes[path]))
+
+
+# ============================================================================
+# ATOMIC OUTPUT FILES
+# ============================================================================
+
+@contextmanager
+def atomic_write(path: str, encoding: str = "utf-8"):
+    """
+    Write `path` through a temp file in the same folder, renamed into place
+    on success. Readers see the old file or the new one, never a truncated
+    one. If the block raises, the old file is left untouched.
+    """
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "w", encoding=encoding) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        _replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def _replace(src: str, dst: str, attempts: int = 20):
+    # Windows refuses to replace a file another process has open (Excel,
+    # OneDrive sync); those handles are short-lived, so retry briefly
+    for attempt in range(attempts):
+        try:
+            os.replace(src, dst)
+            return
+        except PermissionError:
+            if attempt == attempts - 1:
+                raise
+            time.sleep(0.25)
+
+
+def write_json_array(f, items) -> int:
+    """
+    Stream `items` as a JSON array, byte-identical to json.dump(items, f, indent=2),
+    one element at a time. Returns the number of elements written.
+    """
+    count = 0
+    for item in items:
+        f.write(",\n  " if count else "[\n  ")
+        f.write(json.dumps(item, indent=2).replace("\n", "\n  "))
+        count += 1
+
+    f.write("\n]" if count else "[]")
+    return count
+
+
+# ============================================================================
+# SIDECAR INDEX
+# ============================================================================
+
+INDEX_SUFFIX = ".idx"
+
+
+def index_path(path: str) -> str:
+    return path + INDEX_SUFFIX
+
+
+def record_index_key(entry: Dict[str, Any]) -> Optional[str]:
+    """HAWB for AWB records, invoice number for invoice records."""
+    if "awb" in entry:
+        return (entry.get("awb") or {}).get("hawb")
+    if "invoice" in entry:
+        return (entry.get("invoice") or {}).get("invoice_number")
+    return None
+
+
+def _index_entry(offset: int, length: int, entry: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "offset": offset,
+        "length": length,
+        "source_file": entry.get("_source_file"),
+        "key": record_index_key(entry),
+        "timestamp": entry.get("_timestamp")
+    }
+
+
+def append_record(path: str, entry: Dict[str, Any]) -> Dict[str, Any]:
+    """Append `entry` to the store at `path` and record it in the sidecar index."""
+    prefix = ("\n" + SEPARATOR_LINE + "\n").encode("utf-8")
+    body = json.dumps(entry, ensure_ascii=False, indent=2).encode("utf-8")
+
+    with append_lock(path):
+        # First indexed append to an existing store: index the older records first
+        if not os.path.exists(index_path(path)) and os.path.exists(path):
+            rebuild_index(path)
+
+        with open(path, "ab") as f:
+            f.seek(0, os.SEEK_END)
+            start = f.tell()
+            f.write(prefix + body + b"\n")
+
+        index_entry = _index_entry(start + len(prefix), len(body), entry)
+        with open(index_path(path), "a", encoding="utf-8") as f:
+            f.write(json.dumps(index_entry, ensure_ascii=False) + "\n")
+
+    return index_entry
+
+
+def _read_index_file(path: str) -> Optional[List[Dict[str, Any]]]:
+    entries = []
+    with open(index_path(path), "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                entries.append(json.loads(line))
+            except json.JSONDecodeError:
+                return None  # torn line (crashed writer) → rebuild
+    return entries
+
+
+def _index_is_current(path: str, entries: List[Dict[str, Any]]) -> bool:
+    # A whole-file rewrite (e.g. wd2 dedup) moves records: the last indexed
+    # record must still sit exactly where the index says it does
+    if not entries:
+        return True
+
+    last = entries[-1]
+    if last["offset"] + last["length"] > os.path.getsize(path):
+        return False
+
+    try:
+        record = read_record_at(path, last["offset"], last["length"])
+    except (ValueError, UnicodeDecodeError):
+        return False
+    return _index_entry(last["offset"], last["length"], record) == last
+
+
+def rebuild_index(path: str) -> List[Dict[str, Any]]:
+    """Re-scan the whole store and replace its sidecar index (caller holds append_lock)."""
+    entries = [_index_entry(offset, length, entry) for offset, length, entry in iter_record_spans(path)]
+
+    tmp = index_path(path) + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        for e in entries:
+            f.write(json.dumps(e, ensure_ascii=False) + "\n")
+    os.replace(tmp, index_path(path))
+
+    return entries
+
+
+def load_index(path: str) -> List[Dict[str, Any]]:
+    """
+    Index entries for every record in the store, in file order.
+    Rebuilds a missing or stale index; records appended by writers that do
+    not maintain the index yet are scanned from the last indexed offset.
+    """
+    if not os.path.exists(path):
+        return []
+
+    with append_lock(path):
+        if not os.path.exists(index_path(path)):
+            return rebuild_index(path)
+
+        entries = _read_index_file(path)
+        if entries is None or not _index_is_current(path, entries):
+            return rebuild_index(path)
+
+        start = entries[-1]["offset"] + entries[-1]["length"] if entries else 0
+        missing = [_index_entry(offset, length, entry) for offset, length, entry in iter_record_spans(path, start)]
+        if missing:
+            with open(index_path(path), "a", encoding="utf-8") as f:
+                for e in missing:
+                    f.write(json.dumps(e, ensure_ascii=False) + "\n")
+
+    return entries + missing
+
+
+def read_record_at(path: str, offset: int, length: int) -> Dict[str, Any]:
+    with open(path, "rb") as f:
+        f.seek(offset)
+        return json.loads(f.read(length).decode("utf-8"))
+
+
+def find_records(path: str, key: str) -> List[Dict[str, Any]]:
+    """All records whose HAWB / invoice number equals `key` (surrounding spaces ignored), via the index."""
+    key = str(key).strip()
+    return [
+        read_record_at(path, e["offset"], e["length"])
+        for e in load_index(path)
+        if e["key"] is not None and str(e["key"]).strip() == key
+    ]
+
+
+def latest_record_for_source(path: str, source_file: str) -> Optional[Dict[str, Any]]:
+    """The newest record appended for `source_file`, via the index (None if there is none)."""
+    for e in reversed(load_index(path)):
+        if e["source_file"] == source_file:
+            return read_record_at(path, e["offset"], e["length"])
+    return None
+
+
+def tail_records(path: str, n: int) -> List[Dict[str, Any]]:
+    """The last `n` records of the store, without parsing the rest."""
+    if n <= 0:
+        return []
+    return [read_record_at(path, e["offset"], e["length"]) for e in load_index(path)[-n:]]
+
+
+# ----------------------------------------
+# Main Function
+# ----------------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Look up records in a combined store through its sidecar index.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    find = sub.add_parser("find", help="records for one HAWB / invoice number")
+    find.add_argument("store")
+    find.add_argument("key")
+    tail = sub.add_parser("tail", help="the newest records")
+    tail.add_argument("store")
+    tail.add_argument("-n", type=int, default=20, help="number of records (default: 20)")
+    sub.add_parser("reindex", help="rebuild the sidecar index").add_argument("store")
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.store):
+        print(f"ERROR: Store does not exist: {args.store}")
+        return 1
+
+    if args.command == "reindex":
+        with append_lock(args.store):
+            entries = rebuild_index(args.store)
+        print(f"✔ Indexed {len(entries)} records: {index_path(args.store)}")
+        return 0
+
+    records = find_records(args.store, args.key) if args.command == "find" else tail_records(args.store, args.n)
+    for record in records:
+        print(SEPARATOR_LINE)
+        print(json.dumps(record, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
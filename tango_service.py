@@ -0,0 +1,350 @@
+# 17-10-2026
+"""
+Matching service (tango_match --serve)
+--------------------------------------
+
+Keeps the parsed AWB / invoice stores, the invoice index and the match
+results in memory. The stores are tailed by byte offset, and only records
+appended since the last check are parsed. New AWBs, plus open AWBs that
+gain a new candidate invoice, are matched as they arrive. The usual
+outputs (matched_results.json/.txt, match_log.txt, match_state.json,
+match_stats.json) are rewritten after every change, so
+tango_excel_writer and wd2 keep working unchanged.
+
+A whole-file rewrite of a store (wd2 dedup) is detected (new file or
+shorter file) and that store is re-read. match_state.json is
+kept, so unchanged records are not rematched.
+
+Local HTTP API (127.0.0.1 only, JSON):
+    GET  /status
+    GET  /matches?hawb=FRA12345678
+    GET  /matches?awb_file=<path>
+    GET  /matches?invoice_number=1501234567
+    GET  /records?store=awb&key=FRA12345678     stored extractions for one HAWB /
+    GET  /records?store=invoice&last=20         invoice number, or the newest ones
+    POST /rematch            check the stores now
+    POST /rematch?all=1      rematch every unmatched AWB against everything
+
+Run:
+    python tango_match.py --serve [--port 8765] [--poll 2] [--workers N]
+    python tango_service.py [same options]
+
+/records reads the stores through their sidecar index (tango_records), so
+it only parses the records it returns and also sees records appended since
+the last refresh.
+
+Text stores only (TANGO_STORAGE=text).
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Tuple
+from urllib.parse import parse_qs, urlparse
+
+import tango_match as tm
+from tango_records import find_records, iter_record_spans, store_snapshot, tail_records
+from tango_db import use_sqlite
+
+
+class MatchService:
+    """In-memory matcher over the text stores; all state guarded by one lock."""
+
+    def __init__(self, awb_path: str, inv_path: str, out_dir: str, workers: int = 1,
+                 fuzzy: bool = True, consolidation: bool = True):
+        self.awb_path = awb_path
+        self.inv_path = inv_path
+        self.out_dir = out_dir
+        self.workers = workers
+        self.fuzzy = fuzzy
+        self.consolidation = consolidation
+
+        self.lock = threading.RLock()
+        self.tail = {path: {"offset": 0, "ino": None} for path in (awb_path, inv_path)}
+
+        self.awbs: List[Dict[str, Any]] = []
+        self.unique_invoices: Dict[str, Dict[str, Any]] = {}
+        self.invoices: List[Dict[str, Any]] = []
+        self.index = tm.build_invoice_index([])
+        self.results: Dict[str, Dict[str, Any]] = {}
+        self.by_hawb: Dict[str, List[str]] = {}
+        self.by_invoice: Dict[str, List[str]] = {}
+
+        self.state_path = os.path.join(out_dir, tm.MATCH_STATE_FILE)
+        self.state = tm.load_match_state(self.state_path)
+        self.last_refresh = None
+        self.last_summary = {}
+
+        self._load_previous_results()
+
+    # ------------------------------------------------------------------
+    # STORES
+    # ------------------------------------------------------------------
+    def _load_previous_results(self):
+        path = os.path.join(self.out_dir, "matched_results.json")
+        if not os.path.exists(path):
+            return
+
+        with open(path, "r", encoding="utf-8") as f:
+            for r in json.load(f):
+                self.results[r["awb_file"]] = r
+        self._rebuild_lookups()
+
+    def _read_new(self, path: str) -> Tuple[List[Dict[str, Any]], bool]:
+        """Records appended to `path` since the last call, and whether it was rewritten (→ full re-read)."""
+        if not os.path.exists(path):
+            return [], False
+
+        tail = self.tail[path]
+        with store_snapshot(path) as sizes:
+            st = os.stat(path)
+            rewritten = tail["ino"] is not None and (st.st_ino != tail["ino"] or sizes[path] < tail["offset"])
+            if rewritten:
+                tail["offset"] = 0
+
+            records = []
+            for offset, length, record in iter_record_spans(path, tail["offset"], sizes[path]):
+                records.append(record)
+                tail["offset"] = offset + length
+            tail["ino"] = st.st_ino
+
+        return records, rewritten
+
+    # ------------------------------------------------------------------
+    # MATCHING
+    # ------------------------------------------------------------------
+    def refresh(self, rematch_all: bool = False) -> Dict[str, Any]:
+        """Pull new records, match what they affect, rewrite the outputs if anything changed."""
+        with self.lock:
+            started = time.perf_counter()
+            stats = tm.MATCH_STATS
+            stats.reset()
+
+            with stats.phase("load"):
+                new_awbs, awbs_rewritten = self._read_new(self.awb_path)
+                new_invoices, invoices_rewritten = self._read_new(self.inv_path)
+
+            if not (new_awbs or new_invoices or awbs_rewritten or invoices_rewritten or rematch_all):
+                return self.last_summary
+
+            with stats.phase("dedup"):
+                if awbs_rewritten:
+                    self.awbs = []
+                self.awbs.extend(tm.prepare_awbs(new_awbs))
+
+                if invoices_rewritten:
+                    self.unique_invoices = {}
+                for inv in tm.prepare_invoices(new_invoices):
+                    inv_num = tm._features(inv["invoice"]).invoice_number
+                    if inv_num:
+                        self.unique_invoices[inv_num] = inv  # same "last wins" as dedup_invoices
+
+            if new_invoices or invoices_rewritten:
+                with stats.phase("index"):
+                    self.invoices = list(self.unique_invoices.values())
+                    self.index = tm.build_invoice_index(self.invoices)
+
+            with stats.phase("select"):
+                already_matched = {f for f, r in self.results.items() if r.get("matched_invoices")}
+                to_match = tm.select_awbs_to_match(
+                    self.awbs,
+                    self.invoices,
+                    self.index,
+                    already_matched,
+                    set(self.results),
+                    None if rematch_all else self.state
+                )
+
+            with stats.phase("match"):
+                for r in tm.match_awbs(to_match, self.invoices, self.index, self.workers):
+                    r["matched_invoices"] = list({m["invoice_number"]: m for m in r.get("matched_invoices", [])}.values())
+                    self.results[r["awb_file"]] = r
+
+            results = list(self.results.values())
+            matched_now = {a["_source_file"] for a in to_match}
+            if self.fuzzy:
+                with stats.phase("fuzzy"):
+                    tm.fuzzy_rematch_unmatched(results, self.awbs, self.invoices, self.index, matched_now)
+            if self.consolidation:
+                with stats.phase("consolidation"):
+                    tm.consolidate_unmatched_groups(results, self.awbs, self.invoices, self.index, matched_now)
+            self.results = {r["awb_file"]: r for r in results}
+            self._rebuild_lookups()
+
+            with stats.phase("write"):
+                tm.write_match_outputs(results, self.out_dir)
+                tm.save_match_state(self.state_path, self.awbs, self.invoices)
+                self.state = {
+                    "awbs": {tm.record_key(a) for a in self.awbs},
+                    "invoices": {tm.record_key(i) for i in self.invoices}
+                }
+
+            self.last_refresh = datetime.now().isoformat()
+            self.last_summary = {
+                "refreshed": self.last_refresh,
+                "new_awbs": len(new_awbs),
+                "new_invoices": len(new_invoices),
+                "stores_reread": [p for p, flag in ((self.awb_path, awbs_rewritten), (self.inv_path, invoices_rewritten)) if flag],
+                "awbs_matched": len(to_match),
+                "seconds": round(time.perf_counter() - started, 4)
+            }
+            stats.counters.update({k: v for k, v in self.last_summary.items() if isinstance(v, int)})
+            stats.save(os.path.join(self.out_dir, tm.MATCH_STATS_FILE), total_seconds=time.perf_counter() - started)
+
+            print(f"✔ Refreshed: {len(new_awbs)} new AWBs, {len(new_invoices)} new invoices, "
+                  f"{len(to_match)} AWBs matched in {self.last_summary['seconds']:.3f}s")
+            return self.last_summary
+
+    def _rebuild_lookups(self):
+        by_hawb, by_invoice = {}, {}
+        for awb_file, r in self.results.items():
+            if r.get("hawb"):
+                by_hawb.setdefault(str(r["hawb"]).strip(), []).append(awb_file)
+            for m in r.get("matched_invoices", []):
+                by_invoice.setdefault(tm.normalize_invoice_number(m.get("invoice_number")), []).append(awb_file)
+        self.by_hawb, self.by_invoice = by_hawb, by_invoice
+
+    # ------------------------------------------------------------------
+    # QUERIES
+    # ------------------------------------------------------------------
+    def matches(self, hawb: str = None, awb_file: str = None, invoice_number: str = None) -> List[Dict[str, Any]]:
+        with self.lock:
+            if awb_file:
+                files = [awb_file] if awb_file in self.results else []
+            elif hawb:
+                files = self.by_hawb.get(hawb.strip(), [])
+            elif invoice_number:
+                files = self.by_invoice.get(tm.normalize_invoice_number(invoice_number), [])
+            else:
+                files = []
+            return [self.results[f] for f in files]
+
+    def records(self, store: str, key: str = None, last: int = None) -> List[Dict[str, Any]]:
+        """Stored extractions by HAWB / invoice number, or the `last` newest, straight from the store."""
+        path = {"awb": self.awb_path, "invoice": self.inv_path}[store]
+        if key:
+            return find_records(path, key)
+        return tail_records(path, last or 0)
+
+    def status(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                "awbs": len(self.awbs),
+                "invoices": len(self.invoices),
+                "results": len(self.results),
+                "results_with_matches": sum(1 for r in self.results.values() if r.get("matched_invoices")),
+                "last_refresh": self.last_summary
+            }
+
+
+# ============================================================================
+# HTTP API
+# ============================================================================
+
+def make_handler(service: MatchService):
+
+    class Handler(BaseHTTPRequestHandler):
+
+        def _send(self, status: int, payload):
+            body = json.dumps(payload, ensure_ascii=False, indent=2).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _query(self):
+            url = urlparse(self.path)
+            return url.path, {k: v[0] for k, v in parse_qs(url.query).items()}
+
+        def do_GET(self):
+            path, query = self._query()
+
+            if path == "/status":
+                self._send(200, service.status())
+            elif path == "/matches":
+                if not any(query.get(k) for k in ("hawb", "awb_file", "invoice_number")):
+                    self._send(400, {"error": "give hawb, awb_file or invoice_number"})
+                    return
+                self._send(200, service.matches(query.get("hawb"), query.get("awb_file"), query.get("invoice_number")))
+            elif path == "/records":
+                if query.get("store") not in ("awb", "invoice") or not (query.get("key") or query.get("last")):
+                    self._send(400, {"error": "give store=awb|invoice and key or last"})
+                    return
+                try:
+                    last = int(query.get("last") or 0)
+                except ValueError:
+                    self._send(400, {"error": "last must be a number"})
+                    return
+                self._send(200, service.records(query["store"], query.get("key"), last))
+            else:
+                self._send(404, {"error": f"unknown path {path}"})
+
+        def do_POST(self):
+            path, query = self._query()
+
+            if path == "/rematch":
+                self._send(200, service.refresh(rematch_all=query.get("all") in ("1", "true", "yes")))
+            else:
+                self._send(404, {"error": f"unknown path {path}"})
+
+        def log_message(self, fmt, *args):
+            pass  # one line per query would drown the refresh output
+
+    return Handler
+
+
+def _poll_stores(service: MatchService, interval: float, stop: threading.Event):
+    while not stop.wait(interval):
+        try:
+            service.refresh()
+        except Exception as e:
+            # Keep serving; the next poll retries
+            print(f"[WARN] Refresh failed: {e}")
+
+
+def serve(args):
+    if use_sqlite():
+        print("ERROR: --serve tails the text stores; it does not support TANGO_STORAGE=sqlite")
+        return
+
+    os.makedirs(tm.OUT_DIR, exist_ok=True)
+
+    service = MatchService(
+        tm.AWB_PATH, tm.INV_PATH, tm.OUT_DIR,
+        workers=args.workers,
+        fuzzy=not args.no_fuzzy,
+        consolidation=not args.no_consolidation
+    )
+
+    print("Loading AWB + Invoice data...")
+    service.refresh()
+    print(f"Loaded {len(service.awbs)} AWB entries, {len(service.invoices)} UNIQUE Invoice entries")
+
+    stop = threading.Event()
+    poller = threading.Thread(target=_poll_stores, args=(service, args.poll, stop), daemon=True)
+    poller.start()
+
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(service))
+    print(f"→ Serving on http://127.0.0.1:{args.port}  (GET /status, GET /matches?hawb=..., POST /rematch)")
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nStopping...")
+    finally:
+        stop.set()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    try:
+        with tm.single_run_lock():
+            tm.main(["--serve"] + sys.argv[1:])
+    except TimeoutError:
+        print(f"Another matching run is in progress ({tm.LOCK_FILE}) → exiting.")
+        sys.exit(1)
@@ -0,0 +1,221 @@
+# 17-10-2026
+"""
+Cold-start budget for the entry points
+--------------------------------------
+
+Every file the watcher hands over (in subprocess mode), every matching run
+and every Excel export starts a fresh interpreter, so import time is paid
+each time. This script starts a clean `python -X importtime` for each
+entry point and checks it against a budget:
+
+    process_awb          import process_awb
+    process_invoice      import process_invoice
+    tango_match          import tango_match
+    tango_excel_writer   its import block only (the script runs on import)
+
+It also checks that the extractors still leave cv2, pytesseract, numpy,
+PIL, langchain and the Gemini client until a file actually needs them.
+
+    python tango_startup.py                      best of 3, fails (exit 1) over budget
+    python tango_startup.py --repeat 5 --top 15
+    python tango_startup.py --budget tango_match=250 --output startup.json
+
+Times are the best of --repeat runs, since the first run after a reboot
+also measures disk cache misses.
+
+The tests always check the deferred imports (entry points whose third-party
+dependencies are not installed are skipped); the time budgets depend on the
+machine and are only checked when asked for:
+
+    python -m pytest tests/test_startup.py
+    TANGO_STARTUP_BUDGET=1 python -m pytest tests/test_startup.py
+"""
+
+import argparse
+import ast
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+from typing import Any, Dict
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Import-time budget per entry point, milliseconds
+BUDGETS_MS = {
+    "process_awb": 600,
+    "process_invoice": 600,
+    "tango_match": 400,
+    "tango_excel_writer": 1000,  # pandas, which the export needs anyway
+}
+
+# Entry points that run their work at import time: only their imports are measured
+SCRIPTS = {"tango_excel_writer"}
+
+# Top-level packages that must not be imported just by starting an entry point
+DEFERRED = {
+    "process_awb": ["cv2", "pytesseract", "numpy", "PIL", "langchain", "langchain_google_genai"],
+    "process_invoice": ["cv2", "pytesseract", "numpy", "PIL", "langchain", "langchain_google_genai",
+                        "sentence_transformers", "torch"],
+}
+
+START_MARKER = "--- tango_startup: imports start ---"
+IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def import_code(name: str) -> str:
+    """Code that reproduces the entry point's imports."""
+    if name not in SCRIPTS:
+        return f"import {name}"
+
+    with open(os.path.join(HERE, f"{name}.py"), "r", encoding="utf-8") as f:
+        source = f.read()
+
+    lines = []
+    for node in ast.parse(source).body:
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            lines.append(ast.get_source_segment(source, node))
+    return "\n".join(lines)
+
+
+def measure(name: str) -> Dict[str, Any]:
+    """One cold start: total import time and the per-module breakdown."""
+    code = (
+        "import sys as _s, time as _t\n"
+        f"_s.stderr.write({START_MARKER!r} + '\\n')\n"
+        "_start = _t.perf_counter()\n"
+        + import_code(name) + "\n"
+        "print(_t.perf_counter() - _start)\n"
+    )
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=HERE, capture_output=True, text=True, encoding="utf-8", errors="replace"
+    )
+
+    modules = {}
+    other = []
+    started = False
+    for line in proc.stderr.splitlines():
+        if line == START_MARKER:
+            started = True  # everything before is interpreter start-up (site, encodings, ...)
+            continue
+        m = IMPORTTIME_LINE.match(line)
+        if m:
+            if not started:
+                continue
+            self_us, cumulative_us, indent, module = m.groups()
+            modules[module] = {
+                "self_ms": int(self_us) / 1000,
+                "cumulative_ms": int(cumulative_us) / 1000,
+                "top_level": len(indent) == 1
+            }
+        else:
+            other.append(line)
+
+    if proc.returncode != 0:
+        return {"error": (other or ["exit code %d" % proc.returncode])[-1]}
+
+    return {
+        "import_ms": float(proc.stdout.strip().splitlines()[-1]) * 1000,
+        "modules": modules
+    }
+
+
+def check_entry_point(name: str, repeat: int, budget_ms: float) -> Dict[str, Any]:
+    runs = [measure(name) for _ in range(repeat)]
+    errors = [r["error"] for r in runs if "error" in r]
+    if errors:
+        return {"name": name, "error": errors[0], "problems": [f"{name}: import failed: {errors[0]}"]}
+
+    best = min(runs, key=lambda r: r["import_ms"])
+    loaded = {module.split(".")[0] for module in best["modules"]}
+    eager = [pkg for pkg in DEFERRED.get(name, []) if pkg in loaded]
+
+    problems = []
+    if best["import_ms"] > budget_ms:
+        problems.append(f"{name}: {best['import_ms']:.0f} ms > budget {budget_ms:.0f} ms")
+    if eager:
+        problems.append(f"{name}: imports {', '.join(eager)} at start (should be deferred)")
+
+    return {
+        "name": name,
+        "import_ms": round(best["import_ms"], 1),
+        "budget_ms": budget_ms,
+        "runs_ms": [round(r["import_ms"], 1) for r in runs],
+        "eager": eager,
+        "modules": best["modules"],
+        "problems": problems
+    }
+
+
+def print_result(result: Dict[str, Any], top: int):
+    if "error" in result:
+        print(f"\n{result['name']}: ✗ {result['error']}")
+        return
+
+    flag = "✔" if not result["problems"] else "✗"
+    print(f"\n{result['name']}: {flag} {result['import_ms']:.0f} ms (budget {result['budget_ms']:.0f} ms, "
+          f"runs {', '.join(f'{ms:.0f}' for ms in result['runs_ms'])})")
+
+    # The top-level imports that make up the total, heaviest first
+    heaviest = sorted(
+        ((module, info) for module, info in result["modules"].items() if info["top_level"]),
+        key=lambda item: item[1]["cumulative_ms"],
+        reverse=True
+    )[:top]
+    for module, info in heaviest:
+        print(f"   {info['cumulative_ms']:>8.1f} ms  {module}")
+
+    for line in result["problems"]:
+        print(f"   → {line}")
+
+
+# ----------------------------------------
+# Main Function
+# ----------------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure cold-start import time of the TANGO entry points.")
+    parser.add_argument("names", nargs="*", default=list(BUDGETS_MS),
+                        help=f"entry points to check (default: {' '.join(BUDGETS_MS)})")
+    parser.add_argument("--repeat", type=int, default=3, help="fresh interpreters per entry point; the best counts")
+    parser.add_argument("--top", type=int, default=8, help="heaviest imports to list per entry point")
+    parser.add_argument("--budget", action="append", default=[], metavar="NAME=MS",
+                        help="override a budget, e.g. --budget tango_match=250")
+    parser.add_argument("--output", metavar="PATH", help="also save the measurements as JSON")
+    args = parser.parse_args(argv)
+
+    budgets = dict(BUDGETS_MS)
+    for item in args.budget:
+        name, _, ms = item.partition("=")
+        budgets[name] = float(ms)
+
+    results = []
+    for name in args.names:
+        result = check_entry_point(name, max(1, args.repeat), budgets.get(name, float("inf")))
+        print_result(result, args.top)
+        results.append(result)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "results": results
+            }, f, indent=2)
+        print(f"\n✔ Report saved to: {args.output}")
+
+    problems = [line for r in results for line in r["problems"]]
+    if problems:
+        print(f"\n✗ {len(problems)} start-up problem(s):")
+        for line in problems:
+            print(f"   {line}")
+        return 1
+
+    print("\n✔ All entry points within budget")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
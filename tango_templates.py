@@ -0,0 +1,453 @@
+# 17-10-2026
+"""
+Layout templates for recurring AWB forms
+----------------------------------------
+
+Most AWBs come from a handful of forwarders whose forms never change. For
+those, the position of every value on the page is enough; the model is not
+needed. This module learns that from PyMuPDF word boxes
+(page.get_text("words")) of AWBs the model has already extracted.
+
+Learning:
+    fingerprint  label-like words (letters only, 3+ chars) with their
+                 position rounded to a GRID-point grid. Over several
+                 samples only the tokens present every time are kept: the
+                 static form labels.
+    regions      for every extracted value, the words that spell it (after
+                 normalization) and their bounding box. Boxes are merged
+                 over samples. A field whose value shows up somewhere
+                 else, or that cannot be found at all, is never used; a
+                 value printed twice on the page teaches nothing. A list
+                 field other than invoice_numbers (other_reference_numbers)
+                 is only learned if reading its region back gives the
+                 same list.
+    empty        a field the model left empty in every sample (and at
+                 least MIN_EMPTY_SAMPLES of them) is filled in empty.
+
+Only the fields the model returned are learned from
+(process_awb.extract_fields passes those); values the fast path or the
+template itself read teach nothing new.
+
+Extraction:
+    A PDF on the same page size that has at least MATCH_THRESHOLD of a
+    template's fingerprint tokens uses that template. Each usable field
+    is read from the words inside its region, then validated: formats for
+    mawb / hawb / vin_no / order_no / invoice_numbers, numbers that parse,
+    nothing empty. If any field fails validation, the whole template
+    result is dropped. Fields learned as empty are filled in empty.
+
+A template is used only after MIN_SAMPLES samples. Fields it cannot read
+go to the model (process_awb.extract_fields); if it reads every field,
+there is no model call at all.
+
+    python tango_templates.py list
+    python tango_templates.py forget <template_id>
+
+Settings (.env):
+    TANGO_TEMPLATES=off
+    TANGO_TEMPLATES_PATH=C:\\path\\to\\awb_templates.json
+"""
+
+import argparse
+import copy
+import json
+import os
+import re
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from tango_records import atomic_write, file_lock
+from tango_fastpath import INVOICE_PREFIXES
+
+TEMPLATES_ENABLED = os.getenv("TANGO_TEMPLATES", "on").lower() not in ("0", "off", "false", "no")
+TEMPLATES_PATH = os.getenv(
+    "TANGO_TEMPLATES_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "awb_templates.json")
+)
+
+GRID = 8                      # points; fingerprint positions are rounded to this
+MIN_SAMPLES = 2               # samples before a template (and each of its fields) is used
+MIN_EMPTY_SAMPLES = 3         # samples a field must be empty in before it is filled in empty
+MIN_TOKENS = 10               # fewer stable labels than this is not a recognisable form
+MATCH_THRESHOLD = 0.8         # share of a template's labels an incoming PDF must have
+CANDIDATE_THRESHOLD = 0.5     # same, for a 1-sample template (its tokens still include variable text)
+PAGE_TOLERANCE = 2.0          # points
+REGION_MARGIN = 3.0           # points around a learned region
+REGION_GROW_RIGHT = 0.5       # longer values than seen so far: extend regions right by this share
+MAX_TEMPLATES = 200
+
+# Bump when learning or reading rules change (part of the AWB extraction cache version)
+TEMPLATES_VERSION = "2"
+
+# List fields read as invoice numbers; other list fields are read one item per word
+INVOICE_LIST_FIELDS = {"invoice_numbers"}
+LIST_SEPARATORS = re.compile(r"[\s,;]+")
+
+EMPTY_VALUES = (None, "", [])
+
+# Normalized formats, the same rules build_prompt gives the model
+FORMATS = {
+    "mawb": re.compile(r"\d{3}[A-Z]{3}\d{8}"),
+    "hawb": re.compile(r"[A-Z]{3}\d{8}"),
+    "vin_no": re.compile(r"[A-HJ-NPR-Z0-9]{17}"),
+    "order_no": re.compile(r"\d{10}"),
+}
+
+LABEL_RE = re.compile(r"[A-Za-z][A-Za-z.:/&()'-]{2,}")
+NUMBER_RE = re.compile(r"\d[\d.,]*")
+
+AMBIGUOUS = "ambiguous"
+
+Word = Tuple[float, float, float, float, str, int, int, int]   # page.get_text("words") entry
+Box = List[float]
+
+
+# ============================================================================
+# WORDS / VALUES
+# ============================================================================
+
+def template_signature() -> str:
+    """Whether templates are used, and by which rules (part of the AWB extraction cache version)."""
+    return f"{TEMPLATES_VERSION}:{'on' if TEMPLATES_ENABLED else 'off'}"
+
+
+def normalize(value: Any) -> str:
+    return re.sub(r"[^A-Z0-9]", "", str(value).upper())
+
+
+def parse_number(text: str) -> Optional[float]:
+    """'42,000 KG' → 42.0, '1.234,5' → 1234.5, '12.5' → 12.5 (comma decimal, as the prompt asks)."""
+    m = NUMBER_RE.search(text or "")
+    if not m:
+        return None
+    s = m.group().rstrip(".,")
+    if "," in s and "." in s:
+        if s.rfind(",") > s.rfind("."):
+            s = s.replace(".", "").replace(",", ".")
+        else:
+            s = s.replace(",", "")
+    else:
+        s = s.replace(",", ".")
+        if s.count(".") > 1:
+            s = s.replace(".", "")
+    try:
+        return float(s)
+    except ValueError:
+        return None
+
+
+def fingerprint(words: List[Word]) -> set:
+    return {(w[4].lower(), round(w[0] / GRID), round(w[1] / GRID)) for w in words if LABEL_RE.fullmatch(w[4])}
+
+
+def _union(boxes: List[Box]) -> Box:
+    return [min(b[0] for b in boxes), min(b[1] for b in boxes), max(b[2] for b in boxes), max(b[3] for b in boxes)]
+
+
+def _overlaps(a: Box, b: Box, margin: float = REGION_MARGIN) -> bool:
+    return not (a[2] + margin < b[0] or b[2] + margin < a[0] or a[3] + margin < b[1] or b[3] + margin < a[1])
+
+
+def _find_text(words: List[Word], key: str) -> List[Box]:
+    """Boxes of every run of consecutive words that spells `key` (normalized)."""
+    if len(key) < 2:
+        return []
+
+    found = []
+    for i in range(len(words)):
+        acc = ""
+        for j in range(i, len(words)):
+            acc += normalize(words[j][4])
+            if acc == key:
+                found.append(_union([list(w[:4]) for w in words[i:j + 1]]))
+                break
+            if not key.startswith(acc):
+                break
+    return found
+
+
+def locate(words: List[Word], value: Any, kind: str):
+    """Where `value` (as the model returned it) is printed: a box, None (not found) or AMBIGUOUS."""
+    if kind == "list":
+        boxes = [locate(words, v, "str") for v in value or []]
+        if AMBIGUOUS in boxes:
+            return AMBIGUOUS
+        if not boxes or None in boxes:
+            return None
+        return _union(boxes)
+
+    if kind in ("int", "float"):
+        found = [list(w[:4]) for w in words if parse_number(w[4]) == float(value)]
+    else:
+        found = _find_text(words, normalize(value))
+
+    if len(found) > 1:
+        return AMBIGUOUS   # e.g. "1" pieces and a "Page 1" label: no way to tell which
+    return found[0] if found else None
+
+
+def _inside(w: Word, box: Box) -> bool:
+    return box[0] <= (w[0] + w[2]) / 2 <= box[2] and box[1] <= (w[1] + w[3]) / 2 <= box[3]
+
+
+def words_in(words: List[Word], box: Box, labels: set = frozenset()) -> List[Word]:
+    """Words of a learned region, grown a little for values longer than the samples.
+
+    In the grown part, the template's static labels are left out, so a
+    neighbouring box's caption never ends up in the value.
+    """
+    width = box[2] - box[0]
+    grown = [box[0] - REGION_MARGIN, box[1] - REGION_MARGIN,
+             box[2] + REGION_MARGIN + width * REGION_GROW_RIGHT, box[3] + REGION_MARGIN]
+    return [
+        w for w in words
+        if _inside(w, grown) and (_inside(w, box) or next(iter(fingerprint([w])), None) not in labels)
+    ]
+
+
+def _format_value(field: str, words: List[Word]) -> Optional[str]:
+    """The one run of consecutive words that normalizes to the field's format."""
+    found = set()
+    for i in range(len(words)):
+        acc = ""
+        for w in words[i:]:
+            acc += normalize(w[4]) if field != "order_no" else re.sub(r"\D", "", w[4])
+            if FORMATS[field].fullmatch(acc):
+                found.add(acc)
+                break
+            if len(acc) >= 17:
+                break
+    return found.pop() if len(found) == 1 else None
+
+
+def read_field(field: str, kind: str, words: List[Word]):
+    """Value of `field` from the words in its region, or None when it does not validate."""
+    text = " ".join(w[4] for w in words).strip()
+    if not text:
+        return None
+
+    if kind == "int":
+        n = parse_number(text)
+        return int(n) if n is not None and n == int(n) else None
+    if kind == "float":
+        return parse_number(text)
+    if kind == "list":
+        if field in INVOICE_LIST_FIELDS:
+            numbers = [n for n in re.findall(r"(?<!\d)\d{10}(?!\d)", text) if n.startswith(INVOICE_PREFIXES)]
+            return list(dict.fromkeys(numbers)) or None
+        items = [x for w in words for x in LIST_SEPARATORS.split(w[4]) if x]
+        return list(dict.fromkeys(items)) or None
+
+    if field in FORMATS:
+        return _format_value(field, words)
+    return text
+
+
+# ============================================================================
+# TEMPLATE STORE
+# ============================================================================
+
+class TemplateStore:
+    """Learned layouts in one JSON file; every update is read-modify-write under a lock."""
+
+    def __init__(self, path: str = TEMPLATES_PATH):
+        self.path = path
+        self.lock_path = path + ".lock"
+        self._cache = (None, [])
+
+    def load(self) -> List[Dict[str, Any]]:
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return []
+        if self._cache[0] != mtime:
+            with open(self.path, "r", encoding="utf-8") as f:
+                self._cache = (mtime, json.load(f).get("templates", []))
+        return self._cache[1]
+
+    def _save(self, templates: List[Dict[str, Any]]):
+        with atomic_write(self.path) as f:
+            json.dump({"templates": templates}, f, indent=2)
+
+    def _update(self, fn):
+        with file_lock(self.lock_path):
+            self._cache = (None, [])
+            # fn changes a copy: if it or the save fails, the cache still matches the file
+            templates = copy.deepcopy(self.load())
+            result = fn(templates)
+            self._save(templates)
+            self._cache = (os.path.getmtime(self.path), templates)
+            return result
+
+    # ------------------------------------------------------------------
+    # MATCHING / EXTRACTION
+    # ------------------------------------------------------------------
+    def match(self, words: List[Word], page: Tuple[float, float],
+              templates: Optional[List[Dict[str, Any]]] = None, active_only: bool = True):
+        """(best template, score) for this page, or (None, 0.0)."""
+        tokens = fingerprint(words)
+        best, best_score = None, 0.0
+
+        for t in self.load() if templates is None else templates:
+            if active_only and t["samples"] < MIN_SAMPLES:
+                continue
+            if abs(t["page"][0] - page[0]) > PAGE_TOLERANCE or abs(t["page"][1] - page[1]) > PAGE_TOLERANCE:
+                continue
+            stable = {tuple(x) for x in t["tokens"]}
+            if len(stable) < MIN_TOKENS:
+                continue
+
+            score = len(tokens & stable) / len(stable)
+            threshold = MATCH_THRESHOLD if t["samples"] >= MIN_SAMPLES else CANDIDATE_THRESHOLD
+            if score >= threshold and score > best_score:
+                best, best_score = t, score
+
+        return best, best_score
+
+    def extract(self, words: List[Word], page: Tuple[float, float], field_kinds: Dict[str, str]):
+        """(template id, fields read) from the matching template, or (None, {})."""
+        if not TEMPLATES_ENABLED or not words:
+            return None, {}
+
+        template, _ = self.match(words, page)
+        if template is None:
+            return None, {}
+
+        labels = {tuple(x) for x in template["tokens"]}
+        values = {}
+        for field, empty in template.get("empty", {}).items():
+            if field in field_kinds and empty and empty["samples"] >= MIN_EMPTY_SAMPLES:
+                values[field] = copy.copy(empty["value"])
+        for field, info in template["fields"].items():
+            if field not in field_kinds or info["misses"] or info["hits"] < MIN_SAMPLES or not info["box"]:
+                continue
+            value = read_field(field, field_kinds[field], words_in(words, info["box"], labels))
+            if value is None:
+                return template["id"], None   # validation failed: do not trust any of it
+            values[field] = value
+
+        return template["id"], values
+
+    # ------------------------------------------------------------------
+    # LEARNING
+    # ------------------------------------------------------------------
+    def learn(self, words: List[Word], page: Tuple[float, float], values: Dict[str, Any],
+              field_kinds: Dict[str, str]) -> Optional[str]:
+        """
+        Add one extracted AWB to the template of its layout (new layout → new
+        template). `values` holds only the fields to learn from; the others
+        are left as they are.
+        """
+        if not TEMPLATES_ENABLED or not words:
+            return None
+
+        tokens = fingerprint(words)
+        if len(tokens) < MIN_TOKENS:
+            return None
+
+        boxes, empty = {}, {}
+        for field, value in values.items():
+            kind = field_kinds.get(field)
+            if kind is None:
+                continue
+            if value in EMPTY_VALUES:
+                empty[field] = value
+                continue
+            if value in (0, 0.0):
+                continue   # a 0 is printed all over a form
+            box = locate(words, value, kind)
+            if box == AMBIGUOUS:
+                continue
+            if box is not None and kind == "list" and field not in INVOICE_LIST_FIELDS:
+                read = read_field(field, kind, [w for w in words if _inside(w, box)]) or []
+                if [normalize(x) for x in read] != [normalize(x) for x in value]:
+                    box = None   # the region does not read back as this list
+            boxes[field] = box
+
+        def update(templates):
+            template, _ = self.match(words, page, templates, active_only=False)
+            now = time.strftime("%Y-%m-%dT%H:%M:%S")
+
+            if template is None:
+                template = {
+                    "id": f"t{int(time.time() * 1000):x}",
+                    "created": now,
+                    "page": [round(page[0], 1), round(page[1], 1)],
+                    "samples": 0,
+                    "tokens": sorted(tokens),
+                    "fields": {}
+                }
+                templates.append(template)
+                del templates[:-MAX_TEMPLATES]
+            else:
+                template["tokens"] = sorted({tuple(x) for x in template["tokens"]} & tokens)
+
+            template["samples"] += 1
+            template["updated"] = now
+
+            # Empty so far in every sample: count it; a value once → never filled in empty
+            seen_empty = template.setdefault("empty", {})
+            for field, value in empty.items():
+                if field not in seen_empty:
+                    seen_empty[field] = {"value": value, "samples": 0}
+                if seen_empty[field] is not None:
+                    seen_empty[field] = {"value": value, "samples": seen_empty[field]["samples"] + 1}
+            for field in boxes:
+                seen_empty[field] = None
+
+            for field, box in boxes.items():
+                info = template["fields"].get(field)
+                if info is None:
+                    if box is None:
+                        continue   # nothing to learn from yet
+                    info = template["fields"][field] = {"box": box, "hits": 0, "misses": 0}
+                if box is None or not info["box"] or not _overlaps(info["box"], box):
+                    info["misses"] += 1   # not printed where it was before: not a fixed position
+                    continue
+                info["box"] = _union([info["box"], box])
+                info["hits"] += 1
+
+            return template["id"]
+
+        return self._update(update)
+
+    def forget(self, template_id: str) -> bool:
+        def update(templates):
+            before = len(templates)
+            templates[:] = [t for t in templates if t["id"] != template_id]
+            return len(templates) < before
+
+        return self._update(update)
+
+
+# ----------------------------------------
+# Main Function
+# ----------------------------------------
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Learned AWB layout templates.")
+    parser.add_argument("--path", default=TEMPLATES_PATH, help=f"template file (default: {TEMPLATES_PATH})")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("list", help="templates with their samples and usable fields")
+    forget = sub.add_parser("forget", help="drop one template (it is relearned from the next samples)")
+    forget.add_argument("template_id")
+    args = parser.parse_args(argv)
+
+    store = TemplateStore(args.path)
+
+    if args.command == "list":
+        for t in store.load():
+            usable = sorted(f for f, i in t["fields"].items() if i["hits"] >= MIN_SAMPLES and not i["misses"])
+            usable += sorted(f"{f} (empty)" for f, e in t.get("empty", {}).items()
+                             if e and e["samples"] >= MIN_EMPTY_SAMPLES)
+            state = "active" if t["samples"] >= MIN_SAMPLES else "learning"
+            print(f"{t['id']}  {state:<8}  samples={t['samples']:<4} labels={len(t['tokens']):<4} "
+                  f"page={t['page'][0]}x{t['page'][1]}  fields: {', '.join(usable) or '-'}")
+    elif args.command == "forget":
+        if store.forget(args.template_id):
+            print(f"✔ Forgot template {args.template_id}")
+        else:
+            print(f"[WARN] No template {args.template_id}")
+
+
+if __name__ == "__main__":
+    main()
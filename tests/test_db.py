@@ -0,0 +1,83 @@
+import pytest
+
+import tango_db
+from tango_db import TangoStore
+from tango_records import append_record
+
+
+def test_reimport_counts_only_new_rows(tmp_path):
+    awb_path, invoice_path = str(tmp_path / "awb.txt"), str(tmp_path / "invoice.txt")
+    append_record(awb_path, {"_source_file": "a.pdf", "_timestamp": "t1", "awb": {"invoice_numbers": ["1"]}})
+    append_record(invoice_path, {"_source_file": "i.pdf", "_timestamp": "t1", "invoice": {"invoice_number": "1"}})
+
+    with TangoStore(str(tmp_path / "tango.db")) as store:
+        assert store.import_text_stores(awb_path, invoice_path) == {"awbs": 1, "invoices": 1, "match_results": 0}
+        assert store.import_text_stores(awb_path, invoice_path) == {"awbs": 0, "invoices": 0, "match_results": 0}
+
+        append_record(awb_path, {"_source_file": "b.pdf", "_timestamp": "t2", "awb": {}})
+        assert store.import_text_stores(awb_path)["awbs"] == 1
+
+
+def test_snapshot_error_is_not_hidden(tmp_path):
+    with TangoStore(str(tmp_path / "tango.db")) as store:
+        with pytest.raises(KeyError):
+            with store.snapshot():
+                store.conn.execute("COMMIT")   # transaction gone, as after some sqlite errors
+                raise KeyError("boom")
+
+        assert not store.conn.in_transaction
+        with store.snapshot():
+            pass
+
+
+def _lookup_store(tmp_path):
+    store = TangoStore(str(tmp_path / "tango.db"))
+    store.add_awb({"_source_file": "C:\\awb\\a.pdf", "_timestamp": "t1", "awb": {
+        "hawb": "FRA00000001", "vin_no": "W1ND00000000000001", "invoice_numbers": ["15-0001 234"]}})
+    store.add_awb({"_source_file": "C:\\awb\\b.pdf", "_timestamp": "t1", "awb": {
+        "hawb": "FRA00000002", "invoice_numbers": ["150009999"]}})
+    store.add_invoice({"_source_file": "C:\\inv\\i.pdf", "_timestamp": "t1", "invoice": {
+        "invoice_number": "150001234", "vin_no": "W1ND00000000000001"}})
+    return store
+
+
+def test_find_by_each_key(tmp_path):
+    with _lookup_store(tmp_path) as store:
+        assert [e["_source_file"] for e in store.find(hawb=" FRA00000002 ")] == ["C:\\awb\\b.pdf"]
+        # Invoice numbers compare as digits: the AWB's "15-0001 234" is invoice 150001234
+        assert [e["_source_file"] for e in store.find(invoice_number="150001234")] == ["C:\\awb\\a.pdf", "C:\\inv\\i.pdf"]
+        assert [e["_source_file"] for e in store.find(vin_no="W1ND00000000000001")] == ["C:\\awb\\a.pdf", "C:\\inv\\i.pdf"]
+        assert store.find(hawb="FRA99999999") == []
+
+
+def test_find_by_source_file(tmp_path):
+    source = str(tmp_path / "i.pdf")
+    with _lookup_store(tmp_path) as store:
+        store.add_invoice({"_source_file": source, "_timestamp": "t2", "invoice": {"invoice_number": "1"}})
+        assert [e["_timestamp"] for e in store.find(source_file=source)] == ["t2"]
+
+
+def test_find_cli(tmp_path, capsys):
+    _lookup_store(tmp_path).close()
+    assert tango_db.main(["find", "--invoice", "150009999", "--db", str(tmp_path / "tango.db")]) == 0
+    out = capsys.readouterr().out
+    assert "FRA00000002" in out and "✔ 1 stored entries" in out
+
+    assert tango_db.main(["find", "--hawb", "X", "--db", str(tmp_path / "missing.db")]) == 1
+
+
+def test_cached_result_already_stored(tmp_path, monkeypatch):
+    path = str(tmp_path / "awb_all_output.txt")
+    entry = {"_source_file": "C:\\awb\\a.pdf", "_timestamp": "t1", "awb": {"hawb": "FRA00000001", "no_pieces": 2}}
+    assert not tango_db.already_stored(entry, path)
+
+    append_record(path, entry)
+    assert tango_db.already_stored(dict(entry, _timestamp="t2"), path)
+    assert not tango_db.already_stored(dict(entry, awb={"hawb": "FRA00000001", "no_pieces": 3}), path)
+
+    monkeypatch.setattr(tango_db, "STORAGE_BACKEND", "sqlite")
+    monkeypatch.setattr(tango_db, "DB_PATH", str(tmp_path / "tango.db"))
+    assert not tango_db.already_stored(entry, path)
+    with TangoStore(str(tmp_path / "tango.db")) as store:
+        store.add_awb(entry)
+    assert tango_db.already_stored(dict(entry, _timestamp="t2"), path)
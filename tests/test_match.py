@@ -0,0 +1,182 @@
+import argparse
+import json
+import shutil
+
+import pytest
+
+import tango_match
+from tango_match import build_invoice_index, match_mbag_production_parts, prepare_invoices, screen_single_candidates
+from tango_records import append_record
+
+
+@pytest.mark.parametrize("awb_pieces, inv_pieces, expected", [
+    (5, 5, True),
+    (5, 5.0, True),
+    (None, None, True),
+    ("abc", "abc", True),
+    ("abc", 2.5, False),
+    ("5", 5, False),
+    (2.5, 2, False),
+])
+def test_single_pieces_compare_like_raw_values(awb_pieces, inv_pieces, expected):
+    awb = {"no_pieces": awb_pieces, "gross_weight": 10.0}
+    inv = {"no_pieces": inv_pieces, "gross_weight": 10.0}
+    matched, details, _ = match_mbag_production_parts(awb, inv)
+    assert details["pieces_match"] is expected
+    assert matched is expected
+
+
+@pytest.mark.parametrize("awb_pieces, screened", [
+    (5, True), (5.0, True), (None, True), ("5", False), ("abc", False), (2.5, False),
+])
+def test_screen_keeps_exactly_the_pieces_matches(awb_pieces, screened):
+    if tango_match.np is None:
+        pytest.skip("numpy not installed")
+
+    values = [5, 5.0, None, "5", "abc", 2.5, 2, 0] * 5
+    invoices = prepare_invoices([
+        {"_source_file": f"i{k}.pdf", "invoice": {"no_pieces": v, "gross_weight": 10.0}}
+        for k, v in enumerate(values)
+    ])
+    index = build_invoice_index(invoices)
+
+    kept = set(screen_single_candidates({"no_pieces": awb_pieces, "gross_weight": 10.0},
+                                        list(range(len(invoices))), index))
+    if screened:
+        assert kept == {k for k, v in enumerate(values) if v == awb_pieces}
+    else:
+        assert kept == set(range(len(values)))   # only == on the raw values can tell
+
+
+def _consolidation_case(category, listed):
+    awb = {"_source_file": "a.pdf", "awb": {
+        "classification": {"category": category}, "invoice_numbers": listed,
+        "no_pieces": 5, "gross_weight": 50.0, "executed_on_date": "01-03-2026"}}
+    invoices = prepare_invoices([
+        {"_source_file": f"i{k}.pdf", "invoice": {
+            "invoice_number": number, "no_pieces": pieces, "gross_weight": weight, "invoice_date": "28-02-2026"}}
+        for k, (number, pieces, weight) in enumerate([
+            (listed[0], 2, 20.0),
+            ("4900000777", 3, 30.0),   # makes up the rest, but from another prefix
+        ])
+    ])
+    tango_match.prepare_awbs([awb])
+    results = [{"awb_file": "a.pdf", "matched_invoices": []}]
+    count = tango_match.consolidate_unmatched_groups(results, [awb], invoices, build_invoice_index(invoices))
+    return count, results[0]
+
+
+def test_consolidation_needs_a_prefix():
+    # MBUSI has no fixed prefix and the listed numbers share none: skipped, not searched against everything
+    count, result = _consolidation_case("MBUSI", ["1500000001", "4000000002"])
+    assert count == 0
+    assert result["consolidation"] == "no_prefix"
+
+
+def test_consolidation_stays_within_prefix():
+    count, result = _consolidation_case("BBAC Production Parts", ["1500000001"])
+    assert count == 0 and not result["matched_invoices"]
+
+    count, result = _consolidation_case("MBUSI", ["4900000001"])
+    assert count == 1
+    assert result["matched_invoices"][0]["details"]["recovered_invoice_numbers"] == ["4900000777"]
+
+
+def _fuzzy_case(*extra_invoice_numbers, b_number="1500000007"):
+    def awb(name, number):
+        return {"_source_file": name, "awb": {
+            "classification": {"category": "MBAG Production Parts"},
+            "invoice_numbers": [number], "no_pieces": 2, "gross_weight": 20.0}}
+
+    awbs = tango_match.prepare_awbs([awb("a.pdf", "1500000001"), awb("b.pdf", b_number)])
+    invoices = prepare_invoices([
+        {"_source_file": f"i{k}.pdf", "invoice": {"invoice_number": number, "no_pieces": 2, "gross_weight": 20.0}}
+        for k, number in enumerate(("1500000001",) + extra_invoice_numbers)
+    ])
+    index = build_invoice_index(invoices)
+    results = tango_match.match_awbs(awbs, invoices, index)
+    return results, awbs, invoices, index
+
+
+def test_fuzzy_rematch_is_not_counted_twice():
+    if tango_match.fuzz_process is None or tango_match.np is None:
+        pytest.skip("rapidfuzz/numpy not installed")
+
+    tango_match.MATCH_STATS.reset()
+    results, awbs, invoices, index = _fuzzy_case("1500000077", b_number="1500000078")
+    before = (repr(tango_match.MATCH_STATS.categories), repr(tango_match.MATCH_STATS.counters))
+
+    # b.pdf's 1500000078 is one edit from 1500000077 (and two from the taken 1500000001)
+    assert tango_match.fuzzy_rematch_unmatched(results, awbs, invoices, index) == 1
+    assert (repr(tango_match.MATCH_STATS.categories), repr(tango_match.MATCH_STATS.counters)) == before
+
+    (correction,) = results[1]["matched_invoices"][0]["details"]["fuzzy_corrections"]
+    assert correction["invoice_number"] == "1500000077"
+
+
+def test_fuzzy_never_corrects_to_a_taken_invoice():
+    if tango_match.fuzz_process is None or tango_match.np is None:
+        pytest.skip("rapidfuzz/numpy not installed")
+
+    # b.pdf's 1500000007 is one edit from 1500000001, which a.pdf already matched
+    results, awbs, invoices, index = _fuzzy_case()
+    assert tango_match.fuzzy_rematch_unmatched(results, awbs, invoices, index) == 0
+    assert not results[1]["matched_invoices"]
+    assert [m["invoice_number"] for m in results[0]["matched_invoices"]] == ["1500000001"]
+
+
+def test_second_chance_passes_only_try_selected_awbs():
+    if tango_match.fuzz_process is None or tango_match.np is None:
+        pytest.skip("rapidfuzz/numpy not installed")
+
+    results, awbs, invoices, index = _fuzzy_case("1500000077", b_number="1500000078")
+    assert tango_match.fuzzy_rematch_unmatched(results, awbs, invoices, index, {"a.pdf"}) == 0
+    assert tango_match.consolidate_unmatched_groups(results, awbs, invoices, index, {"a.pdf"}) == 0
+    assert not results[1]["matched_invoices"]
+
+    assert tango_match.fuzzy_rematch_unmatched(results, awbs, invoices, index, {"b.pdf"}) == 1
+
+
+def _run(tmp_path, monkeypatch, out_dir, incremental):
+    monkeypatch.setattr(tango_match, "AWB_PATH", str(tmp_path / "awb_all_output.txt"))
+    monkeypatch.setattr(tango_match, "INV_PATH", str(tmp_path / "invoice_all_output.txt"))
+    monkeypatch.setattr(tango_match, "OUT_DIR", str(out_dir))
+    tango_match.run_matching(argparse.Namespace(incremental=incremental, workers=1, no_fuzzy=False,
+                                                no_consolidation=False))
+    with open(out_dir / "matched_results.json", "r", encoding="utf-8") as f:
+        return {r["awb_file"]: sorted(m["invoice_number"] for m in r["matched_invoices"]) for r in json.load(f)}
+
+
+def test_incremental_reopens_for_fuzzy_and_consolidation(tmp_path, monkeypatch):
+    if tango_match.fuzz_process is None or tango_match.np is None:
+        pytest.skip("rapidfuzz/numpy not installed")
+
+    awb_path, inv_path = str(tmp_path / "awb_all_output.txt"), str(tmp_path / "invoice_all_output.txt")
+
+    def invoice(name, number, pieces, weight):
+        append_record(inv_path, {"_source_file": name, "_timestamp": "t", "invoice": {
+            "invoice_number": number, "no_pieces": pieces, "gross_weight": weight, "invoice_date": "28-02-2026"}})
+
+    # Stored first: an AWB with an OCR'd number, a GROUP AWB listing only one of its two invoices
+    append_record(awb_path, {"_source_file": "fuzzy.pdf", "_timestamp": "t", "awb": {
+        "classification": {"category": "MBAG Production Parts"}, "invoice_numbers": ["1500000007"],
+        "no_pieces": 2, "gross_weight": 20.0}})
+    append_record(awb_path, {"_source_file": "group.pdf", "_timestamp": "t", "awb": {
+        "classification": {"category": "MBUSI"}, "invoice_numbers": ["4900000001"],
+        "no_pieces": 5, "gross_weight": 50.0, "executed_on_date": "01-03-2026"}})
+    invoice("g1.pdf", "4900000001", 2, 20.0)
+
+    first = tmp_path / "out"
+    first.mkdir()
+    assert not any(_run(tmp_path, monkeypatch, first, incremental=True).values())
+
+    # Later: the invoice one digit off, and the one completing the group
+    invoice("f.pdf", "1500000001", 2, 20.0)
+    invoice("g2.pdf", "4900000777", 3, 30.0)
+
+    full = tmp_path / "full"
+    shutil.copytree(first, full)
+    expected = _run(tmp_path, monkeypatch, full, incremental=False)
+    assert expected == {"fuzzy.pdf": ["1500000001"], "group.pdf": ["4900000001", "4900000777"]}
+
+    assert _run(tmp_path, monkeypatch, first, incremental=True) == expected
@@ -0,0 +1,24 @@
+import tango_pages
+
+
+def test_signature_names_the_scorer_in_use(monkeypatch):
+    monkeypatch.setattr(tango_pages, "PAGE_SELECT_MODE", "embedding")
+    monkeypatch.setattr(tango_pages, "_embedding_installed", lambda: True)
+    monkeypatch.setattr(tango_pages, "_embedding_error", None)
+    embedding = tango_pages.selection_signature()
+    assert ":embedding:" in embedding
+
+    # The embedding scorer failed (no model download, ...): pages are picked by keywords now
+    monkeypatch.setattr(tango_pages, "_embedding_error", OSError("no model"))
+    keyword = tango_pages.selection_signature()
+    assert ":keyword:" in keyword
+
+    monkeypatch.setattr(tango_pages, "PAGE_SELECT_MODE", "keyword")
+    assert tango_pages.selection_signature() == keyword
+
+
+def test_embedding_not_installed_signs_as_keyword(monkeypatch):
+    monkeypatch.setattr(tango_pages, "PAGE_SELECT_MODE", "embedding")
+    monkeypatch.setattr(tango_pages, "_embedding_error", None)
+    monkeypatch.setattr(tango_pages, "_embedding_installed", lambda: False)
+    assert tango_pages.scorer_in_use() == "keyword"
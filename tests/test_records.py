@@ -0,0 +1,36 @@
+from tango_records import append_record, find_records, index_path, latest_record_for_source, tail_records
+
+
+def _store(tmp_path, count):
+    path = str(tmp_path / "awb_all_output.txt")
+    for k in range(count):
+        append_record(path, {"_source_file": f"a{k}.pdf", "_timestamp": str(k),
+                             "awb": {"hawb": f"FRA{k % 3:08d}"}})
+    return path
+
+
+def test_find_and_tail_through_index(tmp_path):
+    path = _store(tmp_path, 10)
+
+    assert [r["_source_file"] for r in find_records(path, " FRA00000001 ")] == ["a1.pdf", "a4.pdf", "a7.pdf"]
+    assert [r["_source_file"] for r in tail_records(path, 3)] == ["a7.pdf", "a8.pdf", "a9.pdf"]
+    assert tail_records(path, 0) == []
+
+
+def test_records_appended_without_index_are_found(tmp_path):
+    path = _store(tmp_path, 2)
+    with open(index_path(path), "r", encoding="utf-8") as f:
+        first = f.readline()
+    with open(index_path(path), "w", encoding="utf-8") as f:
+        f.write(first)   # second record written by a writer that does not index
+
+    assert [r["_source_file"] for r in tail_records(path, 5)] == ["a0.pdf", "a1.pdf"]
+
+
+def test_latest_record_for_source(tmp_path):
+    path = _store(tmp_path, 3)
+    append_record(path, {"_source_file": "a1.pdf", "_timestamp": "9", "awb": {"hawb": "FRA00000009"}})
+
+    assert latest_record_for_source(path, "a1.pdf")["_timestamp"] == "9"
+    assert latest_record_for_source(path, "a0.pdf")["_timestamp"] == "0"
+    assert latest_record_for_source(path, "x.pdf") is None
@@ -0,0 +1,37 @@
+import os
+import re
+
+import pytest
+
+import tango_startup
+from tango_startup import BUDGETS_MS, HERE, check_entry_point
+
+MISSING_MODULE = re.compile(r"ModuleNotFoundError: No module named '([^'.]+)")
+
+# Wall-clock budgets depend on the machine and its load: opt in with TANGO_STARTUP_BUDGET=1
+CHECK_BUDGET = os.getenv("TANGO_STARTUP_BUDGET", "").strip().lower() in {"1", "true", "yes"}
+
+
+def _check(name, repeat, budget_ms):
+    result = check_entry_point(name, repeat=repeat, budget_ms=budget_ms)
+
+    missing = MISSING_MODULE.search(result.get("error", ""))
+    if missing and not os.path.exists(os.path.join(HERE, missing.group(1) + ".py")):
+        pytest.skip(f"{missing.group(1)} not installed")
+
+    tango_startup.print_result(result, top=10)
+    return result
+
+
+@pytest.mark.parametrize("name", sorted(BUDGETS_MS))
+def test_entry_point_defers_heavy_imports(name):
+    result = _check(name, repeat=1, budget_ms=float("inf"))
+    assert "error" not in result
+    assert not result["eager"]
+
+
+@pytest.mark.skipif(not CHECK_BUDGET, reason="set TANGO_STARTUP_BUDGET=1 to check import times")
+@pytest.mark.parametrize("name", sorted(BUDGETS_MS))
+def test_entry_point_import_budget(name):
+    result = _check(name, repeat=3, budget_ms=BUDGETS_MS[name])
+    assert not result["problems"]
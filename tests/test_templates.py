@@ -0,0 +1,150 @@
+from tango_templates import MIN_EMPTY_SAMPLES, MIN_SAMPLES, TemplateStore
+
+PAGE = (595.0, 842.0)
+KINDS = {"shipper_name": "str", "hawb": "str", "no_pieces": "int"}
+LABELS = ["Shipper", "Consignee", "Airport", "Departure", "Destination", "Pieces",
+          "Weight", "Invoice", "Reference", "Executed", "Signature", "Carrier"]
+
+
+def words(hawb, pieces, shipper=None):
+    w = [(10, 10 + 20 * k, 60, 18 + 20 * k, label, k, 0, 0) for k, label in enumerate(LABELS)]
+    w.append((100, 50, 190, 58, hawb, 20, 0, 0))
+    w.append((100, 110, 120, 118, str(pieces), 21, 0, 0))
+    if shipper:
+        w.append((100, 10, 200, 18, shipper, 22, 0, 0))
+    return w
+
+
+def values(hawb, pieces):
+    return {"shipper_name": "ACME", "hawb": hawb, "no_pieces": pieces}
+
+
+def test_learn_with_field_missing_from_first_sample(tmp_path):
+    store = TemplateStore(str(tmp_path / "templates.json"))
+
+    # Shipper not printed on the first sample: no entry yet, and no crash on the next ones
+    ids = {
+        store.learn(words("FRA12345678", 3), PAGE, values("FRA12345678", 3), KINDS),
+        store.learn(words("FRA22345678", 5, "ACME"), PAGE, values("FRA22345678", 5), KINDS),
+        store.learn(words("FRA32345678", 7, "ACME"), PAGE, values("FRA32345678", 7), KINDS),
+    }
+    assert len(ids) == 1
+
+    (template,) = store.load()
+    assert template["samples"] == 3
+    assert template["fields"]["hawb"]["hits"] == 3
+    assert template["fields"]["shipper_name"] == {"box": [100, 10, 200, 18], "hits": 2, "misses": 0}
+
+    _, read = store.extract(words("FRA42345678", 9, "ACME"), PAGE, KINDS)
+    assert read == {"shipper_name": "ACME", "hawb": "FRA42345678", "no_pieces": 9}
+
+
+def test_field_missing_after_it_was_learned_is_a_miss(tmp_path):
+    store = TemplateStore(str(tmp_path / "templates.json"))
+
+    for n in range(MIN_SAMPLES):
+        store.learn(words(f"FRA{n}2345678", 3 + n, "ACME"), PAGE, values(f"FRA{n}2345678", 3 + n), KINDS)
+    store.learn(words("FRA92345678", 9), PAGE, values("FRA92345678", 9), KINDS)
+
+    (template,) = store.load()
+    assert template["fields"]["shipper_name"]["misses"] == 1
+    _, read = store.extract(words("FRA82345678", 8, "ACME"), PAGE, KINDS)
+    assert "shipper_name" not in read
+
+
+def test_stored_none_box_counts_as_miss(tmp_path):
+    store = TemplateStore(str(tmp_path / "templates.json"))
+    store.learn(words("FRA12345678", 3, "ACME"), PAGE, values("FRA12345678", 3), KINDS)
+
+    # Written by an older version
+    store._update(lambda templates: templates[0]["fields"].update(
+        shipper_name={"box": None, "hits": 0, "misses": 1}))
+
+    store.learn(words("FRA22345678", 5, "ACME"), PAGE, values("FRA22345678", 5), KINDS)
+    (template,) = store.load()
+    assert template["samples"] == 2
+    assert template["fields"]["shipper_name"]["misses"] == 2
+
+
+def test_failed_save_leaves_cache_unchanged(tmp_path, monkeypatch):
+    store = TemplateStore(str(tmp_path / "templates.json"))
+    store.learn(words("FRA12345678", 3, "ACME"), PAGE, values("FRA12345678", 3), KINDS)
+
+    def fail(templates):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(store, "_save", fail)
+    try:
+        store.learn(words("FRA22345678", 5, "ACME"), PAGE, values("FRA22345678", 5), KINDS)
+    except OSError:
+        pass
+
+    (template,) = store.load()
+    assert template["samples"] == 1
+
+
+FULL_KINDS = dict(KINDS, goods_name="str", other_reference_numbers="list")
+
+
+def test_template_reads_every_field_incl_empty_and_list(tmp_path):
+    store = TemplateStore(str(tmp_path / "templates.json"))
+
+    def sample(n):
+        refs = [f"REF{n}01", f"REF{n}02"]
+        w = words(f"FRA{n}2345678", 3 + n, "ACME")
+        w += [(100, 190, 140, 198, refs[0] + ",", 23, 0, 0), (145, 190, 185, 198, refs[1], 23, 0, 1)]
+        return w, dict(values(f"FRA{n}2345678", 3 + n), goods_name="", other_reference_numbers=refs)
+
+    for n in range(max(MIN_SAMPLES, MIN_EMPTY_SAMPLES)):
+        w, v = sample(n)
+        store.learn(w, PAGE, v, FULL_KINDS)
+
+    (template,) = store.load()
+    assert template["empty"]["goods_name"] == {"value": "", "samples": MIN_EMPTY_SAMPLES}
+    assert template["fields"]["other_reference_numbers"]["hits"] == MIN_EMPTY_SAMPLES
+
+    w, expected = sample(7)
+    _, read = store.extract(w, PAGE, FULL_KINDS)
+    assert read == expected   # nothing left for the model
+
+
+def test_field_with_a_value_once_is_never_filled_in_empty(tmp_path):
+    store = TemplateStore(str(tmp_path / "templates.json"))
+    kinds = dict(KINDS, goods_name="str")
+
+    store.learn(words("FRA02345678", 3, "ACME"), PAGE, dict(values("FRA02345678", 3), goods_name="PARTS"), kinds)
+    for n in range(1, MIN_EMPTY_SAMPLES + 1):
+        store.learn(words(f"FRA{n}2345678", 3 + n, "ACME"), PAGE,
+                    dict(values(f"FRA{n}2345678", 3 + n), goods_name=""), kinds)
+
+    (template,) = store.load()
+    assert template["empty"]["goods_name"] is None
+    _, read = store.extract(words("FRA92345678", 9, "ACME"), PAGE, kinds)
+    assert "goods_name" not in read
+
+
+def test_only_given_fields_are_learned(tmp_path):
+    store = TemplateStore(str(tmp_path / "templates.json"))
+
+    # The fast path read hawb / no_pieces: only the model's shipper_name is passed in
+    for n in range(MIN_EMPTY_SAMPLES):
+        store.learn(words(f"FRA{n}2345678", 3 + n, "ACME"), PAGE, {"shipper_name": "ACME"}, KINDS)
+
+    (template,) = store.load()
+    assert set(template["fields"]) == {"shipper_name"}
+    assert set(template["empty"]) == {"shipper_name"}   # not hawb / no_pieces: absent is not empty
+
+
+def test_list_region_that_does_not_read_back_is_not_used(tmp_path):
+    store = TemplateStore(str(tmp_path / "templates.json"))
+    kinds = dict(KINDS, other_reference_numbers="list")
+
+    for n in range(MIN_SAMPLES):
+        w = words(f"FRA{n}2345678", 3 + n, "ACME")
+        # A stray word inside the references' box: reading it back gives three items, not two
+        w += [(100, 190, 130, 198, "A1", 23, 0, 0), (132, 190, 150, 198, "see", 23, 0, 1),
+              (152, 190, 180, 198, "B2", 23, 0, 2)]
+        store.learn(w, PAGE, dict(values(f"FRA{n}2345678", 3 + n), other_reference_numbers=["A1", "B2"]), kinds)
+
+    (template,) = store.load()
+    assert "other_reference_numbers" not in template["fields"]
@@ -2,9 +2,16 @@ import time
 import os
 import subprocess
 import sys
+import importlib
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 
+from dotenv import load_dotenv
+load_dotenv()
+
 # ---------------- CONFIG ----------------
 AWB_FOLDER = r"C:\Users\HEKOLLI\OneDrive - Mercedes-Benz (corpdir.onmicrosoft.com)\DWT_TANGO - Documents\AWB"
 INVOICE_FOLDER = r"C:\Users\HEKOLLI\OneDrive - Mercedes-Benz (corpdir.onmicrosoft.com)\DWT_TANGO - Documents\Invoice"
@@ -16,6 +23,10 @@ INVOICE_PROCESSED = os.path.join(INVOICE_FOLDER, "Processed")
 # Process scripts (you'll need to create these)
 PROCESS_AWB_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "process_awb.py")
 PROCESS_INVOICE_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "process_invoice.py")
+
+# Long-lived extraction workers (0 = old mode: one python subprocess per file)
+EXTRACT_WORKERS = int(os.getenv("TANGO_EXTRACT_WORKERS", "2"))
+EXTRACTOR_MODULES = {"awb": "process_awb", "invoice": "process_invoice"}
 # ----------------------------------------
 
 # Ensure processed folders exist
@@ -27,9 +38,69 @@ for folder in [AWB_FOLDER, INVOICE_FOLDER]:
     if not os.path.isdir(folder):
         raise Exception(f"Folder does not exist: {folder}")
 
+# ---------------- WORKER POOL ----------------
+def _init_extract_worker():
+    # langchain, cv2, pytesseract, PyMuPDF and the Gemini clients load here,
+    # once per worker, instead of once per PDF (the extractors import them lazily)
+    for module in EXTRACTOR_MODULES.values():
+        importlib.import_module(module).preload()
+
+
+def _extract_in_worker(folder_type, file_path, processed_folder):
+    # Both extractors return True / False; they only raise on a bug outside their own try
+    module = importlib.import_module(EXTRACTOR_MODULES[folder_type])
+    return module.process_file(file_path, processed_folder)
+
+
+class ExtractionPool:
+    """Pre-started worker processes; files queue up and run on whichever worker is free."""
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.lock = threading.Lock()
+        self.executor = self._start()
+
+    def _start(self):
+        executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_extract_worker)
+        # Start every worker now so the imports are paid before the first file arrives
+        for _ in range(self.workers):
+            executor.submit(int)
+        return executor
+
+    def submit(self, folder_type, file_path, processed_folder):
+        with self.lock:
+            try:
+                future = self.executor.submit(_extract_in_worker, folder_type, file_path, processed_folder)
+            except BrokenProcessPool:
+                print("[POOL] A worker died → restarting the pool")
+                self.executor = self._start()
+                future = self.executor.submit(_extract_in_worker, folder_type, file_path, processed_folder)
+
+        future.add_done_callback(lambda f: self._report(folder_type, file_path, f))
+
+    def _report(self, folder_type, file_path, future):
+        tag = folder_type.upper()
+        name = os.path.basename(file_path)
+        try:
+            ok = future.result()
+        except BrokenProcessPool:
+            print(f"[{tag}] Worker crashed while processing: {name} (file left in place)")
+        except Exception as e:
+            print(f"[{tag}] Error processing file: {name}: {e}")
+        else:
+            if not ok:
+                print(f"[{tag}] Extraction failed: {name} (file left in place)")
+            else:
+                print(f"[{tag}] Successfully processed: {name}")
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+
 class TangoFileHandler(FileSystemEventHandler):
-    def __init__(self, folder_type):
+    def __init__(self, folder_type, pool=None):
         self.folder_type = folder_type  # 'awb' or 'invoice'
+        self.pool = pool
         super().__init__()
 
     def on_created(self, event):
@@ -56,6 +127,10 @@ class TangoFileHandler(FileSystemEventHandler):
             script = PROCESS_INVOICE_SCRIPT
             processed_folder = INVOICE_PROCESSED
 
+        if self.pool is not None:
+            self.pool.submit(self.folder_type, file_path, processed_folder)
+            return
+
         try:
             subprocess.run(
                 [sys.executable, script, file_path, processed_folder],
@@ -66,13 +141,18 @@ class TangoFileHandler(FileSystemEventHandler):
             print(f"[{self.folder_type.upper()}] Error processing file: {e}")
 
 def start_watchers():
+    pool = None
+    if EXTRACT_WORKERS > 0:
+        pool = ExtractionPool(EXTRACT_WORKERS)
+        print(f"Started {EXTRACT_WORKERS} extraction workers")
+
     # Set up AWB watcher
-    awb_handler = TangoFileHandler('awb')
+    awb_handler = TangoFileHandler('awb', pool)
     awb_observer = Observer()
     awb_observer.schedule(awb_handler, AWB_FOLDER, recursive=False)
 
     # Set up Invoice watcher
-    invoice_handler = TangoFileHandler('invoice')
+    invoice_handler = TangoFileHandler('invoice', pool)
     invoice_observer = Observer()
     invoice_observer.schedule(invoice_handler, INVOICE_FOLDER, recursive=False)
 
@@ -93,5 +173,8 @@ def start_watchers():
     awb_observer.join()
     invoice_observer.join()
 
+    if pool is not None:
+        pool.shutdown()
+
 if __name__ == "__main__":
     start_watchers()
@@ -5,6 +5,8 @@ from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 import json
 
+from tango_records import iter_records, rebuild_index, append_lock, rewrite_lock, atomic_write, SEPARATOR_LINE
+
 # ---------------- CONFIG ----------------
 # MATCHED_RESULTS_FILE = r"C:\Users\HEKOLLI\OneDrive - Mercedes-Benz (corpdir.onmicrosoft.com)\DWT_TANGO - Documents\matched_results.txt"
 # INVOICE_ALL_OUTPUT_FILE = r"C:\Users\HEKOLLI\OneDrive - Mercedes-Benz (corpdir.onmicrosoft.com)\DWT_TANGO - Documents\invoice_all_output.txt"
@@ -13,8 +15,6 @@ MATCHED_RESULTS_FILE = r"C:\Users\SONIARN\OneDrive - Mercedes-Benz (corpdir.onmi
 INVOICE_ALL_OUTPUT_FILE = r"C:\Users\SONIARN\OneDrive - Mercedes-Benz (corpdir.onmicrosoft.com)\DWT_TANGO - Documents\invoice_all_output.txt"
 AWB_ALL_OUTPUT_FILE = r"C:\Users\SONIARN\OneDrive - Mercedes-Benz (corpdir.onmicrosoft.com)\DWT_TANGO - Documents\awb_all_output.txt"
 
-SEPARATOR_LINE = "-" * 80
-
 # AWB behavior toggle
 KEEP_AWB = "LAST"   # "FIRST" or "LAST"
 # ----------------------------------------
@@ -25,8 +25,16 @@ class MatchedResultsHandler(FileSystemEventHandler):
         if event.is_directory:
             return
 
-        src_path = os.path.abspath(event.src_path)
+        self.dispatch_cleanup(os.path.abspath(event.src_path))
+
+    def on_moved(self, event):
+        # tango_match (and the cleaners below) replace files via temp file + rename
+        if event.is_directory:
+            return
+
+        self.dispatch_cleanup(os.path.abspath(event.dest_path))
 
+    def dispatch_cleanup(self, src_path):
         if src_path == os.path.abspath(MATCHED_RESULTS_FILE):
             self.clean_matched_file(MATCHED_RESULTS_FILE)
 
@@ -91,7 +99,11 @@ class MatchedResultsHandler(FileSystemEventHandler):
         if inside_invoice_block:
             flush_invoice_block()
 
-        with open(file_path, "w", encoding="utf-8") as f:
+        # Nothing removed → leave the file alone (our own rewrite re-triggers the watcher)
+        if cleaned_lines == lines:
+            return
+
+        with atomic_write(file_path) as f:
             f.writelines(cleaned_lines)
 
     # ------------------------------------------------------------------
@@ -101,47 +113,34 @@ class MatchedResultsHandler(FileSystemEventHandler):
         if not os.path.exists(file_path):
             return
 
-        with open(file_path, "r", encoding="utf-8") as f:
-            lines = f.readlines()
+        # Readers finish first; extractor appends wait until the rewrite is done
+        with rewrite_lock(file_path), append_lock(file_path):
+            invoices = {}
+            total = 0
 
-        json_blocks = []
-        buffer = []
-        brace_count = 0
+            for data in iter_records(file_path):
+                total += 1
+                try:
+                    invoice_no = data["invoice"]["invoice_number"]
 
-        for line in lines:
-            if line.strip() == SEPARATOR_LINE:
-                continue
+                    if invoice_no not in invoices:
+                        invoices[invoice_no] = data
+                    else:
+                        print(f"[INVOICE_OUTPUT] Removed duplicate invoice {invoice_no}")
+                except Exception:
+                    pass
+
+            if len(invoices) == total:
+                return
+
+            with atomic_write(file_path) as f:
+                for invoice in invoices.values():
+                    f.write(SEPARATOR_LINE + "\n")
+                    f.write(json.dumps(invoice, indent=2))
+                    f.write("\n\n")
 
-            for char in line:
-                if char == "{":
-                    brace_count += 1
-                if brace_count > 0:
-                    buffer.append(char)
-                if char == "}":
-                    brace_count -= 1
-                    if brace_count == 0:
-                        json_blocks.append("".join(buffer))
-                        buffer = []
-
-        invoices = {}
-
-        for block in json_blocks:
-            try:
-                data = json.loads(block)
-                invoice_no = data["invoice"]["invoice_number"]
-
-                if invoice_no not in invoices:
-                    invoices[invoice_no] = data
-                else:
-                    print(f"[INVOICE_OUTPUT] Removed duplicate invoice {invoice_no}")
-            except Exception:
-                pass
-
-        with open(file_path, "w", encoding="utf-8") as f:
-            for invoice in invoices.values():
-                f.write(SEPARATOR_LINE + "\n")
-                f.write(json.dumps(invoice, indent=2))
-                f.write("\n\n")
+            # Record offsets moved → refresh the sidecar index
+            rebuild_index(file_path)
 
     # ------------------------------------------------------------------
     # PART 3 : AWB OUTPUT (FIRST / LAST TOGGLE)
@@ -150,57 +149,43 @@ class MatchedResultsHandler(FileSystemEventHandler):
         if not os.path.exists(file_path):
             return
 
-        with open(file_path, "r", encoding="utf-8") as f:
-            lines = f.readlines()
+        with rewrite_lock(file_path), append_lock(file_path):
+            awb_records = {}
+            total = 0
 
-        json_blocks = []
-        buffer = []
-        brace_count = 0
+            for data in iter_records(file_path):
+                total += 1
+                try:
+                    awb = data.get("awb", {})
 
-        for line in lines:
-            if line.strip() == SEPARATOR_LINE:
-                continue
+                    hawb = awb.get("hawb", "").strip()
+                    invoice_numbers = tuple(sorted(awb.get("invoice_numbers", [])))
+                    vin_no = awb.get("vin_no", "").strip()
+
+                    key = (hawb, invoice_numbers, vin_no)
 
-            for char in line:
-                if char == "{":
-                    brace_count += 1
-                if brace_count > 0:
-                    buffer.append(char)
-                if char == "}":
-                    brace_count -= 1
-                    if brace_count == 0:
-                        json_blocks.append("".join(buffer))
-                        buffer = []
-
-        awb_records = {}
-
-        for block in json_blocks:
-            try:
-                data = json.loads(block)
-                awb = data.get("awb", {})
-
-                hawb = awb.get("hawb", "").strip()
-                invoice_numbers = tuple(sorted(awb.get("invoice_numbers", [])))
-                vin_no = awb.get("vin_no", "").strip()
-
-                key = (hawb, invoice_numbers, vin_no)
-
-                if key not in awb_records:
-                    awb_records[key] = data
-                else:
-                    if KEEP_AWB == "LAST":
+                    if key not in awb_records:
                         awb_records[key] = data
-                        print(f"[AWB_OUTPUT] Removed earlier duplicate AWB {key}")
                     else:
-                        print(f"[AWB_OUTPUT] Removed later duplicate AWB {key}")
-            except Exception:
-                pass
-
-        with open(file_path, "w", encoding="utf-8") as f:
-            for awb_json in awb_records.values():
-                f.write(SEPARATOR_LINE + "\n")
-                f.write(json.dumps(awb_json, indent=2))
-                f.write("\n\n")
+                        if KEEP_AWB == "LAST":
+                            awb_records[key] = data
+                            print(f"[AWB_OUTPUT] Removed earlier duplicate AWB {key}")
+                        else:
+                            print(f"[AWB_OUTPUT] Removed later duplicate AWB {key}")
+                except Exception:
+                    pass
+
+            if len(awb_records) == total:
+                return
+
+            with atomic_write(file_path) as f:
+                for awb_json in awb_records.values():
+                    f.write(SEPARATOR_LINE + "\n")
+                    f.write(json.dumps(awb_json, indent=2))
+                    f.write("\n\n")
+
+            # Record offsets moved → refresh the sidecar index
+            rebuild_index(file_path)
 
 
 def start_watcher():